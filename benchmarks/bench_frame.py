@@ -0,0 +1,72 @@
+"""
+Microbenchmark of frame decoding: the zero-copy decoder against the old, copying
+NGTTFrame.from_bytes.
+
+Run with:
+
+    PYTHONPATH=. python benchmarks/bench_frame.py
+"""
+import timeit
+import tracemalloc
+
+from ngtt.protocol import NGTTHeaderType, STRUCT_LHH, NGTTFrame, NGTTFrameDecoder
+
+FRAMES_IN_BURST = 1000
+PAYLOAD = b'{"uuid": "1234", "data": [1, 2, 3]}' * 4
+BURST = (STRUCT_LHH.pack(len(PAYLOAD), 5, NGTTHeaderType.ORDER.value) + PAYLOAD) * FRAMES_IN_BURST
+
+
+class LegacyFrame:
+    def __init__(self, tid, packet_type, data):
+        self.tid = tid
+        self.packet_type = packet_type
+        self.data = data
+
+
+def legacy_from_bytes(b):
+    length, tid, h_type = STRUCT_LHH.unpack(b[:STRUCT_LHH.size])
+    return LegacyFrame(tid, NGTTHeaderType(h_type), b[STRUCT_LHH.size:STRUCT_LHH.size + length])
+
+
+def decode_legacy():
+    buffer = bytearray(BURST)
+    frames = []
+    while len(buffer) >= STRUCT_LHH.size:
+        frame = legacy_from_bytes(buffer)
+        del buffer[:STRUCT_LHH.size + len(frame.data)]
+        frames.append(frame)
+    return frames
+
+
+def decode_from_bytes():
+    view = memoryview(BURST)
+    frames = []
+    while view:
+        frame = NGTTFrame.from_bytes(view)
+        view = view[len(frame):]
+        frames.append(frame)
+    return frames
+
+
+def decode_streaming():
+    decoder = NGTTFrameDecoder(len(BURST))
+    decoder.feed(BURST)
+    return list(decoder.frames())
+
+
+def peak_memory(fun) -> int:
+    tracemalloc.start()
+    fun()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == '__main__':
+    for name, fun in (('legacy from_bytes', decode_legacy),
+                      ('zero-copy from_bytes', decode_from_bytes),
+                      ('NGTTFrameDecoder', decode_streaming)):
+        assert len(fun()) == FRAMES_IN_BURST
+        took = min(timeit.repeat(fun, number=20, repeat=5)) / 20
+        print('%-22s %8.1f ns/frame %10d bytes peak per burst' % (
+            name, took / FRAMES_IN_BURST * 1e9, peak_memory(fun)))
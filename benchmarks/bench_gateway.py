@@ -0,0 +1,61 @@
+"""
+Scaling benchmark of NGTTGateway: 1 to 1000 devices against a local stand-in server,
+which runs in a separate process so that it doesn't skew the measurements.
+
+For every amount of devices this reports the time it took for all of them to connect and
+sync a single DATA_STREAM, the thread count and the resident memory of the client.
+
+Run with:
+
+    PYTHONPATH=. python benchmarks/bench_gateway.py
+"""
+import multiprocessing
+import sys
+import threading
+import time
+
+import psutil
+
+from ngtt.testing import NGTTTestServer, TestCertificates
+from ngtt.uplink import NGTTGateway
+
+DEVICE_COUNTS = (1, 10, 100, 1000)
+
+
+def run_server(certificates: TestCertificates, port_queue: multiprocessing.Queue) -> None:
+    server = NGTTTestServer(certificates)
+    port_queue.put(server.port)
+    server.join()
+
+
+def main() -> None:
+    certificates = TestCertificates()
+    devices = [certificates.device('device-%s' % (i,)) for i in range(max(DEVICE_COUNTS))]
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=run_server, args=(certificates, port_queue),
+                                     daemon=True)
+    server.start()
+    port = port_queue.get()
+    process = psutil.Process()
+
+    print('%8s %12s %8s %10s' % ('devices', 'sync time', 'threads', 'RSS MiB'))
+    for count in DEVICE_COUNTS:
+        rss_before = process.memory_info().rss
+        started_at = time.monotonic()
+        gateway = NGTTGateway()
+        connected = [gateway.add_device(cert_file, key_file, lambda order: None,
+                                        host='localhost', port=port,
+                                        ca_file=certificates.ca_file)
+                     for cert_file, key_file in devices[:count]]
+        for fut in [device.sync_pathpoints([]) for device in connected]:
+            fut.result(timeout=120)
+        took = time.monotonic() - started_at
+        print('%8s %11.2fs %8s %10.1f' % (count, took, threading.active_count(),
+                                          (process.memory_info().rss - rss_before) / 2 ** 20))
+        sys.stdout.flush()
+        gateway.stop()
+    server.terminate()
+
+
+if __name__ == '__main__':
+    main()
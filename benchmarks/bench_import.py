@@ -0,0 +1,55 @@
+"""
+Measures how long importing ngtt.uplink takes, with python -X importtime, and lists the
+modules that take longest. With --budget, exits with status 1 if the import takes longer
+than that many milliseconds, so that it can guard CI against slow imports creeping in.
+
+Run with:
+
+    PYTHONPATH=. python benchmarks/bench_import.py [--budget 250]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+MODULE = 'ngtt.uplink'
+RUNS = 5
+TOP = 10
+
+
+def import_times() -> dict:
+    """
+    :return: module name => cumulative import time in microseconds
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + MODULE],
+                            stderr=subprocess.PIPE, check=True,
+                            universal_newlines=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget', type=float, help='maximum import time in milliseconds')
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(RUNS)]
+    total = statistics.median(run[MODULE] for run in runs) / 1000
+    print('import %s: %.1f ms (median of %s runs)' % (MODULE, total, RUNS))
+    for name, cumulative in sorted(runs[-1].items(), key=lambda item: -item[1])[1:TOP + 1]:
+        print('    %-50s %8.1f ms' % (name, cumulative / 1000))
+    for heavy in ('cryptography', 'pyasn1', 'pkg_resources'):
+        if heavy in runs[-1]:
+            print('%s is imported eagerly' % (heavy,))
+    if args.budget is not None and total > args.budget:
+        print('Over the budget of %s ms' % (args.budget,))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Benchmark of memory taken by a device that keeps being given DATA_STREAMs while the
+server is unreachable, without a budget and with a MemoryBudget of every policy.
+
+Run with:
+
+    PYTHONPATH=. python benchmarks/bench_overload.py
+"""
+import tempfile
+import time
+import tracemalloc
+
+from ngtt.exceptions import Overloaded
+from ngtt.testing import TestCertificates
+from ngtt.uplink import NGTTConnection
+from ngtt.uplink.budget import MemoryBudget, BLOCK, FAIL, SPILL
+
+OPERATIONS = 20000
+ENTRY = [{'path': 'W1', 'values': [{'timestamp': 0, 'value': 'x' * 1000}]}]
+MAX_BYTES = 1024 * 1024
+
+
+def run(certificates: TestCertificates, budget) -> None:
+    tracemalloc.start()
+    conn = NGTTConnection(*certificates.device('overload'), lambda order: None,
+                          host='localhost', port=1, ca_file=certificates.ca_file,
+                          journal_directory=tempfile.mkdtemp(), budget=budget)
+    rejected = 0
+    started_at = time.monotonic()
+    for _ in range(OPERATIONS):
+        fut = conn.sync_pathpoints(ENTRY)
+        if fut.done() and isinstance(fut.exception(), Overloaded):
+            rejected += 1
+    took = time.monotonic() - started_at
+    while len(conn.outbox):
+        time.sleep(0.01)
+    peak = tracemalloc.get_traced_memory()[1]
+    conn.stop()
+    tracemalloc.stop()
+    print('%-8s %8.1f ms to submit %10d bytes peak %6d rejected' % (
+        'none' if budget is None else budget.policy, took * 1e3, peak, rejected))
+
+
+if __name__ == '__main__':
+    certificates = TestCertificates()
+    run(certificates, None)
+    for policy in (FAIL, SPILL):
+        run(certificates, MemoryBudget(MAX_BYTES, policy))
+    run(certificates, MemoryBudget(MAX_BYTES, BLOCK, block_timeout=0))
@@ -0,0 +1,44 @@
+"""
+Benchmark of encoding a large upload of a single pathpoint: a list of dicts against
+a PathpointSeries built from array.array columns.
+
+Run with:
+
+    PYTHONPATH=. python benchmarks/bench_series.py
+"""
+import array
+import timeit
+import tracemalloc
+
+from ngtt.uplink.device import encode_data
+from ngtt.uplink.series import PathpointSeries
+
+SAMPLES = 100000
+TIMESTAMPS = array.array('q', range(1600000000000, 1600000000000 + SAMPLES))
+VALUES = array.array('f', (i / 4 for i in range(SAMPLES)))
+
+
+def encode_dicts():
+    return encode_data([{'path': 'W1', 'values': [
+        {'timestamp': timestamp, 'value': value}
+        for timestamp, value in zip(TIMESTAMPS, VALUES)]}])
+
+
+def encode_series():
+    return encode_data([PathpointSeries('W1', TIMESTAMPS, VALUES)])
+
+
+def peak_memory(fun) -> int:
+    tracemalloc.start()
+    fun()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == '__main__':
+    for name, fun in (('list of dicts', encode_dicts),
+                      ('PathpointSeries', encode_series)):
+        took = min(timeit.repeat(fun, number=5, repeat=3)) / 5
+        print('%-16s %8.1f ms per upload %10d bytes peak %10d bytes encoded' % (
+            name, took * 1e3, peak_memory(fun), len(fun())))
@@ -0,0 +1,48 @@
+"""
+Benchmark of uploading a large backlog of pathpoint entries: encoding a list of them
+against streaming them with a PathpointStream, which is what the connection does
+with them.
+
+Run with:
+
+    PYTHONPATH=. python benchmarks/bench_streaming.py
+"""
+import timeit
+import tracemalloc
+
+from ngtt.uplink.device import encode_data
+from ngtt.uplink.streaming import PathpointStream
+
+ENTRIES = 200000
+
+
+class Backlog:
+    def __iter__(self):
+        for i in range(ENTRIES):
+            yield {'path': 'W%s' % (i % 100,), 'values': [
+                {'timestamp': 1600000000000 + i, 'value': i / 4}]}
+
+
+def send_list() -> int:
+    return len(encode_data(list(Backlog())))
+
+
+def send_stream() -> int:
+    stream = PathpointStream(Backlog())
+    return sum(len(chunk) for chunk in stream.chunks())
+
+
+def peak_memory(fun) -> int:
+    tracemalloc.start()
+    fun()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == '__main__':
+    for name, fun in (('list', send_list),
+                      ('PathpointStream', send_stream)):
+        took = min(timeit.repeat(fun, number=1, repeat=3))
+        print('%-16s %8.1f ms per upload %10d bytes peak %10d bytes sent' % (
+            name, took * 1e3, peak_memory(fun), fun()))
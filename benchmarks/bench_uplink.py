@@ -0,0 +1,142 @@
+"""
+End-to-end benchmark of the uplink against a local stand-in server, which runs in a
+separate process so that it doesn't skew the measurements.
+
+It reports:
+
+* DATA_STREAMs per second, submitted all at once and confirmed by the server
+* round-trip time percentiles of DATA_STREAMs submitted one at a time
+* how long it takes to receive and handle a burst of ORDERs
+* how long it takes to reconnect after the server drops the connection
+* memory allocated per connection of a gateway
+
+Run with:
+
+    PYTHONPATH=. python benchmarks/bench_uplink.py
+"""
+import multiprocessing
+import threading
+import time
+import tracemalloc
+import typing as tp
+
+from ngtt.testing import NGTTTestServer, TestCertificates
+from ngtt.uplink import NGTTConnection, NGTTGateway
+
+THROUGHPUT_OPS = 20000
+ROUND_TRIPS = 2000
+ORDER_BURST = 10000
+RECONNECTS = 20
+GATEWAY_DEVICES = 100
+
+
+def run_server(certificates: TestCertificates, port_queue: multiprocessing.Queue,
+               commands: multiprocessing.Queue) -> None:
+    server = NGTTTestServer(certificates)
+    port_queue.put(server.port)
+    while True:
+        command, arg = commands.get()
+        if command == 'orders':
+            for i in range(arg):
+                server.send_order({'uuid': str(i)})
+        elif command == 'drop':
+            server.call_soon(lambda: [server.drop(client) for client in list(server.clients)])
+
+
+def percentile(values: tp.List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def bench_throughput(conn: NGTTConnection) -> None:
+    started_at = time.monotonic()
+    for fut in [conn.sync_pathpoints([]) for _ in range(THROUGHPUT_OPS)]:
+        fut.result(timeout=60)
+    took = time.monotonic() - started_at
+    print('DATA_STREAM throughput: %.0f ops/s (%s ops in %.2f s)' % (
+        THROUGHPUT_OPS / took, THROUGHPUT_OPS, took))
+
+
+def bench_round_trips(conn: NGTTConnection) -> None:
+    round_trips = []
+    for _ in range(ROUND_TRIPS):
+        started_at = time.monotonic()
+        conn.sync_pathpoints([]).result(timeout=10)
+        round_trips.append(time.monotonic() - started_at)
+    print('DATA_STREAM round trip: p50 %.2f ms, p90 %.2f ms, p99 %.2f ms, max %.2f ms' % tuple(
+        percentile(round_trips, q) * 1000 for q in (0.5, 0.9, 0.99, 1)))
+
+
+def bench_order_burst(conn: NGTTConnection, handled: threading.Semaphore,
+                      commands: multiprocessing.Queue) -> None:
+    started_at = time.monotonic()
+    commands.put(('orders', ORDER_BURST))
+    for _ in range(ORDER_BURST):
+        if not handled.acquire(timeout=60):
+            raise RuntimeError('Orders were not received')
+    took = time.monotonic() - started_at
+    print('ORDER burst: %s orders handled in %.2f s, %.0f orders/s' % (
+        ORDER_BURST, took, ORDER_BURST / took))
+
+
+def bench_reconnect(conn: NGTTConnection, commands: multiprocessing.Queue) -> None:
+    took = []
+    for _ in range(RECONNECTS):
+        connection = conn.current_connection
+        started_at = time.monotonic()
+        commands.put(('drop', None))
+        while conn.current_connection is connection:
+            time.sleep(0.001)
+        conn.sync_pathpoints([]).result(timeout=60)
+        took.append(time.monotonic() - started_at)
+    print('Reconnect and sync: p50 %.1f ms, max %.1f ms' % (
+        percentile(took, 0.5) * 1000, max(took) * 1000))
+
+
+def bench_memory(certificates: TestCertificates, port: int) -> None:
+    devices = [certificates.device('memory-%s' % (i,)) for i in range(GATEWAY_DEVICES)]
+    gateway = NGTTGateway()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    connected = [gateway.add_device(cert_file, key_file, lambda order: None,
+                                    host='localhost', port=port, ca_file=certificates.ca_file)
+                 for cert_file, key_file in devices]
+    for fut in [device.sync_pathpoints([]) for device in connected]:
+        fut.result(timeout=120)
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    gateway.stop()
+    print('Memory per gateway connection: %.1f KiB' % (allocated / GATEWAY_DEVICES / 1024,))
+
+
+def main() -> None:
+    certificates = TestCertificates()
+    port_queue = multiprocessing.Queue()
+    commands = multiprocessing.Queue()
+    server = multiprocessing.Process(target=run_server,
+                                     args=(certificates, port_queue, commands), daemon=True)
+    server.start()
+    port = port_queue.get()
+
+    handled = threading.Semaphore(0)
+
+    def on_new_order(order):
+        order.acknowledge()
+        handled.release()
+
+    conn = NGTTConnection(*certificates.device('benchmark'), on_new_order,
+                          host='localhost', port=port, ca_file=certificates.ca_file)
+    try:
+        conn.sync_pathpoints([]).result(timeout=10)
+        bench_throughput(conn)
+        bench_round_trips(conn)
+        bench_order_burst(conn, handled, commands)
+        bench_reconnect(conn, commands)
+    finally:
+        conn.stop()
+    bench_memory(certificates, port)
+    server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import typing as tp
+import zlib
+
+from .exceptions import InvalidFrame
+
+#: set on the packet type of a frame whose payload is compressed. Such a payload starts
+#: with the ID of the codec it was compressed with.
+COMPRESSED = 0x8000
+
+DEFAULT_THRESHOLD = 1024
+DEFAULT_OFFLOAD_THRESHOLD = 256 * 1024
+
+
+class Codec:
+    """
+    A compression algorithm. Subclass this to provide a codec of your own, and register it
+    with :func:`~ngtt.compression.register_codec` on both ends of the connection.
+
+    :cvar codec_id: ID of this codec on the wire, 1-255
+    """
+    codec_id = None  # type: int
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+    def decompress(self, data: tp.Union[bytes, memoryview]) -> bytes:
+        raise NotImplementedError()
+
+
+class ZlibCodec(Codec):
+    """
+    zlib, available everywhere
+
+    :param level: compression level, 0-9
+    """
+    codec_id = 1
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: tp.Union[bytes, memoryview]) -> bytes:
+        return zlib.decompress(data)
+
+
+CODECS = {}  # type: tp.Dict[int, Codec]
+
+
+def register_codec(codec: Codec) -> None:
+    """
+    Make it possible to decompress payloads compressed with codec
+    """
+    CODECS[codec.codec_id] = codec
+
+
+register_codec(ZlibCodec())
+
+
+class CompressedPayload(bytes):
+    """
+    A payload that is compressed: a codec ID followed by the compressed data. Frames with
+    such a payload are sent with :data:`~ngtt.compression.COMPRESSED` set on their packet
+    type.
+    """
+
+
+def wire_type(h_type: int, data: tp.Union[bytes, memoryview]) -> int:
+    """
+    Return packet type to send data with
+    """
+    return h_type | COMPRESSED if isinstance(data, CompressedPayload) else h_type
+
+
+def decompress(data: tp.Union[bytes, memoryview]) -> bytes:
+    """
+    Decompress the payload of a frame that had :data:`~ngtt.compression.COMPRESSED` set
+
+    :raises InvalidFrame: the codec is unknown, or the payload is damaged
+    """
+    if not data:
+        raise InvalidFrame('Compressed payload without a codec')
+    codec = CODECS.get(data[0])
+    if codec is None:
+        raise InvalidFrame('Unknown compression codec %s' % (data[0],))
+    try:
+        return codec.decompress(data[1:])
+    except Exception as e:
+        raise InvalidFrame('Damaged compressed payload') from e
+
+
+class Compression:
+    """
+    Opt-in compression of payloads sent to the server. The server has to support it, so
+    it's not enabled by default.
+
+    The threaded clients compress payloads in the thread that submits them, except for
+    merged logs and pathpoints, which are compressed by the thread that merges them. The
+    asyncio client compresses large payloads in the default executor.
+
+    :param codec: codec to compress with, default is zlib
+    :param threshold: payloads smaller than this many bytes are sent as they are
+    :param offload_threshold: payloads at least this large are compressed in an executor by
+        the asyncio client
+    """
+    __slots__ = ('codec', 'threshold', 'offload_threshold')
+
+    def __init__(self, codec: tp.Optional[Codec] = None, threshold: int = DEFAULT_THRESHOLD,
+                 offload_threshold: int = DEFAULT_OFFLOAD_THRESHOLD):
+        self.codec = codec or ZlibCodec()
+        self.threshold = threshold
+        self.offload_threshold = offload_threshold
+        register_codec(self.codec)
+
+    def compress(self, data: bytes) -> bytes:
+        """
+        Compress data, if it's large enough and compression makes it smaller
+
+        :return: a :class:`~ngtt.compression.CompressedPayload`, or data itself
+        """
+        if len(data) < self.threshold or isinstance(data, CompressedPayload):
+            return data
+        compressed = self.codec.compress(data)
+        if len(compressed) + 1 >= len(data):
+            return data
+        return CompressedPayload(bytes((self.codec.codec_id,)) + compressed)
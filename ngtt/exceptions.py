@@ -16,3 +16,27 @@ class DataStreamSyncFailed(NGTTError):
 
 class InvalidFrame(NGTTError):
     pass
+
+
+class StreamedPayloadFailed(InvalidFrame):
+    """
+    A streamed payload turned out to be of a different length than it claimed, or failed
+    to produce its data, halfway through being sent
+
+    :ivar tid: transaction ID of the frame that carries it
+    """
+    def __init__(self, tid: int, message: str):
+        super().__init__(message)
+        self.tid = tid
+
+
+class TidsExhausted(NGTTError):
+    """
+    Every transaction ID is in use, so nothing more can be sent until some are freed
+    """
+
+
+class Overloaded(NGTTError):
+    """
+    The operation doesn't fit in the device's :class:`~ngtt.uplink.budget.MemoryBudget`
+    """
@@ -1,7 +1,13 @@
+import collections
+import hashlib
+import time
 import typing as tp
 
 from ngtt.protocol import NGTTHeaderType
 
+DEFAULT_MAX_ORDERS = 10000
+DEFAULT_TTL = 3600
+
 
 class Order:
     """
@@ -10,18 +16,91 @@ class Order:
     Can be confirmed via :meth:`~ngtt.orders.Order.acknowledge` to signal to the server
     that it's been processed.
     """
-    __slots__ = ('data', 'tid', 'sock', 'confirmed')
+    __slots__ = ('data', 'tid', 'outbox', 'confirmed', 'duplicates')
 
-    def __init__(self, data: tp.Dict, tid: int, sock: 'NGTTSocket'):
+    def __init__(self, data: tp.Dict, tid: int, outbox: 'Outbox'):
         self.data = data
         self.tid = tid
-        self.sock = sock
+        self.outbox = outbox
         self.confirmed = False
+        self.duplicates = []  # type: tp.List[Order]
 
     def acknowledge(self):
         """
-        Signal to the server that the order has been processed
+        Signal to the server that the order has been processed. Redeliveries of this
+        order that were recognized by an :class:`~ngtt.orders.OrderCache` are acknowledged
+        as well.
+
+        This can be called from any thread.
         """
         if not self.confirmed:
-            self.sock.send_frame(self.tid, NGTTHeaderType.ORDER_CONFIRM, b'')
             self.confirmed = True
+            self.outbox.send_frame(self.tid, NGTTHeaderType.ORDER_CONFIRM, b'')
+        for duplicate in self.duplicates:
+            duplicate.acknowledge()
+
+
+class OrderCache:
+    """
+    Remembers orders received recently, so that orders delivered again, eg. because their
+    acknowledgement was lost when the connection dropped, are not handled twice.
+
+    An order is identified by its uuid, if its data has one, otherwise by its transaction
+    ID and a digest of its payload. A known order is acknowledged right away if the original
+    was already acknowledged, or as soon as the original is, and is not handled again.
+
+    Orders are remembered for ttl seconds, and at most max_orders of them are remembered,
+    forgetting the oldest ones first.
+
+    This is not thread-safe, it's meant to be used by the thread that drives the device.
+
+    :param max_orders: maximum amount of orders to remember
+    :param ttl: seconds to remember an order for
+    :ivar hits: amount of orders recognized as delivered again (int)
+    :ivar misses: amount of orders seen for the first time (int)
+    """
+    __slots__ = ('max_orders', 'ttl', 'orders', 'hits', 'misses')
+
+    def __init__(self, max_orders: int = DEFAULT_MAX_ORDERS, ttl: float = DEFAULT_TTL):
+        self.max_orders = max_orders
+        self.ttl = ttl
+        # order's key => (monotonic time to forget it at, order), oldest first
+        self.orders = collections.OrderedDict()  # type: tp.Dict[tp.Hashable, tuple]
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    @staticmethod
+    def key_for(order: Order, payload: bytes) -> tp.Hashable:
+        if isinstance(order.data, dict) and order.data.get('uuid') is not None:
+            return order.data['uuid']
+        return order.tid, hashlib.blake2b(payload, digest_size=16).digest()
+
+    def is_duplicate(self, order: Order, payload: bytes) -> bool:
+        """
+        Check whether order was received before. If it was, it will be acknowledged along
+        with the original, otherwise it's remembered.
+
+        :param order: order received
+        :param payload: the order's payload, as received
+        :return: whether it's a duplicate, which should not be handled
+        """
+        now = time.monotonic()
+        while self.orders and next(iter(self.orders.values()))[0] < now:
+            self.orders.popitem(last=False)
+        key = self.key_for(order, payload)
+        entry = self.orders.get(key)
+        if entry is not None:
+            self.hits += 1
+            original = entry[1]
+            original.duplicates.append(order)
+            if original.confirmed:
+                order.acknowledge()
+            return True
+        self.misses += 1
+        self.orders[key] = now + self.ttl, order
+        if len(self.orders) > self.max_orders:
+            self.orders.popitem(last=False)
+        return False
@@ -2,12 +2,15 @@ try:
     import ujson as json
 except ImportError:
     import json
+import collections
+import itertools
 import struct
 import typing as tp
 
 from satella.coding.structures import HashableIntEnum
 
-from .exceptions import InvalidFrame
+from .compression import COMPRESSED, decompress, wire_type
+from .exceptions import InvalidFrame, StreamedPayloadFailed
 
 
 class NGTTHeaderType(HashableIntEnum):
@@ -23,26 +26,61 @@ class NGTTHeaderType(HashableIntEnum):
 
 
 STRUCT_LHH = struct.Struct('>LHH')
+TLS_RECORD_SIZE = 16384
+#: a single TLS record is the most that a single read from a TLS socket can return
+RECV_BUFFER_SIZE = TLS_RECORD_SIZE
+#: default size of the largest payload accepted from the server, after decompression
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+#: header types indexed by their wire value, so that decoding does not construct enums
+HEADER_TYPES = tuple(sorted(NGTTHeaderType, key=lambda header: header.value))
+
+
+def header_type_for(h_type: int) -> NGTTHeaderType:
+    """
+    Return a header type for given wire value
+
+    :raises InvalidFrame: packet type was not recognized
+    """
+    if h_type >= len(HEADER_TYPES):
+        raise InvalidFrame('Unrecognized packet type %s' % (h_type,))
+    return HEADER_TYPES[h_type]
 
 
 class NGTTFrame:
-    def __init__(self, tid: int, packet_type: NGTTHeaderType, data: bytes):
+    """
+    A single frame.
+
+    Note that data of frames returned by :class:`~ngtt.protocol.NGTTFrameDecoder` is a
+    memoryview into the decoder's receive buffer, valid only until the decoder reads again.
+    Use :meth:`~ngtt.protocol.NGTTFrame.tobytes` if you need to keep it.
+    """
+    __slots__ = ('tid', 'packet_type', 'data')
+
+    def __init__(self, tid: int, packet_type: NGTTHeaderType,
+                 data: tp.Union[bytes, memoryview]):
         self.tid = tid
         self.packet_type = packet_type
         self.data = data
 
     def __repr__(self) -> str:
-        return f'NGTTFrame({self.tid}, {self.packet_type}, {self.data})'
+        return f'NGTTFrame({self.tid}, {self.packet_type}, {self.tobytes()})'
 
     def __str__(self) -> str:
         return repr(self)
 
+    def tobytes(self) -> bytes:
+        """
+        :return: a copy of this frame's data, safe to keep around
+        """
+        return bytes(self.data)
+
     @property
     def real_data(self) -> tp.Union[dict, list]:
         """
         :return: JSON unserialized data
         """
-        return json.loads(self.data.decode('utf-8'))
+        return json.loads(self.tobytes().decode('utf-8'))
 
     def __len__(self):
         return STRUCT_LHH.size + len(self.data)
@@ -51,11 +89,274 @@ class NGTTFrame:
         return STRUCT_LHH.pack(len(self.data), self.tid, self.packet_type.value)
 
     @classmethod
-    def from_bytes(cls, b: tp.Union[bytes, bytearray]) -> 'NGTTFrame':
-        length, tid, h_type = STRUCT_LHH.unpack(b[:STRUCT_LHH.size])
-        if h_type > NGTTHeaderType.DATA_STREAM_REJECT.value:
-            raise InvalidFrame('Unrecognized packet type %s' % (h_type,))
-        return NGTTFrame(tid, NGTTHeaderType(h_type), b[STRUCT_LHH.size:STRUCT_LHH.size + length])
+    def from_bytes(cls, b: tp.Union[bytes, bytearray, memoryview]) -> 'NGTTFrame':
+        length, tid, h_type = STRUCT_LHH.unpack_from(b)
+        return NGTTFrame(tid, header_type_for(h_type),
+                         memoryview(b)[STRUCT_LHH.size:STRUCT_LHH.size + length])
+
+
+class NGTTFrameDecoder:
+    """
+    An incremental decoder that turns a stream of bytes into frames.
+
+    Data is read straight into a reused receive buffer, either via
+    :meth:`~ngtt.protocol.NGTTFrameDecoder.recv_into` or
+    :meth:`~ngtt.protocol.NGTTFrameDecoder.feed`. Iterate over
+    :meth:`~ngtt.protocol.NGTTFrameDecoder.frames` to obtain every complete frame received
+    so far. Consumed data is tracked by a read offset, and unconsumed data is moved to the
+    front of the buffer only when space runs out.
+
+    Frames refer to the receive buffer, so their data is valid only until next read.
+
+    A frame longer than max_frame_size is rejected as soon as its header arrives, so that
+    a damaged or hostile length field can't make the buffer grow without limit.
+
+    :param buffer_size: initial size of the receive buffer. It will grow if a frame that
+        doesn't fit in it arrives, and go back to the initial buffer once that frame is
+        consumed.
+    :param max_frame_size: largest payload to accept, or None for no limit
+    """
+    __slots__ = ('base', 'buffer', 'view', 'offset', 'end', 'wanted', 'max_frame_size')
+
+    def __init__(self, buffer_size: int = RECV_BUFFER_SIZE,
+                 max_frame_size: tp.Optional[int] = MAX_FRAME_SIZE):
+        self.base = bytearray(buffer_size)
+        self.buffer = self.base
+        self.view = memoryview(self.buffer)
+        self.max_frame_size = max_frame_size
+        self.offset = 0
+        self.end = 0
+        self.wanted = 0
+
+    def __len__(self) -> int:
+        """
+        :return: amount of bytes buffered, but not yet returned as frames
+        """
+        return self.end - self.offset
+
+    @property
+    def free(self) -> int:
+        """
+        :return: amount of bytes that can be read into the buffer right now
+        """
+        return len(self.buffer) - self.end
+
+    def make_room(self) -> int:
+        """
+        Make sure that there's space for the next read, moving the unconsumed data to the
+        front of the buffer or growing it if the next frame wouldn't fit. A grown buffer is
+        let go of once what's left in it fits in the initial one.
+
+        :return: amount of free space in the buffer
+        """
+        pending = self.end - self.offset
+        if not pending:
+            self.offset = self.end = 0
+        if self.buffer is not self.base and max(pending, self.wanted) < len(self.base):
+            self.base[:pending] = self.view[self.offset:self.end]
+            self.buffer = self.base
+            self.view = memoryview(self.base)
+            self.offset = 0
+            self.end = pending
+        if self.end < len(self.buffer) and self.offset + self.wanted <= len(self.buffer):
+            return len(self.buffer) - self.end
+        if self.wanted > len(self.buffer) or pending == len(self.buffer):
+            # Frames handed out earlier may still refer to the old buffer, so don't resize it
+            buffer = bytearray(max(self.wanted, 2 * len(self.buffer)))
+            buffer[:pending] = self.view[self.offset:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        elif self.offset:
+            self.view[:pending] = bytes(self.view[self.offset:self.end])
+        self.offset = 0
+        self.end = pending
+        return len(self.buffer) - self.end
+
+    def recv_into(self, sock) -> int:
+        """
+        Read from a socket straight into the receive buffer
+
+        :param sock: socket to read from
+        :return: amount of bytes read, 0 means that the socket was closed
+        """
+        self.make_room()
+        received = sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def feed(self, data: tp.Union[bytes, bytearray, memoryview]) -> None:
+        """
+        Add data received from the network
+        """
+        self.wanted = max(self.wanted, len(self) + len(data))
+        self.make_room()
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def frames(self) -> tp.Iterator[NGTTFrame]:
+        """
+        Return every complete frame that is currently buffered. Compressed payloads are
+        decompressed.
+
+        :raises InvalidFrame: an unrecognized packet type, an invalid compressed payload or
+            a payload longer than max_frame_size was received
+        """
+        view = self.view
+        while self.end - self.offset >= STRUCT_LHH.size:
+            length, tid, h_type = STRUCT_LHH.unpack_from(view, self.offset)
+            if self.max_frame_size is not None and length > self.max_frame_size:
+                raise InvalidFrame('Frame of %s bytes exceeds the limit of %s bytes' % (
+                    length, self.max_frame_size))
+            start = self.offset + STRUCT_LHH.size
+            stop = start + length
+            if self.end < stop:
+                self.wanted = stop - self.offset
+                return
+            self.offset = stop
+            if h_type & COMPRESSED:
+                data = decompress(view[start:stop])
+                if self.max_frame_size is not None and len(data) > self.max_frame_size:
+                    raise InvalidFrame('Frame decompressed to %s bytes, over the limit of %s '
+                                       'bytes' % (len(data), self.max_frame_size))
+                yield NGTTFrame(tid, header_type_for(h_type & ~COMPRESSED), data)
+            else:
+                yield NGTTFrame(tid, header_type_for(h_type), view[start:stop])
+        self.wanted = STRUCT_LHH.size
+
+
+class StreamedPayload:
+    """
+    A payload that is produced piece by piece as it's sent, so that it's never in memory
+    as a whole. Its length has to be known up front, as it's sent before the payload.
+
+    Subclasses implement __len__ and chunks. As a payload is sent again after a reconnect,
+    chunks can be called many times, and must yield exactly len(self) bytes every time.
+    """
+
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+    def chunks(self) -> tp.Iterator[tp.Union[bytes, bytearray]]:
+        raise NotImplementedError()
+
+
+class PayloadStream:
+    """
+    The unsent rest of a :class:`~ngtt.protocol.StreamedPayload` in a send queue
+
+    :param tid: transaction ID of the frame that carries the payload
+    """
+    __slots__ = ('tid', 'chunks', 'remaining')
+
+    def __init__(self, tid: int, payload: StreamedPayload):
+        self.tid = tid
+        self.chunks = iter(payload.chunks())
+        self.remaining = len(payload)
+
+    def pull(self) -> memoryview:
+        """
+        :return: the next chunk of the payload
+        :raises StreamedPayloadFailed: the payload is not as long as it claimed to be, or
+            producing it raised an exception
+        """
+        try:
+            for chunk in self.chunks:
+                if chunk:
+                    break
+            else:
+                chunk = None
+        except Exception as e:
+            raise StreamedPayloadFailed(self.tid, 'Streamed payload failed: %s' % (e,)) from e
+        if chunk is None:
+            raise StreamedPayloadFailed(self.tid, 'Streamed payload is %s bytes too short' % (
+                self.remaining,))
+        self.remaining -= len(chunk)
+        if self.remaining < 0:
+            raise StreamedPayloadFailed(self.tid, 'Streamed payload is %s bytes too long' % (
+                -self.remaining,))
+        return memoryview(chunk)
+
+
+class NGTTSendQueue:
+    """
+    A scatter-gather queue of outgoing frames.
+
+    Frames are kept as a header and a memoryview of their payload, so large payloads are
+    never copied. A :class:`~ngtt.protocol.StreamedPayload` is pulled a chunk at a time,
+    only once everything before it was sent.
+
+    Use :meth:`~ngtt.protocol.NGTTSendQueue.next_chunk` to obtain the data to send and
+    report how much was sent with :meth:`~ngtt.protocol.NGTTSendQueue.consume`.
+
+    :ivar pending: amount of bytes queued, but not sent yet
+    """
+    __slots__ = ('segments', 'offset', 'pending')
+
+    def __init__(self):
+        self.segments = collections.deque()  # type: tp.Deque[tp.Union[memoryview, PayloadStream]]
+        self.offset = 0  # bytes of segments[0] already sent
+        self.pending = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.segments)
+
+    def append(self, tid: int, header: NGTTHeaderType,
+               data: tp.Union[bytes, memoryview, StreamedPayload] = b'') -> None:
+        """
+        Queue a frame. The data is not copied, so it must not be modified until it's sent.
+        """
+        self.segments.append(memoryview(STRUCT_LHH.pack(len(data), tid,
+                                                        wire_type(header.value, data))))
+        if isinstance(data, StreamedPayload):
+            if len(data):
+                self.segments.append(PayloadStream(tid, data))
+        elif data:
+            self.segments.append(memoryview(data))
+        self.pending += STRUCT_LHH.size + len(data)
+
+    def next_chunk(self) -> tp.Union[memoryview, bytearray]:
+        """
+        Return the data to pass to the next send() call.
+
+        Segments of at least a TLS record are sent straight from their memoryview, smaller
+        ones are coalesced up to a single TLS record. The chunk always starts at the first
+        unsent byte and won't get shorter until something is consumed, so it's safe to
+        retry it after SSLWantWriteError.
+
+        :raises StreamedPayloadFailed: a streamed payload is not as long as it claimed to
+            be, or failed to produce its data
+        """
+        while isinstance(self.segments[0], PayloadStream):
+            stream = self.segments[0]
+            chunk = stream.pull()
+            if not stream.remaining:
+                self.segments.popleft()
+            self.segments.appendleft(chunk)
+        head = self.segments[0][self.offset:]
+        if len(head) >= TLS_RECORD_SIZE or len(self.segments) == 1:
+            return head[:TLS_RECORD_SIZE]
+        chunk = bytearray(head)
+        for segment in itertools.islice(self.segments, 1, None):
+            if isinstance(segment, PayloadStream):
+                break
+            chunk += segment[:TLS_RECORD_SIZE - len(chunk)]
+            if len(chunk) >= TLS_RECORD_SIZE:
+                break
+        return chunk
+
+    def consume(self, data_sent: int) -> None:
+        """
+        Mark data_sent bytes as sent
+        """
+        self.pending -= data_sent
+        while data_sent:
+            head_left = len(self.segments[0]) - self.offset
+            if data_sent < head_left:
+                self.offset += data_sent
+                return
+            data_sent -= head_left
+            self.segments.popleft()
+            self.offset = 0
 
 
 def env_to_hostname(env: int) -> str:
@@ -0,0 +1,5 @@
+"""
+Things that help to test and benchmark code using NGTT without SMOK's servers
+"""
+from .certs import TestCertificates
+from .server import NGTTTestServer, CONFIRM, REJECT, IGNORE, DROP
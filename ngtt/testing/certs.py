@@ -0,0 +1,95 @@
+import datetime
+import os
+import tempfile
+import typing as tp
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from pyasn1.codec.der.encoder import encode
+from pyasn1.type.char import UTF8String
+from pyasn1.type.univ import Integer
+
+from ..uplink.certificates import get_oids
+
+DEVICE_ID, ENVIRONMENT = get_oids()
+
+
+def _generate_key() -> ec.EllipticCurvePrivateKey:
+    return ec.generate_private_key(ec.SECP256R1(), default_backend())
+
+
+def _name(common_name: str) -> x509.Name:
+    return x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+
+
+class TestCertificates:
+    """
+    A locally generated CA, with a certificate for the server and any amount of device
+    certificates, carrying the DEVICE_ID and ENVIRONMENT extensions just like the ones
+    SMOK issues.
+
+    Everything is written as PEM files into a directory.
+
+    :param directory: directory to write the files to. Default is a new temporary directory.
+    :param server_name: host name for the server's certificate
+    :ivar ca_file: path to the CA certificate
+    :ivar server_cert_file: path to the server's certificate
+    :ivar server_key_file: path to the server's private key
+    """
+    __test__ = False  # this is not a test case
+
+    def __init__(self, directory: tp.Optional[str] = None, server_name: str = 'localhost'):
+        self.directory = directory or tempfile.mkdtemp(prefix='ngtt-certs-')
+        self.ca_key = _generate_key()
+        self.ca_name = _name('NGTT test CA')
+        self.ca_cert = self._build(self.ca_name, self.ca_key.public_key(), ca=True)
+        self.ca_file = self._write('ca.crt', self.ca_cert)
+
+        server_key = _generate_key()
+        server_cert = self._build(_name(server_name), server_key.public_key(),
+                                  extensions=[x509.SubjectAlternativeName(
+                                      [x509.DNSName(server_name)])])
+        self.server_cert_file = self._write('server.crt', server_cert)
+        self.server_key_file = self._write('server.key', server_key)
+
+    def _build(self, subject: x509.Name, public_key, ca: bool = False,
+               extensions: tp.Sequence[x509.ExtensionType] = ()) -> x509.Certificate:
+        now = datetime.datetime.utcnow()
+        builder = x509.CertificateBuilder().subject_name(subject).issuer_name(self.ca_name) \
+            .public_key(public_key).serial_number(x509.random_serial_number()) \
+            .not_valid_before(now - datetime.timedelta(days=1)) \
+            .not_valid_after(now + datetime.timedelta(days=365)) \
+            .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+        for extension in extensions:
+            builder = builder.add_extension(extension, critical=False)
+        return builder.sign(self.ca_key, hashes.SHA256(), default_backend())
+
+    def _write(self, name: str, obj) -> str:
+        path = os.path.join(self.directory, name)
+        if isinstance(obj, x509.Certificate):
+            data = obj.public_bytes(serialization.Encoding.PEM)
+        else:
+            data = obj.private_bytes(serialization.Encoding.PEM,
+                                     serialization.PrivateFormat.PKCS8,
+                                     serialization.NoEncryption())
+        with open(path, 'wb') as f_out:
+            f_out.write(data)
+        return path
+
+    def device(self, device_id: str, environment: int = 2) -> tp.Tuple[str, str]:
+        """
+        Issue a certificate for a device
+
+        :param device_id: device ID to put into the certificate
+        :param environment: environment to put into the certificate
+        :return: a tuple of (path to certificate, path to private key)
+        """
+        key = _generate_key()
+        cert = self._build(_name(device_id), key.public_key(), extensions=[
+            x509.UnrecognizedExtension(DEVICE_ID, encode(UTF8String(device_id))),
+            x509.UnrecognizedExtension(ENVIRONMENT, encode(Integer(environment)))])
+        return self._write('%s.crt' % (device_id,), cert), \
+            self._write('%s.key' % (device_id,), key)
@@ -0,0 +1,312 @@
+import collections
+import heapq
+import itertools
+import json
+import logging
+import selectors
+import socket
+import ssl
+import time
+import typing as tp
+
+import minijson
+from satella.coding.concurrent import TerminableThread
+
+from ..protocol import NGTTHeaderType, NGTTFrame, NGTTFrameDecoder, NGTTSendQueue
+from ..uplink.outbox import Waker
+from .certs import TestCertificates
+
+logger = logging.getLogger(__name__)
+
+#: answer a DATA_STREAM with DATA_STREAM_CONFIRM
+CONFIRM = 'confirm'
+#: answer a DATA_STREAM with DATA_STREAM_REJECT
+REJECT = 'reject'
+#: never answer a DATA_STREAM
+IGNORE = 'ignore'
+#: drop the connection instead of answering a DATA_STREAM
+DROP = 'drop'
+
+
+class TestClient:
+    """
+    A single client connected to :class:`~ngtt.testing.server.NGTTTestServer`
+    """
+    __test__ = False
+
+    def __init__(self, sock: ssl.SSLSocket):
+        self.socket = sock
+        self.handshaken = False
+        self.wants = selectors.EVENT_READ
+        self.decoder = NGTTFrameDecoder(4096)
+        self.send_queue = NGTTSendQueue()
+        self.outstanding = 0  # DATA_STREAMs received and not confirmed yet
+
+    def fileno(self) -> int:
+        return self.socket.fileno()
+
+    @property
+    def events(self) -> int:
+        if not self.handshaken:
+            return self.wants
+        return selectors.EVENT_READ | (selectors.EVENT_WRITE if self.send_queue else 0)
+
+    def send_frame(self, tid: int, header: NGTTHeaderType, data: bytes = b'') -> None:
+        self.send_queue.append(tid, header, data)
+
+    def flush(self) -> None:
+        try:
+            while self.send_queue:
+                self.send_queue.consume(self.socket.send(self.send_queue.next_chunk()))
+        except (ssl.SSLWantWriteError, ssl.SSLWantReadError):
+            pass
+
+
+class NGTTTestServer(TerminableThread):
+    """
+    A local stand-in for SMOK's NGTT server, for tests and benchmarks.
+
+    It speaks the protocol over TLS, requiring clients to present a certificate issued by
+    the CA in certificates. It answers PINGs, unless answer_pings is False, confirms every
+    DATA_STREAM after confirm_delay seconds, answers every SYNC_BAOB_REQUEST with nothing to
+    download or upload, and counts frames received. It understands compressed payloads, and
+    compresses its own payloads if compression is set.
+
+    How the next DATA_STREAMs are answered can be scripted with
+    :meth:`~ngtt.testing.server.NGTTTestServer.script`:
+
+    >>> server.script(REJECT, (CONFIRM, 0.5), DROP, IGNORE)
+
+    The thread is started immediately, and listens on a random port unless told otherwise.
+
+    :param certificates: certificates to use
+    :param host: address to listen on
+    :param port: port to listen on, 0 to pick a free one
+    :ivar port: port that the server listens on
+    :ivar received: frames received, by packet type (tp.Counter[NGTTHeaderType])
+    :ivar log_entries: log entries received in LOGS frames (int)
+    :ivar pathpoint_entries: pathpoint entries received in DATA_STREAM frames (int)
+    :ivar answer_pings: whether to answer PINGs (bool)
+    :ivar confirm_delay: seconds to wait before confirming a DATA_STREAM (float)
+    :ivar compression: how to compress payloads sent, or None not to compress them
+        (tp.Optional[Compression])
+    :ivar max_outstanding: largest amount of DATA_STREAMs that a single client had sent and
+        were not confirmed yet (int)
+    """
+    __test__ = False
+
+    def __init__(self, certificates: TestCertificates, host: str = '127.0.0.1',
+                 port: int = 0):
+        super().__init__(name='ngtt test server', daemon=True)
+        self.certificates = certificates
+        self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.ssl_context.load_cert_chain(certificates.server_cert_file,
+                                         certificates.server_key_file)
+        self.ssl_context.load_verify_locations(certificates.ca_file)
+        self.ssl_context.verify_mode = ssl.CERT_REQUIRED
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(1024)
+        self.listener.setblocking(False)
+        self.host = host
+        self.port = self.listener.getsockname()[1]
+        self.waker = Waker()
+        self.commands = collections.deque()  # type: tp.Deque[tp.Callable[[], None]]
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.selector.register(self.waker, selectors.EVENT_READ)
+        self.clients = set()  # type: tp.Set[TestClient]
+        self.received = collections.Counter()  # type: tp.Counter[NGTTHeaderType]
+        self.log_entries = 0
+        self.pathpoint_entries = 0
+        self.answer_pings = True
+        self.confirm_delay = 0.0
+        self.responses = collections.deque()  # type: tp.Deque[tp.Tuple[str, float]]
+        self.compression = None  # type: tp.Optional[Compression]
+        self.max_outstanding = 0
+        self.timers = []  # type: tp.List[tp.Tuple[float, int, tp.Callable[[], None]]]
+        self.timer_counter = itertools.count()
+        self.start()
+
+    def call_soon(self, fun: tp.Callable[[], None]) -> None:
+        """
+        Have fun called in the server's thread
+        """
+        self.commands.append(fun)
+        self.waker.wake()
+
+    def call_later(self, delay: float, fun: tp.Callable[[], None]) -> None:
+        """
+        Have fun called after delay seconds. To be called from the server's thread only.
+        """
+        heapq.heappush(self.timers, (time.monotonic() + delay, next(self.timer_counter), fun))
+
+    def script(self, *responses: tp.Union[str, tp.Tuple[str, float]]) -> None:
+        """
+        Choose how the next DATA_STREAMs, from any client, will be answered. Once the
+        script runs out, they are confirmed after confirm_delay seconds again.
+
+        :param responses: for every DATA_STREAM, one of :data:`~ngtt.testing.server.CONFIRM`,
+            :data:`~ngtt.testing.server.REJECT`, :data:`~ngtt.testing.server.IGNORE` or
+            :data:`~ngtt.testing.server.DROP`, or a tuple of that and seconds to wait
+            before doing it
+        """
+        for response in responses:
+            self.responses.append((response, 0.0) if isinstance(response, str) else response)
+
+    def send_order(self, data, tid: int = 1) -> None:
+        """
+        Send an order to every connected client
+
+        :param data: order data, will be serialized with minijson
+        :param tid: transaction ID to use
+        """
+        data = self.compress(minijson.dumps(data))
+
+        def send():
+            for client in self.clients:
+                if client.handshaken:
+                    client.send_frame(tid, NGTTHeaderType.ORDER, data)
+                    self.update(client)
+
+        self.call_soon(send)
+
+    def terminate(self, force: bool = False) -> 'NGTTTestServer':
+        super().terminate(force)
+        self.waker.wake()
+        return self
+
+    def loop(self) -> None:
+        while self.timers and self.timers[0][0] <= time.monotonic():
+            heapq.heappop(self.timers)[2]()
+        timeout = 5
+        if self.timers:
+            timeout = min(timeout, max(0.0, self.timers[0][0] - time.monotonic()))
+        for key, events in self.selector.select(timeout):
+            if key.fileobj is self.listener:
+                self.accept()
+            elif key.fileobj is self.waker:
+                self.waker.drain()
+                while self.commands:
+                    self.commands.popleft()()
+            else:
+                try:
+                    self.handle(key.fileobj)
+                except (OSError, ValueError) as e:
+                    logger.debug('Client failed', exc_info=e)
+                    self.drop(key.fileobj)
+
+    def accept(self) -> None:
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except BlockingIOError:
+                return
+            sock.setblocking(False)
+            client = TestClient(self.ssl_context.wrap_socket(sock, server_side=True,
+                                                             do_handshake_on_connect=False))
+            self.clients.add(client)
+            self.selector.register(client, client.events)
+
+    def update(self, client: TestClient) -> None:
+        """
+        Send what's queued for client and bring its selector registration up to date
+        """
+        if client not in self.clients:
+            return
+        if client.handshaken:
+            try:
+                client.flush()
+            except OSError as e:
+                logger.debug('Client failed', exc_info=e)
+                return self.drop(client)
+        self.selector.modify(client, client.events)
+
+    def drop(self, client: TestClient) -> None:
+        if client in self.clients:
+            self.clients.discard(client)
+            self.selector.unregister(client)
+            client.socket.close()
+
+    def handle(self, client: TestClient) -> None:
+        if not client.handshaken:
+            try:
+                client.socket.do_handshake()
+            except ssl.SSLWantReadError:
+                client.wants = selectors.EVENT_READ
+                return self.update(client)
+            except ssl.SSLWantWriteError:
+                client.wants = selectors.EVENT_WRITE
+                return self.update(client)
+            client.handshaken = True
+        client.flush()
+        while True:
+            free = client.decoder.make_room()
+            try:
+                received = client.decoder.recv_into(client.socket)
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                break
+            if not received:
+                self.drop(client)
+                return
+            for frame in client.decoder.frames():
+                self.received[frame.packet_type] += 1
+                self.on_frame(client, frame)
+            if received < free and not client.socket.pending():
+                break
+        self.update(client)
+
+    def on_frame(self, client: TestClient, frame: NGTTFrame) -> None:
+        """
+        Respond to a frame received from a client
+        """
+        if frame.packet_type == NGTTHeaderType.PING:
+            if self.answer_pings:
+                client.send_frame(frame.tid, NGTTHeaderType.PING)
+        elif frame.packet_type == NGTTHeaderType.DATA_STREAM:
+            self.pathpoint_entries += len(minijson.loads(frame.tobytes()))
+            client.outstanding += 1
+            self.max_outstanding = max(self.max_outstanding, client.outstanding)
+            tid = frame.tid
+            action, delay = CONFIRM, self.confirm_delay
+            if self.responses:
+                action, delay = self.responses.popleft()
+            if action == IGNORE:
+                return
+            if delay:
+                self.call_later(delay, lambda: self.answer(client, tid, action))
+            else:
+                self.answer(client, tid, action)
+        elif frame.packet_type == NGTTHeaderType.LOGS:
+            self.log_entries += len(minijson.loads(frame.tobytes()))
+        elif frame.packet_type == NGTTHeaderType.SYNC_BAOB_REQUEST:
+            client.send_frame(frame.tid, NGTTHeaderType.SYNC_BAOB_RESPONSE,
+                              self.compress(json.dumps({'download': [], 'upload': []})
+                                            .encode('utf-8')))
+
+    def compress(self, data: bytes) -> bytes:
+        return data if self.compression is None else self.compression.compress(data)
+
+    def answer(self, client: TestClient, tid: int, action: str = CONFIRM) -> None:
+        """
+        Answer a DATA_STREAM, if the client is still connected
+
+        :param action: :data:`~ngtt.testing.server.CONFIRM`,
+            :data:`~ngtt.testing.server.REJECT` or :data:`~ngtt.testing.server.DROP`
+        """
+        if client not in self.clients:
+            return
+        client.outstanding -= 1
+        if action == DROP:
+            return self.drop(client)
+        client.send_frame(tid, NGTTHeaderType.DATA_STREAM_CONFIRM if action == CONFIRM
+                          else NGTTHeaderType.DATA_STREAM_REJECT)
+        self.update(client)
+
+    def cleanup(self):
+        for client in list(self.clients):
+            self.drop(client)
+        self.selector.close()
+        self.listener.close()
+        self.waker.close()
@@ -1 +1,2 @@
 from .thread import NGTTConnection
+from .gateway import NGTTGateway
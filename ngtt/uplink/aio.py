@@ -0,0 +1,392 @@
+import asyncio
+import logging
+import time
+import typing as tp
+
+import minijson
+from satella.time import ExponentialBackoff
+
+from ..compression import Compression, wire_type
+from ..exceptions import ConnectionFailed, DataStreamSyncFailed
+from ..orders import Order, OrderCache
+from ..protocol import NGTTHeaderType, NGTTFrame, NGTTFrameDecoder, STRUCT_LHH, \
+    env_to_hostname
+from .certificates import read_device_info
+from .connection import NGTT_PORT, CONNECT_TIMEOUT, get_ssl_context
+from .device import encode_data
+from .inflight import InFlightOps, DEFAULT_WINDOW, DEFAULT_WINDOW_BYTES
+from .keepalive import Keepalive
+from .metrics import Metrics
+from .tids import TidAllocator
+
+logger = logging.getLogger(__name__)
+
+
+class NGTTProtocol(asyncio.BufferedProtocol):
+    """
+    Protocol that reads straight into a :class:`~ngtt.protocol.NGTTFrameDecoder` and hands
+    every frame received to a :class:`~ngtt.uplink.aio.NGTTAsyncConnection`
+    """
+
+    def __init__(self, connection: 'NGTTAsyncConnection'):
+        self.connection = connection
+        self.decoder = NGTTFrameDecoder()
+        self.transport = None  # type: tp.Optional[asyncio.Transport]
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        self.decoder.make_room()
+        return self.decoder.view[self.decoder.end:]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.decoder.end += nbytes
+        self.connection.last_read = time.monotonic()
+        try:
+            for frame in self.decoder.frames():
+                self.connection.process_frame(frame)
+        except Exception as e:
+            logger.error('Error processing a frame, reconnecting', exc_info=e)
+            self.transport.abort()
+
+    def connection_lost(self, exc: tp.Optional[Exception]) -> None:
+        self.connection.connection_lost(self)
+
+
+class NGTTAsyncConnection:
+    """
+    An asyncio counterpart of :class:`~ngtt.uplink.NGTTConnection`.
+
+    Connection is maintained by a background task, started by
+    :meth:`~ngtt.uplink.aio.NGTTAsyncConnection.start` or by entering this as an async
+    context manager. It reconnects with an exponential backoff and replays pending
+    operations upon reconnecting, just like the threaded version.
+
+    Orders are obtained by iterating over this object:
+
+    >>> async with NGTTAsyncConnection('dev.crt', 'key.crt') as conn:
+    >>>     await conn.sync_pathpoints(...)
+    >>>     async for order in conn:
+    >>>         ...
+    >>>         order.acknowledge()
+
+    Everything here must be called from the event loop's thread. Requires Python 3.7+.
+
+    Closing fails every pending operation with ConnectionFailed and ends iteration over
+    orders.
+
+    :param cert_file: path to the device's certificate
+    :param key_file: path to the device's private key
+    :param host: host to connect to. Default is to pick it basing on the environment
+        that the certificate was issued for.
+    :param port: port to connect to
+    :param ca_file: path to the CA certificates to verify the server with. Default is to
+        use SMOK's certificates.
+    :param window: maximum amount of operations sent and waiting for the server's answer.
+        Further operations wait locally until the server answers. None for no limit.
+    :param window_bytes: maximum total size of operations sent and waiting for the server's
+        answer. None for no limit.
+    :param compression: how to compress payloads sent, or None not to compress them. The
+        server has to support compression.
+    :param order_cache: an :class:`~ngtt.orders.OrderCache` to recognize orders delivered
+        again with, so that they are not handed out twice, or None
+    :param keepalive: a :class:`~ngtt.uplink.keepalive.Keepalive` that decides when to ping
+        the server, and when to give up on a connection whose pings aren't answered
+    :param metrics: a :class:`~ngtt.uplink.metrics.Metrics` to count what this connection
+        does in, or None not to measure anything
+    """
+
+    def __init__(self, cert_file: str, key_file: str, host: tp.Optional[str] = None,
+                 port: int = NGTT_PORT, ca_file: tp.Optional[str] = None,
+                 window: tp.Optional[int] = DEFAULT_WINDOW,
+                 window_bytes: tp.Optional[int] = DEFAULT_WINDOW_BYTES,
+                 compression: tp.Optional[Compression] = None,
+                 order_cache: tp.Optional[OrderCache] = None,
+                 keepalive: tp.Optional[Keepalive] = None,
+                 metrics: tp.Optional[Metrics] = None):
+        self.cert_file = cert_file
+        self.key_file = key_file
+        self.host = host or env_to_hostname(read_device_info(cert_file)[1])
+        self.port = port
+        self.ca_file = ca_file
+        self.protocol = None  # type: tp.Optional[NGTTProtocol]
+        self.currently_running_ops = InFlightOps(window, window_bytes)
+        self.id_assigner = TidAllocator()
+        self.ping_tid = self.id_assigner.allocate()
+        self.ping_id = None
+        self.ping_sent_at = None  # type: tp.Optional[float]
+        self.keepalive = keepalive or Keepalive()
+        self.metrics = metrics
+        self.last_read = time.monotonic()
+        self.orders = None  # type: tp.Optional[asyncio.Queue]
+        self.state_changed = None  # type: tp.Optional[asyncio.Event]
+        self.task = None  # type: tp.Optional[asyncio.Task]
+        self.closed = False
+        self.compression = compression
+        self.order_cache = order_cache
+
+    @property
+    def connected(self) -> bool:
+        return self.protocol is not None
+
+    async def start(self) -> None:
+        """
+        Start maintaining the connection in the background
+        """
+        if self.task is None:
+            self.closed = False
+            self.orders = asyncio.Queue()
+            self.state_changed = asyncio.Event()
+            self.task = asyncio.get_running_loop().create_task(self.maintain())
+
+    async def close(self) -> None:
+        """
+        Stop the background task and close the connection
+        """
+        self.closed = True
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.protocol is not None:
+            self.protocol.transport.close()
+            self.protocol = None
+        for op in self.currently_running_ops:
+            if not op.fut.done():
+                op.fut.set_exception(ConnectionFailed())
+        self.currently_running_ops = InFlightOps(self.currently_running_ops.window,
+                                                 self.currently_running_ops.window_bytes)
+        if self.orders is not None:
+            self.orders.put_nowait(None)
+
+    async def __aenter__(self) -> 'NGTTAsyncConnection':
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> bool:
+        await self.close()
+        return False
+
+    def __aiter__(self) -> 'NGTTAsyncConnection':
+        return self
+
+    async def __anext__(self) -> Order:
+        """
+        Wait for the next order
+
+        :raises StopAsyncIteration: the connection was closed
+        """
+        order = await self.orders.get()
+        if order is None:
+            self.orders.put_nowait(None)    # wake up the next waiter, if any
+            raise StopAsyncIteration()
+        return order
+
+    async def connect(self) -> None:
+        """
+        Connect, retrying with an exponential backoff until it succeeds, and replay pending
+        operations
+        """
+        eb = ExponentialBackoff(1, 30)
+        ssl_context = get_ssl_context(self.cert_file, self.key_file, self.ca_file)
+        loop = asyncio.get_running_loop()
+        while self.protocol is None:
+            try:
+                _, protocol = await asyncio.wait_for(
+                    loop.create_connection(lambda: NGTTProtocol(self), self.host, self.port,
+                                           ssl=ssl_context, server_hostname=self.host),
+                    CONNECT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError) as e:
+                logger.warning('Failure reconnecting', exc_info=e)
+                if self.metrics is not None:
+                    self.metrics.connection_failed()
+                eb.failed()
+                await asyncio.sleep(eb.counter)
+                continue
+            self.protocol = protocol
+        self.last_read = time.monotonic()
+        self.id_assigner = TidAllocator()
+        # pings are sent one at a time, so they can all use the same ID
+        self.ping_tid = self.id_assigner.allocate()
+        self.ping_id = None
+        self.currently_running_ops.reset_tids()
+        self.send_pending()
+        if self.metrics is not None:
+            self.metrics.connected()
+        logger.debug('Successfully connected')
+
+    async def maintain(self) -> None:
+        while True:
+            await self.connect()
+            while self.connected:
+                self.state_changed.clear()
+                now = time.monotonic()
+                if self.ping_id is None:
+                    timeout = self.last_read + self.keepalive.current_interval - now
+                    if timeout <= 0:
+                        self.ping_id = self.ping_tid
+                        self.ping_sent_at = now
+                        self.send_frame(self.ping_id, NGTTHeaderType.PING)
+                if self.ping_id is not None:
+                    timeout = self.ping_sent_at + self.keepalive.timeout - now
+                    if timeout <= 0:
+                        logger.warning('Ping not answered in %s seconds, reconnecting',
+                                       self.keepalive.timeout)
+                        self.keepalive.timed_out()
+                        if self.metrics is not None:
+                            self.metrics.connection_failed()
+                        self.protocol.transport.abort()
+                        self.protocol = None
+                        break
+                try:
+                    await asyncio.wait_for(self.state_changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    def connection_lost(self, protocol: NGTTProtocol) -> None:
+        if self.protocol is protocol:
+            logger.debug('Connection failed, retrying')
+            if self.metrics is not None:
+                self.metrics.connection_failed()
+            self.protocol = None
+            self.state_changed.set()
+
+    def send_frame(self, tid: int, header: NGTTHeaderType, data: bytes = b'') -> None:
+        """
+        Send a frame, if connected. Used by :meth:`~ngtt.orders.Order.acknowledge`.
+        """
+        if self.protocol is not None:
+            if self.metrics is not None:
+                self.metrics.frame_sent(header, STRUCT_LHH.size + len(data))
+            self.protocol.transport.writelines(
+                (STRUCT_LHH.pack(len(data), tid, wire_type(header.value, data)), data))
+
+    def send_pending(self) -> None:
+        """
+        Send operations waiting locally, for as long as they fit in the window
+        """
+        if not self.connected:
+            return
+        for op in self.currently_running_ops.sendable():
+            if self.id_assigner.exhausted:
+                break
+            tid = self.id_assigner.allocate()
+            self.currently_running_ops.sent(op, tid)
+            self.send_frame(tid, op.h_type, op.data)
+
+    async def submit(self, h_type: NGTTHeaderType, data: bytes):
+        """
+        Send an operation, which will be replayed on reconnects, and wait for its result
+
+        :raises ConnectionFailed: the connection is closed, or was closed in the meantime
+        """
+        if self.closed:
+            raise ConnectionFailed()
+        submitted_at = time.monotonic()
+        data = await self.compress(data)
+        op = self.currently_running_ops.add(h_type, data,
+                                            asyncio.get_running_loop().create_future())
+        if self.metrics is not None:
+            self.metrics.watch(h_type, op.fut, submitted_at)
+        self.send_pending()
+        try:
+            return await op.fut
+        finally:
+            if op.fut.cancelled():
+                if op.tid is not None:
+                    self.id_assigner.free(op.tid)
+                self.currently_running_ops.discard(op)
+                self.send_pending()
+
+    async def compress(self, data: bytes) -> bytes:
+        """
+        Compress data if there's compression, in an executor if data is large
+        """
+        if self.compression is None:
+            return data
+        if len(data) >= self.compression.offload_threshold:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.compression.compress, data)
+        return self.compression.compress(data)
+
+    async def sync_pathpoints(self, data) -> None:
+        """
+        Synchronize pathpoints.
+
+        This will survive multiple reconnection attempts.
+
+        :param data: exactly the same thing that you would submit to POST
+        at POST https://api.smok.co/v1/device/. Entries of the list can also be
+        :class:`~ngtt.uplink.series.PathpointSeries`.
+        :raises DataStreamSyncFailed: the server rejected the data
+        """
+        await self.submit(NGTTHeaderType.DATA_STREAM, encode_data(data))
+
+    async def sync_baobs(self, baobs) -> dict:
+        """
+        Request to synchronize BAOBs
+
+        This will survive multiple reconnection attempts.
+
+        :param baobs: a dictionary of locally kept BAOB name => local version (tp.Dict[str, int])
+        :return: a dict of {"download": [.. list of BAOBs to download from the server ..],
+         "upload": [.. list of BAOBs to upload to the server ..]}
+        """
+        return await self.submit(NGTTHeaderType.SYNC_BAOB_REQUEST, encode_data(baobs))
+
+    async def stream_logs(self, data: tp.List) -> None:
+        """
+        Stream logs to the server
+
+        This will work on a best-effort basis.
+
+        :param data: the same thing that you would PUT /v1/device/device_logs
+        :raises ConnectionFailed: not connected at the moment
+        """
+        if not self.connected:
+            raise ConnectionFailed(True)
+        self.send_frame(0, NGTTHeaderType.LOGS, await self.compress(encode_data(data)))
+
+    def complete_op(self, tid: int) -> tp.Optional[asyncio.Future]:
+        op = self.currently_running_ops.complete(tid)
+        if op is not None:
+            self.id_assigner.free(tid)
+        self.send_pending()
+        if op is None or op.fut.done():
+            return None
+        return op.fut
+
+    def process_frame(self, frame: NGTTFrame) -> None:
+        if self.metrics is not None:
+            self.metrics.frame_received(frame.packet_type, len(frame))
+        if frame.packet_type == NGTTHeaderType.PING:
+            if self.ping_id is not None:
+                self.keepalive.answered(time.monotonic() - self.ping_sent_at)
+                self.ping_id = None
+                self.state_changed.set()
+        elif frame.packet_type == NGTTHeaderType.ORDER:
+            payload = frame.tobytes()
+            try:
+                data = minijson.loads(payload)
+            except ValueError:
+                logger.error('Received invalid JSON over the wire')
+                raise ConnectionFailed('Got invalid JSON')
+            order = Order(data, frame.tid, self)
+            if self.order_cache is None or not self.order_cache.is_duplicate(order, payload):
+                self.orders.put_nowait(order)
+        elif frame.packet_type in (
+                NGTTHeaderType.DATA_STREAM_REJECT, NGTTHeaderType.DATA_STREAM_CONFIRM):
+            fut = self.complete_op(frame.tid)
+            if fut is not None:
+                if frame.packet_type == NGTTHeaderType.DATA_STREAM_CONFIRM:
+                    fut.set_result(None)
+                else:
+                    fut.set_exception(DataStreamSyncFailed())
+        elif frame.packet_type == NGTTHeaderType.SYNC_BAOB_RESPONSE:
+            fut = self.complete_op(frame.tid)
+            if fut is not None:
+                fut.set_result(frame.real_data)
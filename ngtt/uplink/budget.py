@@ -0,0 +1,169 @@
+import threading
+import typing as tp
+from concurrent.futures import Future
+
+from ..protocol import MAX_FRAME_SIZE
+
+#: wait up to block_timeout seconds for room
+BLOCK = 'block'
+#: fail the operation with Overloaded right away
+FAIL = 'fail'
+#: keep the payload of a DATA_STREAM only in the journal, until it's sent
+SPILL = 'spill'
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+class SpilledPayload:
+    """
+    Stands in for the payload of an operation that is kept only in the journal
+    """
+    __slots__ = ('length', )
+
+    def __init__(self, length: int):
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+
+class MemoryBudget:
+    """
+    Caps the memory taken by operations waiting to be sent or answered, which would
+    otherwise grow without limit while the link is down, or while the server can't keep up.
+    Pass one as budget to a device to enable it.
+
+    A payload counts from submitting it until its Future is resolved. A payload that
+    doesn't fit is handled according to policy:
+
+    * :data:`~ngtt.uplink.budget.BLOCK` - the submitting thread waits up to block_timeout
+      seconds for room, and the operation fails with Overloaded if there's still none.
+      Operations submitted from the event loop's thread can't wait, so they fail right away.
+    * :data:`~ngtt.uplink.budget.FAIL` - the operation fails with Overloaded right away
+    * :data:`~ngtt.uplink.budget.SPILL` - a DATA_STREAM is accepted and its payload is
+      dropped from memory once it's journaled, to be read back from the journal when it's
+      sent. Other operations, and DATA_STREAMs of devices without a journal, fail as with
+      FAIL. Producers are not slowed down, so this bounds the memory of payloads only.
+
+    A single payload is always admitted if nothing is counted, however large it is.
+    Payloads merged by a pathpoint coalescer are counted once they're merged, and fail
+    instead of waiting. Streamed payloads are not counted.
+
+    Logs waiting in the journal for a connection count too. If they don't fit, the oldest
+    of them are dropped to make room.
+
+    This is thread-safe, and can be shared by many devices, eg. all devices of a gateway,
+    to cap their total.
+
+    :param max_bytes: maximum amount of payload bytes to keep in memory
+    :param policy: what to do with a payload that doesn't fit
+    :param block_timeout: seconds to wait for room with BLOCK, None to wait as long as
+        it takes
+    :param max_frame_size: largest payload to accept from the server. A connection that
+        receives a larger one fails.
+    :ivar used: amount of payload bytes counted (int)
+    :ivar peak: largest value of used so far (int)
+    :ivar rejected: amount of operations failed with Overloaded (int)
+    :ivar spilled: amount of payloads kept only in the journal (int)
+    :ivar logs_dropped: amount of batches of logs dropped to make room (int)
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, policy: str = BLOCK,
+                 block_timeout: tp.Optional[float] = None,
+                 max_frame_size: tp.Optional[int] = MAX_FRAME_SIZE):
+        if policy not in (BLOCK, FAIL, SPILL):
+            raise ValueError('Unknown policy %s' % (policy, ))
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.max_frame_size = max_frame_size
+        self.condition = threading.Condition()
+        self.counted = {}  # type: tp.Dict[Future, int]
+        self.used = 0
+        self.peak = 0
+        self.rejected = 0
+        self.spilled = 0
+        self.logs_dropped = 0
+
+    @property
+    def over(self) -> bool:
+        """
+        Whether more is counted than max_bytes
+        """
+        return self.used > self.max_bytes
+
+    def fits(self, size: int) -> bool:
+        return not self.used or self.used + size <= self.max_bytes
+
+    def count(self, size: int) -> None:
+        self.used += size
+        self.peak = max(self.peak, self.used)
+
+    def admit(self, fut: Future, size: int, can_spill: bool, can_block: bool) -> bool:
+        """
+        Count the payload of an operation until fut is resolved
+
+        :param size: length of the payload
+        :param can_spill: whether the payload can be kept only in the journal
+        :param can_block: whether the calling thread can wait for room
+        :return: whether the payload was admitted. If it wasn't, the operation is to be
+            failed with Overloaded.
+        """
+        with self.condition:
+            if not self.fits(size) and not (self.policy == SPILL and can_spill):
+                if self.policy != BLOCK or not can_block or \
+                        not self.condition.wait_for(lambda: self.fits(size),
+                                                    self.block_timeout):
+                    self.rejected += 1
+                    return False
+            self.count(size)
+            self.counted[fut] = size
+        fut.add_done_callback(self.release)
+        return True
+
+    def release(self, fut: Future) -> None:
+        """
+        Stop counting the payload of fut's operation. Does nothing if it's not counted.
+        """
+        with self.condition:
+            size = self.counted.pop(fut, 0)
+            if size:
+                self.used -= size
+                self.condition.notify_all()
+
+    def spill(self, fut: Future) -> None:
+        """
+        Note that the payload of fut's operation is now kept only in the journal, and stop
+        counting it
+        """
+        with self.condition:
+            self.spilled += 1
+        self.release(fut)
+
+    def take(self, size: int, force: bool = False) -> bool:
+        """
+        Count logs of given size, if they fit
+
+        :param force: whether to count them even if they don't
+        :return: whether they were counted
+        """
+        with self.condition:
+            if not force and not self.fits(size):
+                return False
+            self.count(size)
+            return True
+
+    def give_back(self, size: int) -> None:
+        """
+        Stop counting logs of given size
+        """
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+    def log_dropped(self) -> None:
+        """
+        Note that a batch of logs was dropped to make room
+        """
+        with self.condition:
+            self.logs_dropped += 1
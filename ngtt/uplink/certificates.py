@@ -1,32 +1,60 @@
+import functools
 import logging
+import os
 import typing as tp
 
-import pkg_resources
-from cryptography import x509
-from cryptography.hazmat.backends import default_backend
-from pyasn1.codec.der.decoder import decode
-from pyasn1.error import PyAsn1Error
 from satella.coding import reraise_as
 from satella.files import read_in_file
 
 logger = logging.getLogger(__name__)
 
-DEVICE_ID = x509.ObjectIdentifier('1.3.6.1.4.1.55338.0.0')
-ENVIRONMENT = x509.ObjectIdentifier('1.3.6.1.4.1.55338.0.1')
-# noinspection PyProtectedMember
-x509.oid._OID_NAMES[DEVICE_ID] = 'DeviceID'
-# noinspection PyProtectedMember
-x509.oid._OID_NAMES[ENVIRONMENT] = 'Environment'
+# cryptography and pyasn1 take long to import, and are needed only to parse certificates,
+# so they are imported once a certificate is parsed
 
+#: OID of the extension that carries the device ID
+DEVICE_ID_OID = '1.3.6.1.4.1.55338.0.0'
+#: OID of the extension that carries the environment
+ENVIRONMENT_OID = '1.3.6.1.4.1.55338.0.1'
 
-def get_cert(cert_name: str):
-    ca_file = pkg_resources.resource_filename(__name__, '../certs/%s.crt' % (cert_name,), )
-    return read_in_file(ca_file)
+
+@functools.lru_cache(maxsize=None)
+def get_oids() -> tuple:
+    """
+    Return the ObjectIdentifiers of the DeviceID and Environment extensions
+    """
+    from cryptography import x509
+    device_id = x509.ObjectIdentifier(DEVICE_ID_OID)
+    environment = x509.ObjectIdentifier(ENVIRONMENT_OID)
+    # noinspection PyProtectedMember
+    x509.oid._OID_NAMES[device_id] = 'DeviceID'
+    # noinspection PyProtectedMember
+    x509.oid._OID_NAMES[environment] = 'Environment'
+    return device_id, environment
+
+
+def __getattr__(name: str):
+    # DEVICE_ID and ENVIRONMENT are created on first access
+    if name == 'DEVICE_ID':
+        return get_oids()[0]
+    if name == 'ENVIRONMENT':
+        return get_oids()[1]
+    raise AttributeError('module %s has no attribute %s' % (__name__, name))
 
 
 def get_ca_path() -> str:
-    ca_file = pkg_resources.resource_filename(__name__, '../certs')
-    return ca_file
+    """
+    Return the path of the directory with SMOK's CA certificates
+    """
+    try:
+        from importlib.resources import files
+    except ImportError:  # Python < 3.9
+        return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'certs')
+    return str(files('ngtt') / 'certs')
+
+
+@functools.lru_cache(maxsize=None)
+def get_cert(cert_name: str) -> bytes:
+    return read_in_file(os.path.join(get_ca_path(), '%s.crt' % (cert_name,)))
 
 
 def get_root_cert() -> bytes:
@@ -44,23 +72,29 @@ def get_dev_ca_cert() -> bytes:
 
 
 def get_device_info(cert_data: bytes) -> tp.Tuple[str, int]:
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from pyasn1.codec.der.decoder import decode
+    from pyasn1.error import PyAsn1Error
+
+    device_id_oid, environment_oid = get_oids()
     try:
         cert = x509.load_pem_x509_certificate(cert_data, default_backend())
     except ValueError:
         raise ValueError('Error unserializing certificate')
 
     try:
-        device_asn1 = cert.extensions.get_extension_for_oid(DEVICE_ID).value.value
+        device_asn1 = cert.extensions.get_extension_for_oid(device_id_oid).value.value
     except x509.extensions.ExtensionNotFound as e:
-        return ValueError('DEVICE_ID not found in cert: %s' % (e,))
+        raise ValueError('DEVICE_ID not found in cert: %s' % (e,))
 
     try:
         device_id = str(decode(device_asn1)[0])
     except (PyAsn1Error, IndexError) as e:
-        return ValueError('error during decoding DEVICE_ID: %s' % (e,))
+        raise ValueError('error during decoding DEVICE_ID: %s' % (e,))
 
     try:
-        environment_asn1 = cert.extensions.get_extension_for_oid(ENVIRONMENT).value.value
+        environment_asn1 = cert.extensions.get_extension_for_oid(environment_oid).value.value
     except x509.extensions.ExtensionNotFound as e:
         raise ValueError(str(e))
 
@@ -73,3 +107,23 @@ def get_device_info(cert_data: bytes) -> tp.Tuple[str, int]:
 
     with reraise_as(ValueError, ValueError):
         return device_id, environment
+
+
+#: path of a certificate => (its mtime, what get_device_info returned for it)
+device_infos = {}  # type: tp.Dict[str, tp.Tuple[float, tp.Tuple[str, int]]]
+
+
+def read_device_info(cert_file: str) -> tp.Tuple[str, int]:
+    """
+    Return what :func:`~ngtt.uplink.certificates.get_device_info` returns for the
+    certificate in given file. The result is cached until the file is modified.
+
+    :param cert_file: path to the device's certificate
+    :raises ValueError: the certificate is invalid
+    """
+    mtime = os.stat(cert_file).st_mtime
+    entry = device_infos.get(cert_file)
+    if entry is None or entry[0] != mtime:
+        entry = mtime, get_device_info(read_in_file(cert_file))
+        device_infos[cert_file] = entry
+    return entry[1]
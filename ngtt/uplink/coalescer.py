@@ -0,0 +1,147 @@
+import reprlib
+import time
+import typing as tp
+from concurrent.futures import Future
+
+from .series import PathpointSeries
+
+DEFAULT_MAX_VALUES = 10000
+DEFAULT_MAX_LATENCY = 0.1
+
+
+def fan_out(futures: tp.List[Future]) -> tp.Callable[[Future], None]:
+    """
+    Return a done callback for a Future that passes its outcome on to every future in
+    futures
+    """
+    def callback(fut: Future) -> None:
+        exc = fut.exception()
+        for future in futures:
+            if future.done():
+                continue
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(fut.result())
+
+    return callback
+
+
+def check_entries(data: tp.List[tp.Union[dict, PathpointSeries]]) -> None:
+    """
+    Check that data is a list of pathpoint entries that can be merged
+
+    :raises ValueError: it's not
+    """
+    if not isinstance(data, (list, tuple)):
+        raise ValueError('Pathpoint entries must be a list, not %s' % (type(data).__name__,))
+    for entry in data:
+        if isinstance(entry, PathpointSeries):
+            continue
+        if not isinstance(entry, dict) or not isinstance(entry.get('path'), str) or \
+                not isinstance(entry.get('values'), (list, tuple)):
+            raise ValueError('Invalid pathpoint entry %s' % (reprlib.repr(entry),))
+
+
+def call_all(callables: tp.List[tp.Callable[[], None]]) -> tp.Optional[tp.Callable[[], None]]:
+    """
+    Return a callable that calls every callable in callables, or None if there are none
+    """
+    if not callables:
+        return None
+
+    def call() -> None:
+        for fun in callables:
+            fun()
+
+    return call
+
+
+class PathpointCoalescer:
+    """
+    Merges payloads passed to many calls to sync_pathpoints into a single DATA_STREAM.
+
+    Entries for the same pathpoint are merged into one, by concatenating their values, in
+    the order they were submitted. :class:`~ngtt.uplink.series.PathpointSeries` are not
+    merged, but sent as they are along with the rest. A merged payload is sent once it
+    contains max_values values, or max_latency seconds after its first payload was added,
+    whichever comes first.
+    The server's answer to it is passed on to the Future of every payload merged into it,
+    so if the server rejects a merged payload, every payload that contributed to it fails.
+
+    Payloads are merged as they are, so they must not be modified after they have been
+    submitted.
+
+    This is not thread-safe, it's meant to be used by the thread that drives the device.
+
+    :param max_values: amount of values in a merged payload that is sent right away
+    :param max_latency: maximum amount of seconds that payloads wait to be merged
+    """
+    __slots__ = ('max_values', 'max_latency', 'paths', 'values', 'futures', 'on_sent',
+                 'due_at')
+
+    def __init__(self, max_values: int = DEFAULT_MAX_VALUES,
+                 max_latency: float = DEFAULT_MAX_LATENCY):
+        self.max_values = max_values
+        self.max_latency = max_latency
+        self.paths = {}  # type: tp.Dict[tp.Hashable, tp.Union[dict, PathpointSeries]]
+        self.values = 0
+        self.futures = []  # type: tp.List[Future]
+        self.on_sent = []  # type: tp.List[tp.Callable[[], None]]
+        self.due_at = None  # type: tp.Optional[float]
+
+    def __bool__(self) -> bool:
+        return bool(self.futures)
+
+    @property
+    def due(self) -> bool:
+        """
+        Whether the merged payload should be sent now
+        """
+        return self.values >= self.max_values or \
+            (self.due_at is not None and time.monotonic() >= self.due_at)
+
+    def add(self, data: tp.List[tp.Union[dict, PathpointSeries]], fut: Future,
+            on_sent: tp.Optional[tp.Callable[[], None]] = None) -> None:
+        """
+        Merge a payload. Nothing is merged if it's invalid.
+
+        :param data: a list of pathpoint entries, as submitted to POST /v1/device/
+        :param fut: future that will receive the server's answer to the merged payload
+        :param on_sent: callable to call once the merged payload is first sent
+        :raises ValueError: data is not a list of valid pathpoint entries
+        """
+        check_entries(data)
+        for entry in data:
+            if isinstance(entry, PathpointSeries):
+                self.paths[object()] = entry
+                self.values += len(entry)
+                continue
+            values = entry['values']
+            merged = self.paths.get(entry['path'])
+            if merged is None:
+                self.paths[entry['path']] = dict(entry, values=list(values))
+            else:
+                merged['values'].extend(values)
+            self.values += len(values)
+        self.futures.append(fut)
+        if on_sent is not None:
+            self.on_sent.append(on_sent)
+        if self.due_at is None:
+            self.due_at = time.monotonic() + self.max_latency
+
+    def pop(self) -> tp.Tuple[tp.List[tp.Union[dict, PathpointSeries]], tp.List[Future],
+                              tp.Optional[tp.Callable[[], None]]]:
+        """
+        Take the merged payload
+
+        :return: a tuple of (merged payload, futures of the payloads merged into it,
+            callable to call once it's first sent or None)
+        """
+        result = list(self.paths.values()), self.futures, call_all(self.on_sent)
+        self.paths = {}
+        self.values = 0
+        self.futures = []
+        self.on_sent = []
+        self.due_at = None
+        return result
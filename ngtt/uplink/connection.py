@@ -1,27 +1,81 @@
+import errno
 import logging
 import os
+import selectors
 import socket
 import ssl
-import tempfile
 import threading
 import time
 import typing as tp
 from ssl import SSLContext, PROTOCOL_TLS_CLIENT, SSLError, CERT_REQUIRED
 
-from satella.coding import silence_excs, reraise_as, Closeable, wraps
-from satella.coding.concurrent import IDAllocator
+from satella.coding import reraise_as, Closeable, wraps
 from satella.coding.optionals import Optional
-from satella.files import read_in_file
 from satella.instrumentation import Traceback
 
-from .certificates import get_device_info, get_dev_ca_cert, get_root_cert, get_ca_path
+from .certificates import read_device_info, get_dev_ca_cert, get_root_cert, get_ca_path
+from .keepalive import Keepalive
+from .metrics import Metrics
+from .tids import TidAllocator
 from ..exceptions import ConnectionFailed
-from ..protocol import NGTTHeaderType, STRUCT_LHH, env_to_hostname, NGTTFrame
+from ..protocol import NGTTHeaderType, env_to_hostname, NGTTFrame, NGTTFrameDecoder, \
+    NGTTSendQueue, StreamedPayload, STRUCT_LHH, MAX_FRAME_SIZE
 
-PING_INTERVAL_TIME = 30
+NGTT_PORT = 2408
+CONNECT_TIMEOUT = 10
 logger = logging.getLogger(__name__)
 
 
+def create_ssl_context(cert_file: str, key_file: str,
+                       ca_file: tp.Optional[str] = None) -> SSLContext:
+    """
+    Create a SSL context to connect to the server with
+
+    :param cert_file: path to the device's certificate
+    :param key_file: path to the device's private key
+    :param ca_file: path to the CA certificates to verify the server with. Default is to
+        use SMOK's certificates.
+    """
+    ssl_context = SSLContext(PROTOCOL_TLS_CLIENT)
+    if ca_file is None:
+        ssl_context.load_verify_locations(
+            cadata=(get_dev_ca_cert() + b'\n' + get_root_cert()).decode('ascii'))
+    else:
+        ssl_context.load_verify_locations(ca_file)
+    ssl_context.load_cert_chain(cert_file, key_file)
+    ssl_context.verify_mode = CERT_REQUIRED
+    return ssl_context
+
+
+SSLContextKey = tp.Tuple[str, str, tp.Optional[str]]
+#: (cert_file, key_file, ca_file) => ((mtime of cert_file, mtime of key_file), SSL context)
+ssl_contexts = {}  # type: tp.Dict[SSLContextKey, tp.Tuple[tuple, SSLContext]]
+ssl_contexts_lock = threading.Lock()
+
+
+def get_ssl_context(cert_file: str, key_file: str,
+                    ca_file: tp.Optional[str] = None) -> SSLContext:
+    """
+    Return a SSL context to connect to the server with, shared by every connection that
+    uses the same files. A new one is created if the certificate or the key was modified.
+
+    Reusing a context lets connections resume TLS sessions of earlier connections.
+
+    :param cert_file: path to the device's certificate
+    :param key_file: path to the device's private key
+    :param ca_file: path to the CA certificates to verify the server with. Default is to
+        use SMOK's certificates.
+    """
+    key = cert_file, key_file, ca_file
+    mtimes = os.stat(cert_file).st_mtime, os.stat(key_file).st_mtime
+    with ssl_contexts_lock:
+        if key in ssl_contexts and ssl_contexts[key][0] == mtimes:
+            return ssl_contexts[key][1]
+        ssl_context = create_ssl_context(cert_file, key_file, ca_file)
+        ssl_contexts[key] = mtimes, ssl_context
+        return ssl_context
+
+
 def must_be_connected(fun):
     @wraps(fun)
     def outer(self, *args, **kwargs):
@@ -35,42 +89,95 @@ def must_be_connected(fun):
 class NGTTSocket(Closeable):
     @property
     def wants_write(self) -> bool:
-        return bool(self.w_buffer)
+        """
+        :return: whether this socket should be woken up when it becomes writable
+        """
+        return (bool(self.send_queue) and not self.send_wants_read) or self.recv_wants_write
+
+    @property
+    def events(self) -> int:
+        """
+        :return: selector events that this socket is interested in
+        """
+        if self.connecting:
+            return self.connect_events
+        return selectors.EVENT_READ | (selectors.EVENT_WRITE if self.wants_write else 0)
 
-    def __init__(self, cert_file: str, key_file: str):
+    @property
+    def has_pending_data(self) -> bool:
+        """
+        :return: whether OpenSSL holds decrypted data that select() won't report
+        """
+        return self.socket is not None and self.socket.pending() > 0
+
+    def __init__(self, cert_file: str, key_file: str, host: tp.Optional[str] = None,
+                 port: int = NGTT_PORT, ca_file: tp.Optional[str] = None,
+                 tls_session: tp.Optional[tp.Tuple[SSLContext, ssl.SSLSession]] = None,
+                 keepalive: tp.Optional[Keepalive] = None,
+                 metrics: tp.Optional[Metrics] = None,
+                 max_frame_size: tp.Optional[int] = MAX_FRAME_SIZE):
+        """
+        :param cert_file: path to the device's certificate
+        :param key_file: path to the device's private key
+        :param host: host to connect to. Default is to pick it basing on the environment
+            that the certificate was issued for.
+        :param port: port to connect to
+        :param ca_file: path to the CA certificates to verify the server with. Default is to
+            use SMOK's certificates.
+        :param tls_session: tls_session of an earlier connection to the same host, to
+            resume its TLS session if the server allows it
+        :param keepalive: :class:`~ngtt.uplink.keepalive.Keepalive` that decides when to
+            ping the server. Default is to ping it every 30 seconds of silence.
+        :param metrics: :class:`~ngtt.uplink.metrics.Metrics` to count frames sent in, or
+            None
+        :param max_frame_size: largest payload to accept from the server, or None for no
+            limit. A larger one fails the connection.
+        :ivar tls_session: SSL context and TLS session of this connection, once it's
+            disconnected (tp.Optional[tp.Tuple[SSLContext, ssl.SSLSession]])
+        """
         logger.info('New connection %s %s', cert_file, key_file)
         self.socket = None
         self.connected = False
+        self.connecting = False
+        self.connect_events = selectors.EVENT_WRITE
+        self.connect_deadline = None  # type: tp.Optional[float]
+        self.ssl_context = None  # type: tp.Optional[SSLContext]
         self.connection_lock = threading.Lock()
-        environment = get_device_info(read_in_file(cert_file))[1]
-        self.host = env_to_hostname(environment)
-        logger.info('Environment is %s', environment)
+        if host is None:
+            environment = read_device_info(cert_file)[1]
+            logger.info('Environment is %s', environment)
+            host = env_to_hostname(environment)
+        self.host = host
+        self.port = port
+        self.tls_session = tls_session
         self.cert_file = cert_file
         self.key_file = key_file
-        self.buffer = bytearray()
-        self.w_buffer = bytearray()
+        self.max_frame_size = max_frame_size
+        self.decoder = NGTTFrameDecoder(max_frame_size=max_frame_size)
+        self.send_queue = NGTTSendQueue()
+        self.send_wants_read = False  # last send() raised SSLWantReadError
+        self.recv_wants_write = False  # last recv() raised SSLWantWriteError
         self.ping_id = None
+        self.ping_sent_at = None  # type: tp.Optional[float]
+        self.keepalive = keepalive or Keepalive()
+        self.metrics = metrics
         self.last_read = None
-        try:
-            with tempfile.NamedTemporaryFile('wb', delete=False) as chain_file:
-                chain_file.write(get_dev_ca_cert())
-                chain_file.write(b'\n')
-                chain_file.write(get_root_cert())
-                chain_file.close()
-                self.chain_file_name = chain_file.name
-        except Exception as e:
-            logger.error('Found exception %s', e, exc_info=e)
-            raise
-
-        self.id_assigner = IDAllocator(start_at=1)
+        self.ca_file = ca_file
+
+        self.id_assigner = TidAllocator()
+        # pings are sent one at a time, so they can all use the same ID
+        self.ping_tid = self.id_assigner.allocate()
         super().__init__()
 
-    @reraise_as(ssl.SSLError, ConnectionFailed)
-    @silence_excs(ssl.SSLWantWriteError)
     @must_be_connected
-    def send_frame(self, tid: int, header: NGTTHeaderType, data: bytes = b'') -> None:
+    def send_frame(self, tid: int, header: NGTTHeaderType,
+                   data: tp.Union[bytes, memoryview, StreamedPayload] = b'') -> None:
         """
-        Schedule a frame to be sent
+        Schedule a frame to be sent. Nothing is sent until
+        :meth:`~ngtt.uplink.connection.NGTTSocket.try_send`, so that frames queued in a row
+        are coalesced into as few TLS records as possible.
+
+        The data is not copied, so it must not be modified until it's sent.
 
         :param tid: transaction ID
         :param header: packet type
@@ -78,90 +185,195 @@ class NGTTSocket(Closeable):
         """
         if self.closed:
             return
-        logger.debug('Sending %s', NGTTFrame(tid, header, data))
-        self.w_buffer.extend(STRUCT_LHH.pack(len(data), tid, header.value))
-        self.w_buffer.extend(data)
-        data_sent = self.socket.send(self.w_buffer)
-        del self.w_buffer[:data_sent]
-
-    @reraise_as(ssl.SSLError, ConnectionFailed)
-    @silence_excs(ssl.SSLWantWriteError)
+        logger.debug('Sending %s of %s bytes with tid %s', header, len(data), tid)
+        if self.metrics is not None:
+            self.metrics.frame_sent(header, STRUCT_LHH.size + len(data))
+        self.send_queue.append(tid, header, data)
+
+    @reraise_as(OSError, ConnectionFailed)
     @must_be_connected
     def try_send(self):
         """
         Try to send some data
         """
-        if self.w_buffer:
-            try:
-                data_sent = self.socket.send(self.w_buffer)
-                del self.w_buffer[:data_sent]
-            except socket.timeout:
-                return
+        self.flush()
+
+    def flush(self) -> None:
+        """
+        Send as much of the queued data as the socket will take
+        """
+        self.send_wants_read = False
+        try:
+            while self.send_queue:
+                self.send_queue.consume(self.socket.send(self.send_queue.next_chunk()))
+        except ssl.SSLWantWriteError:
+            pass
+        except ssl.SSLWantReadError:
+            self.send_wants_read = True
+
+    def next_deadline(self) -> tp.Optional[float]:
+        """
+        :return: monotonic time at which :meth:`~ngtt.uplink.connection.NGTTSocket.try_ping`
+            will have something to do, or None if nothing is scheduled
+        """
+        if self.connecting:
+            return self.connect_deadline
+        if self.ping_id is not None:
+            return self.ping_sent_at + self.keepalive.timeout
+        return self.last_read + self.keepalive.current_interval
 
     @must_be_connected
     def try_ping(self):
-        if time.monotonic() - self.last_read > PING_INTERVAL_TIME and self.ping_id is None:
-            self.ping_id = self.id_assigner.allocate_int()
+        """
+        Ping the server if it's been silent for long enough
+
+        :raises ConnectionFailed: the last ping wasn't answered in time
+        """
+        now = time.monotonic()
+        if self.ping_id is not None:
+            if now >= self.ping_sent_at + self.keepalive.timeout:
+                logger.warning('Ping not answered in %s seconds', self.keepalive.timeout)
+                self.keepalive.timed_out()
+                raise ConnectionFailed(True)
+        elif now - self.last_read >= self.keepalive.current_interval:
+            self.ping_id = self.ping_tid
+            self.ping_sent_at = now
             self.send_frame(self.ping_id, NGTTHeaderType.PING, b'')
 
     @must_be_connected
     def got_ping(self):
         if self.ping_id is not None:
-            self.id_assigner.mark_as_free(self.ping_id)
+            self.keepalive.answered(time.monotonic() - self.ping_sent_at)
             self.ping_id = None
 
     def fileno(self) -> int:
         return self.socket.fileno()
 
-    @reraise_as(ssl.SSLError, ConnectionFailed)
-    @silence_excs(ssl.SSLWantReadError)
+    @reraise_as(OSError, ConnectionFailed)
     @must_be_connected
-    def recv_frame(self) -> tp.Optional[NGTTFrame]:
+    def recv_frames(self) -> tp.List[NGTTFrame]:
         """
-        Receive a frame from remote socket, or None if nothing could be assembled as of now.
+        Read everything that is available from the remote socket, including the data that
+        OpenSSL has already decrypted, and return every frame that could be assembled.
+
+        If the receive buffer fills up, this returns early. Process the frames and check
+        :attr:`~ngtt.uplink.connection.NGTTSocket.has_pending_data` to see whether to call
+        it again.
 
         :raises ConnectionFailed: connection closed
-        :return: a tuple of transaction ID, header type, data
+        :return: a list of received frames, possibly empty
         """
-        data = self.socket.recv(512)
-        if not data:
-            raise ConnectionFailed()
-        self.last_read = time.monotonic()
-        self.buffer.extend(data)
-        if len(self.buffer) > STRUCT_LHH.size:
-            length, tid, h_type = STRUCT_LHH.unpack(self.buffer[:STRUCT_LHH.size])
-            if len(self.buffer) < STRUCT_LHH.size + length:
-                return
-            data = self.buffer[STRUCT_LHH.size:STRUCT_LHH.size + length]
-            del self.buffer[:STRUCT_LHH.size + length]
-            return NGTTFrame(tid, NGTTHeaderType(h_type), data)
+        self.recv_wants_write = False
+        while True:
+            free = self.decoder.make_room()
+            try:
+                received = self.decoder.recv_into(self.socket)
+            except ssl.SSLWantReadError:
+                break
+            except ssl.SSLWantWriteError:
+                self.recv_wants_write = True
+                break
+            if not received:
+                raise ConnectionFailed()
+            self.last_read = time.monotonic()
+            if received == free or not self.socket.pending():
+                break
+        return list(self.decoder.frames())
 
     def close(self, wait_for_me: bool = True):
         logger.info('Closing %s %s %s', self.closed, self.connected, self.socket)
         if super().close():
             logger.info('Actually closing')
             self.disconnect()
-            try:
-                os.unlink(self.chain_file_name)
-            except TypeError:
-                logger.error('Tried to close an uninitialized object')
-                logger.warning(Traceback().pretty_print())
-            except OSError as e:
-                logger.error('Failure to remove certificate chain file %s', self.chain_file_name,
-                             exc_info=e)
 
     def disconnect(self):
         """
-        Disconnect from the remote host
+        Disconnect from the remote host, keeping the TLS session to resume it later
         """
         if self.socket is not None:
+            if self.connected and self.socket.session is not None:
+                self.tls_session = self.ssl_context, self.socket.session
             self.socket.close()
             self.socket = None
             self.connected = False
+            self.connecting = False
+
+    @reraise_as(OSError, ConnectionFailed)
+    def start_connecting(self, address: tp.Optional[tp.Tuple[str, int]] = None) -> None:
+        """
+        Start connecting to the remote host without blocking, save for resolving its name
+        if address is not given.
+
+        Call :meth:`~ngtt.uplink.connection.NGTTSocket.continue_connecting` whenever the
+        socket becomes ready for :attr:`~ngtt.uplink.connection.NGTTSocket.events`, until
+        it's connected. Give up if it's not connected by connect_deadline.
+
+        :param address: resolved address of the remote host, or None to resolve it now
+        :raises ConnectionFailed: connecting failed right away
+        :raises RuntimeError: upon connection being closed
+        """
+        if self.closed:
+            raise RuntimeError('This connection is closed!')
+        self.ssl_context = get_ssl_context(self.cert_file, self.key_file, self.ca_file)
+        if address is None:
+            address = socket.getaddrinfo(self.host, self.port, socket.AF_INET,
+                                         socket.SOCK_STREAM)[0][4]
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setblocking(False)
+        self.connecting = True
+        self.connect_events = selectors.EVENT_WRITE
+        self.connect_deadline = time.monotonic() + CONNECT_TIMEOUT
+        result = self.socket.connect_ex(address)
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            raise ConnectionFailed(True)
+
+    @reraise_as(OSError, ConnectionFailed)
+    def continue_connecting(self) -> None:
+        """
+        Advance connecting, started by
+        :meth:`~ngtt.uplink.connection.NGTTSocket.start_connecting`. Check
+        :attr:`~ngtt.uplink.connection.NGTTSocket.connected` afterwards.
+
+        :raises ConnectionFailed: connecting failed
+        """
+        if not isinstance(self.socket, ssl.SSLSocket):
+            if self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                raise ConnectionFailed(True)
+            self.socket = self.ssl_context.wrap_socket(self.socket, server_hostname=self.host,
+                                                       do_handshake_on_connect=False,
+                                                       session=self.resumable_session())
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLWantReadError:
+            self.connect_events = selectors.EVENT_READ
+            return
+        except ssl.SSLWantWriteError:
+            self.connect_events = selectors.EVENT_WRITE
+            return
+        self.connecting = False
+        self.on_connected()
+
+    def resumable_session(self) -> tp.Optional[ssl.SSLSession]:
+        """
+        :return: the TLS session to resume, if any. A session can only be resumed with the
+            SSL context it was established with.
+        """
+        if self.tls_session is not None and self.tls_session[0] is self.ssl_context:
+            return self.tls_session[1]
+        return None
+
+    def on_connected(self) -> None:
+        self.last_read = time.monotonic()
+        self.decoder = NGTTFrameDecoder(max_frame_size=self.max_frame_size)
+        self.send_queue = NGTTSendQueue()
+        self.send_wants_read = False
+        self.recv_wants_write = False
+        self.connected = True
 
     def connect(self):
         """
-        Connect to remote host
+        Connect to remote host, blocking for up to CONNECT_TIMEOUT seconds. The event loop
+        uses :meth:`~ngtt.uplink.connection.NGTTSocket.start_connecting` instead.
 
         :raises SSLError: an error occurred
         :raises RuntimeError: upon connection being closed
@@ -171,15 +383,13 @@ class NGTTSocket(Closeable):
                 raise RuntimeError('This connection is closed!')
             if self.connected:
                 return
-            ssl_context = SSLContext(PROTOCOL_TLS_CLIENT)
-            ssl_context.load_verify_locations(self.chain_file_name)
-            ssl_context.load_cert_chain(self.cert_file, self.key_file)
-            ssl_context.verify_mode = CERT_REQUIRED
+            self.ssl_context = get_ssl_context(self.cert_file, self.key_file, self.ca_file)
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(10)
-            ssl_sock = ssl_context.wrap_socket(sock, server_hostname=self.host)
+            sock.settimeout(CONNECT_TIMEOUT)
+            ssl_sock = self.ssl_context.wrap_socket(sock, server_hostname=self.host,
+                                                    session=self.resumable_session())
             try:
-                ssl_sock.connect((self.host, 2408))
+                ssl_sock.connect((self.host, self.port))
                 ssl_sock.do_handshake()
             except (socket.error, SSLError) as e:
                 logger.error(Traceback().pretty_print())
@@ -187,7 +397,4 @@ class NGTTSocket(Closeable):
                 raise ConnectionFailed(True) from e
             self.socket = ssl_sock
             self.socket.setblocking(False)
-            self.last_read = time.monotonic()
-            self.buffer = bytearray()
-            self.w_buffer = bytearray()
-            self.connected = True
+            self.on_connected()
@@ -0,0 +1,714 @@
+import collections
+import logging
+import selectors
+import ssl
+import threading
+import time
+import typing as tp
+from concurrent.futures import Future
+
+import minijson
+from satella.coding import wraps, for_argument, silence_excs
+from satella.time import ExponentialBackoff
+
+from ..compression import Compression
+from ..exceptions import DataStreamSyncFailed, ConnectionFailed, Overloaded, \
+    StreamedPayloadFailed
+from ..orders import Order, OrderCache
+from ..protocol import NGTTHeaderType, NGTTFrame, StreamedPayload, env_to_hostname, \
+    MAX_FRAME_SIZE
+from .budget import MemoryBudget, SpilledPayload, SPILL
+from .certificates import read_device_info
+from .coalescer import PathpointCoalescer, check_entries, fan_out
+from .connection import NGTTSocket, NGTT_PORT, CONNECT_TIMEOUT
+from .inflight import InFlightOps, InFlightOp, DEFAULT_WINDOW, DEFAULT_WINDOW_BYTES
+from .journal import Journal
+from .keepalive import Keepalive
+from .logs import LogBatcher, split_list
+from .metrics import Metrics
+from .outbox import Outbox
+from .resolver import resolver, Address
+from .series import PathpointSeries, encode_pathpoints
+from .streaming import PathpointStream
+
+logger = logging.getLogger(__name__)
+
+
+def must_be_connected(fun):
+    @wraps(fun)
+    def outer(self, *args, **kwargs):
+        if not self.connected:
+            raise ConnectionFailed(True)
+        return fun(self, *args, **kwargs)
+
+    return outer
+
+
+def encode_data(y) -> bytes:
+    if isinstance(y, list) and any(isinstance(entry, PathpointSeries) for entry in y):
+        return encode_pathpoints(y)
+    return minijson.dumps(y)
+
+
+def earliest(*deadlines: tp.Optional[float]) -> tp.Optional[float]:
+    deadlines = [deadline for deadline in deadlines if deadline is not None]
+    return min(deadlines) if deadlines else None
+
+
+def fail_operation(fut: tp.Optional[Future],
+                   on_sent: tp.Optional[tp.Callable[[], None]]) -> None:
+    if on_sent is not None:
+        on_sent()
+    if fut is not None and not fut.done():
+        fut.set_exception(ConnectionFailed())
+
+
+class NGTTDevice:
+    """
+    A single SMOK device, talking to the server over its own connection.
+
+    This does no I/O on its own, it is driven by a :class:`~ngtt.uplink.loop.NGTTEventLoop`,
+    which can drive many devices at once. The methods that submit data can be called from
+    any thread.
+
+    :param event_loop: event loop that will drive this device
+    :param cert_file: path to the device's certificate
+    :param key_file: path to the device's private key
+    :param on_new_order: callable to call, in the event loop's thread, with every order
+        received. It should return quickly, use an
+        :class:`~ngtt.uplink.dispatcher.OrderDispatcher` to handle orders in other threads.
+    :param host: host to connect to. Default is to pick it basing on the environment
+        that the certificate was issued for.
+    :param port: port to connect to
+    :param ca_file: path to the CA certificates to verify the server with. Default is to
+        use SMOK's certificates.
+    :param window: maximum amount of operations sent and waiting for the server's answer.
+        Further operations wait locally until the server answers. None for no limit.
+    :param window_bytes: maximum total size of operations sent and waiting for the server's
+        answer. None for no limit.
+    :param journal_directory: directory to keep a :class:`~ngtt.uplink.journal.Journal`
+        of DATA_STREAMs and logs in, so that they survive a restart, or None to keep them
+        in memory only. DATA_STREAMs that were not confirmed, and logs that were not sent,
+        before the restart are sent again once connected. Every device needs a directory
+        of its own. DATA_STREAMs of data that is not a list or a tuple are streamed, and
+        are never journaled.
+    :param log_batcher: a :class:`~ngtt.uplink.logs.LogBatcher` to merge logs with, or None
+        to send every call to stream_logs as a frame of its own. Every device needs a
+        batcher of its own.
+    :param pathpoint_coalescer: a :class:`~ngtt.uplink.coalescer.PathpointCoalescer` to
+        merge calls to sync_pathpoints with, or None to send each of them as a DATA_STREAM
+        of its own. Every device needs a coalescer of its own.
+    :param compression: how to compress payloads sent, or None not to compress them. The
+        server has to support compression.
+    :param order_cache: an :class:`~ngtt.orders.OrderCache` to recognize orders delivered
+        again with, so that they are not passed to on_new_order twice, or None
+    :param keepalive: a :class:`~ngtt.uplink.keepalive.Keepalive` that decides when to ping
+        the server, and when to give up on a connection whose pings aren't answered. Default
+        is to ping after 30 seconds of silence, and to wait 10 seconds for the answer.
+    :param metrics: a :class:`~ngtt.uplink.metrics.Metrics` to count what this device does
+        in, or None not to measure anything
+    :param budget: a :class:`~ngtt.uplink.budget.MemoryBudget` to cap the memory taken by
+        operations waiting to be sent or answered with, or None for no cap. Operations that
+        don't fit fail with :class:`~ngtt.exceptions.Overloaded`. It can be shared by many
+        devices, to cap their total.
+    :ivar connected (bool) is connection opened
+    :ivar keepalive: the :class:`~ngtt.uplink.keepalive.Keepalive` in use, with the
+        round-trip times measured so far
+    """
+
+    def __init__(self, event_loop: 'NGTTEventLoop', cert_file: str, key_file: str,
+                 on_new_order: tp.Callable[[Order], None], host: tp.Optional[str] = None,
+                 port: int = NGTT_PORT, ca_file: tp.Optional[str] = None,
+                 window: tp.Optional[int] = DEFAULT_WINDOW,
+                 window_bytes: tp.Optional[int] = DEFAULT_WINDOW_BYTES,
+                 journal_directory: tp.Optional[str] = None,
+                 log_batcher: tp.Optional[LogBatcher] = None,
+                 pathpoint_coalescer: tp.Optional[PathpointCoalescer] = None,
+                 compression: tp.Optional[Compression] = None,
+                 order_cache: tp.Optional[OrderCache] = None,
+                 keepalive: tp.Optional[Keepalive] = None,
+                 metrics: tp.Optional[Metrics] = None,
+                 budget: tp.Optional[MemoryBudget] = None):
+        self.event_loop = event_loop
+        self.on_new_order = on_new_order
+        self.cert_file = cert_file
+        self.key_file = key_file
+        self.host = host
+        self.port = port
+        self.ca_file = ca_file
+        self.current_connection = None  # type: tp.Optional[NGTTSocket]
+        self.currently_running_ops = InFlightOps(window, window_bytes)
+        self.outbox = Outbox(event_loop.waker, self)
+        self.backoff = ExponentialBackoff(1, 30)
+        # these are maintained by the event loop
+        self.timer_at = None  # type: tp.Optional[float]
+        self.socket_events = 0
+        self.registered_connection = None  # type: tp.Optional[NGTTSocket]
+        self.abandoned = False
+        self.resolving_until = None  # type: tp.Optional[float]
+        self.tls_session = None  # type: tp.Optional[tp.Tuple[ssl.SSLContext, ssl.SSLSession]]
+        self.journal = None  # type: tp.Optional[Journal]
+        self.pending_logs = collections.deque()  # type: tp.Deque[tp.Tuple[int, bytes]]
+        self.log_batcher = log_batcher
+        self.pathpoint_coalescer = pathpoint_coalescer
+        self.compression = compression
+        self.order_cache = order_cache
+        self.keepalive = keepalive or Keepalive()
+        self.metrics = metrics
+        self.budget = budget
+        if journal_directory is not None:
+            self.journal = Journal(journal_directory)
+            for record_id, h_type, data in self.journal.replay():
+                if h_type == NGTTHeaderType.LOGS:
+                    self.pending_logs.append((record_id, data))
+                    if self.budget is not None:
+                        self.budget.take(len(data), force=True)
+                else:
+                    fut = Future()
+                    fut.set_running_or_notify_cancel()
+                    self.currently_running_ops.add(h_type, data, fut).journal_id = record_id
+
+    @property
+    @silence_excs(AttributeError, returns=False)
+    def connected(self) -> bool:
+        return self.current_connection.connected
+
+    @property
+    @silence_excs(AttributeError, returns=False)
+    def connecting(self) -> bool:
+        return self.current_connection.connecting
+
+    @property
+    def resolving(self) -> bool:
+        return self.resolving_until is not None
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Amount of operations sent and not answered yet
+        """
+        return self.currently_running_ops.sent_count
+
+    @property
+    def queued_bytes(self) -> int:
+        """
+        Amount of bytes queued on the connection and not sent yet
+        """
+        if self.current_connection is None:
+            return 0
+        return self.current_connection.send_queue.pending
+
+    @property
+    def receive_buffer_size(self) -> int:
+        """
+        Size of the buffer that the connection receives frames into
+        """
+        if self.current_connection is None:
+            return 0
+        return len(self.current_connection.decoder.buffer)
+
+    def connect(self) -> None:
+        """
+        Start a single attempt at connecting, which the event loop carries on without
+        blocking. If it succeeds, pending operations are replayed, otherwise the next attempt
+        is scheduled with an exponential backoff.
+
+        The host name is resolved by :data:`~ngtt.uplink.resolver.resolver`, which caches
+        the address.
+        """
+        if self.connected or self.connecting or self.resolving:
+            return
+        try:
+            if self.host is None:
+                self.host = env_to_hostname(read_device_info(self.cert_file)[1])
+        except Exception as e:
+            logger.warning('Failure reading the certificate', exc_info=e)
+            self.backoff.failed()
+            return
+        address = resolver.get(self.host, self.port)
+        if address is not None:
+            return self.start_connecting(address)
+        self.resolving_until = time.monotonic() + CONNECT_TIMEOUT
+        resolver.resolve(self.host, self.port, self.on_resolved)
+
+    def on_resolved(self, address: tp.Optional[Address]) -> None:
+        """
+        Called by the resolver, in its own thread, with the address of the host
+        """
+        self.event_loop.call_soon(
+            lambda: self.event_loop.run_device(self, self.resolved, address))
+
+    def resolved(self, address: tp.Optional[Address]) -> None:
+        if not self.resolving or self.abandoned:
+            return  # timed out in the meantime
+        self.resolving_until = None
+        if address is None:
+            self.backoff.failed()
+        else:
+            self.start_connecting(address)
+
+    def start_connecting(self, address: Address) -> None:
+        max_frame_size = MAX_FRAME_SIZE if self.budget is None else self.budget.max_frame_size
+        try:
+            self.current_connection = NGTTSocket(self.cert_file, self.key_file, self.host,
+                                                 self.port, self.ca_file, self.tls_session,
+                                                 self.keepalive, self.metrics,
+                                                 max_frame_size)
+            self.current_connection.start_connecting(address)
+        except Exception as e:
+            logger.warning('Failure reconnecting', exc_info=e)
+            self.disconnect()
+            self.backoff.failed()
+            resolver.forget(self.host, self.port)
+
+    def on_connected(self) -> None:
+        if self.metrics is not None:
+            self.metrics.connected()
+        self.backoff.success()
+        self.currently_running_ops.reset_tids()
+        logger.debug('Successfully connected')
+        self.process_outbox()
+
+    def connection_failed(self) -> None:
+        """
+        Called by the event loop when the connection has failed
+        """
+        if self.metrics is not None:
+            self.metrics.connection_failed()
+        if self.connecting:
+            logger.warning('Failure reconnecting')
+            self.backoff.failed()
+            resolver.forget(self.host, self.port)
+        self.disconnect()
+
+    def disconnect(self) -> None:
+        """
+        Close the current connection, if there's any, keeping its TLS session to resume it
+        """
+        self.event_loop.unregister_socket(self)
+        if self.current_connection is not None:
+            self.current_connection.close()
+            self.tls_session = self.current_connection.tls_session
+            self.current_connection = None
+
+    def abandon(self) -> None:
+        """
+        Disconnect for good, because the device is no longer driven by the event loop.
+        Every pending operation fails with ConnectionFailed, although the journaled ones
+        will be sent again when the device is started with the same journal.
+        """
+        self.abandoned = True
+        self.disconnect()
+        self.process_outbox()
+        if self.pathpoint_coalescer is not None:
+            self.flush_pathpoints(force=True)
+        if self.journal is not None:
+            if self.log_batcher is not None:
+                self.flush_logs(force=True)
+            self.journal.close()
+            if self.budget is not None:
+                for _, data in self.pending_logs:
+                    self.budget.give_back(len(data))
+            self.pending_logs.clear()
+        for op in self.currently_running_ops:
+            fail_operation(op.fut, op.on_sent)
+        self.currently_running_ops = InFlightOps(self.currently_running_ops.window,
+                                                 self.currently_running_ops.window_bytes)
+        self.fail_outbox()
+
+    def fail_outbox(self) -> None:
+        """
+        Fail every operation that is queued in the outbox. Safe to call from any thread, as
+        every entry is popped exactly once.
+        """
+        entry = self.outbox.pop()
+        while entry is not None:
+            fail_operation(entry[3], entry[4])
+            entry = self.outbox.pop()
+
+    def submit(self, h_type: NGTTHeaderType, data: bytes,
+               on_sent: tp.Optional[tp.Callable[[], None]] = None) -> Future:
+        """
+        Queue an operation from any thread. If there's a budget, the operation fails with
+        Overloaded if it doesn't fit.
+
+        :return: a Future that will receive the outcome
+        """
+        fut = Future()
+        fut.set_running_or_notify_cancel()
+        if self.metrics is not None:
+            self.metrics.watch(h_type, fut, time.monotonic())
+        # the coalescer's merged payloads are counted as they're made
+        if self.budget is not None and not isinstance(data, (list, tuple, StreamedPayload)):
+            can_spill = h_type == NGTTHeaderType.DATA_STREAM and self.journal is not None
+            can_block = self.event_loop.thread_id != threading.get_ident()
+            if not self.budget.admit(fut, len(data), can_spill, can_block):
+                fail_operation(None, on_sent)
+                fut.set_exception(Overloaded())
+                return fut
+        self.outbox.submit(h_type, data, fut, on_sent)
+        if self.abandoned:
+            self.fail_outbox()
+        return fut
+
+    def next_deadline(self) -> tp.Optional[float]:
+        """
+        :return: monotonic time at which :meth:`~ngtt.uplink.device.NGTTDevice.on_timer`
+            should be called, or None if it doesn't need to be
+        """
+        if self.resolving:
+            deadline = self.resolving_until
+        elif not self.connected and not self.connecting:
+            deadline = self.backoff.unavailable_until or time.monotonic()
+        else:
+            deadline = self.current_connection.next_deadline()
+        if self.journal is not None:
+            deadline = earliest(deadline, self.journal.sync_at)
+        if self.log_batcher is not None and self.can_send_logs:
+            deadline = earliest(deadline, self.log_batcher.due_at)
+        if self.pathpoint_coalescer is not None:
+            deadline = earliest(deadline, self.pathpoint_coalescer.due_at)
+        return deadline
+
+    def on_timer(self) -> None:
+        """
+        Called by the event loop at the time returned by
+        :meth:`~ngtt.uplink.device.NGTTDevice.next_deadline`, or later.
+        """
+        if self.journal is not None:
+            self.journal.sync_if_due()
+        if self.log_batcher is not None:
+            self.flush_logs()
+        if self.pathpoint_coalescer is not None:
+            self.flush_pathpoints()
+        self.send_pending()
+        if self.resolving:
+            if time.monotonic() >= self.resolving_until:
+                logger.warning('Timed out resolving %s', self.host)
+                self.resolving_until = None
+                self.backoff.failed()
+        elif self.connecting:
+            if time.monotonic() >= self.current_connection.connect_deadline:
+                raise ConnectionFailed(True)
+        elif not self.connected:
+            if self.backoff.ready_for_next_check:
+                self.connect()
+        else:
+            self.current_connection.try_ping()
+
+    def sync_pathpoints(self, data, block: bool = False,
+                        timeout: tp.Optional[float] = None) -> Future:
+        """
+        Try to synchronize pathpoints.
+
+        This will survive multiple reconnection attempts.
+
+        The operation is sent as soon as it fits in the window, so the Future returned
+        might refer to an operation that is not sent yet. Pass block=True to wait until it
+        is, which throttles the producer to the pace at which the server answers.
+
+        If there's a pathpoint coalescer, data is merged with data from other calls, so it
+        must not be modified afterwards, and the Future receives the server's answer to the
+        merged payload.
+
+        Data that is not a list or a tuple, eg. a generator of entries, is sent as a
+        :class:`~ngtt.uplink.streaming.PathpointStream`, which is encoded while it's sent.
+        Such data is neither coalesced, compressed nor journaled.
+
+        :param data: exactly the same thing that you would submit to POST
+        at POST https://api.smok.co/v1/device/. Entries of the list can also be
+        :class:`~ngtt.uplink.series.PathpointSeries`. Can also be an iterable of entries,
+        or a :class:`~ngtt.uplink.streaming.PathpointStream`.
+        :param block: whether to wait until the operation is sent
+        :param timeout: maximum amount of seconds to wait for if block is True, after which
+            the Future is returned anyway. None means wait as long as it takes.
+        :return: a Future telling you whether this succeeds or fails. If the device is
+            removed or stopped before that's known, it fails with ConnectionFailed.
+        :raises RuntimeError: block is True and this was called from the event loop's thread
+            (eg. from on_new_order), where it would wait forever
+        :raises ValueError: there's a pathpoint coalescer, and data has an entry that is
+            not a valid pathpoint entry
+        """
+        if isinstance(data, (list, tuple)):
+            if self.pathpoint_coalescer is None:
+                data = self.compress(encode_data(data))
+            else:
+                check_entries(data)
+        elif not isinstance(data, StreamedPayload):
+            data = PathpointStream(data)
+        if not block:
+            return self.submit(NGTTHeaderType.DATA_STREAM, data)
+        if self.event_loop.thread_id == threading.get_ident():
+            raise RuntimeError('Cannot block in the event loop\'s thread')
+        sent = threading.Event()
+        fut = self.submit(NGTTHeaderType.DATA_STREAM, data, sent.set)
+        sent.wait(timeout)
+        return fut
+
+    @for_argument(None, encode_data)
+    def sync_baobs(self, baobs) -> Future:
+        """
+        Request to synchronize BAOBs
+
+        This will survive multiple reconnection attempts.
+
+        :param baobs: a dictionary of locally kept BAOB name => local version (tp.Dict[str, int])
+        :return: a Future that will receive a result of dict
+        {"download": [.. list of BAOBs to download from the server ..],
+         "upload": [.. list of BAOBs to upload to the server ..]}
+        """
+        return self.submit(NGTTHeaderType.SYNC_BAOB_REQUEST, self.compress(baobs))
+
+    @for_argument(None, encode_data)
+    def stream_logs(self, data: tp.List) -> None:
+        """
+        Stream logs to the server
+
+        This will work on a best-effort basis, unless there's a journal, in which case
+        logs are kept until they can be sent. If there's a log batcher, logs are kept by it
+        while not connected, and the oldest ones are dropped if there's too many.
+
+        :param data: the same thing that you would PUT /v1/device/device_logs
+        :raises ConnectionFailed: not connected at the moment, and there's neither a journal
+            nor a log batcher
+        :raises ValueError: there's a log batcher, and data is not a list
+        """
+        if self.journal is None and self.log_batcher is None and not self.connected:
+            raise ConnectionFailed(True)
+        if self.log_batcher is None:
+            data = self.compress(data)
+        else:
+            split_list(data)    # the batcher merges lists only
+        self.outbox.send_frame(0, NGTTHeaderType.LOGS, data)
+
+    def process_outbox(self) -> None:
+        """
+        Send everything that other threads have queued. Operations are remembered so that
+        they can be replayed after a reconnect, even if they could not be sent now.
+        """
+        entry = self.outbox.pop()
+        while entry is not None:
+            h_type, data, tid, fut, on_sent = entry
+            if fut is not None:
+                if self.pathpoint_coalescer is not None and \
+                        h_type == NGTTHeaderType.DATA_STREAM and \
+                        not isinstance(data, StreamedPayload):
+                    try:
+                        self.pathpoint_coalescer.add(data, fut, on_sent)
+                    except ValueError as e:     # modified after it was submitted
+                        logger.error('Dropping invalid pathpoints: %s', e)
+                        fail_operation(None, on_sent)
+                        fut.set_exception(e)
+                else:
+                    self.add_op(h_type, data, fut, on_sent)
+            elif h_type == NGTTHeaderType.LOGS:
+                if self.log_batcher is not None:
+                    self.log_batcher.add(data)
+                else:
+                    self.queue_logs(data)
+            elif self.connected:
+                self.current_connection.send_frame(tid, h_type, data)
+            entry = self.outbox.pop()
+        if self.log_batcher is not None:
+            self.flush_logs()
+        if self.pathpoint_coalescer is not None:
+            self.flush_pathpoints()
+        self.send_pending()
+
+    def compress(self, data: bytes) -> bytes:
+        """
+        Compress data, if there's compression
+        """
+        return data if self.compression is None else self.compression.compress(data)
+
+    def add_op(self, h_type: NGTTHeaderType, data: bytes, fut: Future,
+               on_sent: tp.Optional[tp.Callable[[], None]] = None) -> None:
+        """
+        Remember an operation to be sent, journaling it if it's a DATA_STREAM that is not
+        streamed. If the budget is exceeded and its policy is SPILL, the journaled payload
+        is dropped from memory.
+        """
+        op = self.currently_running_ops.add(h_type, data, fut, on_sent)
+        if self.journal is not None and h_type == NGTTHeaderType.DATA_STREAM and \
+                not isinstance(data, StreamedPayload):
+            op.journal_id = self.journal.append(h_type, data)
+            if self.budget is not None and self.budget.policy == SPILL and self.budget.over:
+                op.data = SpilledPayload(len(data))
+                self.budget.spill(fut)
+
+    def flush_pathpoints(self, force: bool = False) -> None:
+        """
+        Take the merged payload from the pathpoint coalescer if it's due, and make it an
+        operation whose outcome is passed on to every payload merged into it
+
+        :param force: whether to take it even if it's not due yet
+        """
+        if self.pathpoint_coalescer.due or (force and self.pathpoint_coalescer):
+            data, futures, on_sent = self.pathpoint_coalescer.pop()
+            fut = Future()
+            fut.set_running_or_notify_cancel()
+            fut.add_done_callback(fan_out(futures))
+            data = self.compress(encode_data(data))
+            if self.budget is not None and \
+                    not self.budget.admit(fut, len(data), self.journal is not None, False):
+                fail_operation(None, on_sent)
+                fut.set_exception(Overloaded())
+                return
+            self.add_op(NGTTHeaderType.DATA_STREAM, data, fut, on_sent)
+
+    @property
+    def can_send_logs(self) -> bool:
+        """
+        Whether logs can be taken from the log batcher now
+        """
+        return self.connected or self.journal is not None
+
+    def queue_logs(self, data: bytes) -> None:
+        """
+        Journal logs to be sent, or send them right away if there's no journal and it's
+        connected. Otherwise they are dropped. If there's a budget, the oldest logs waiting
+        in the journal are dropped to make room for these, and these are dropped if that's
+        not enough.
+        """
+        if self.journal is not None:
+            if self.budget is not None:
+                while not self.budget.take(len(data)):
+                    if not self.pending_logs:
+                        self.budget.log_dropped()
+                        return
+                    record_id, dropped = self.pending_logs.popleft()
+                    self.journal.ack(record_id)
+                    self.budget.give_back(len(dropped))
+                    self.budget.log_dropped()
+            self.pending_logs.append((self.journal.append(NGTTHeaderType.LOGS, data), data))
+        elif self.connected:
+            self.current_connection.send_frame(0, NGTTHeaderType.LOGS, data)
+
+    def flush_logs(self, force: bool = False) -> None:
+        """
+        Take the batches that are due from the log batcher, if they can be sent
+
+        :param force: whether to take all logs, even if they are not due yet
+        """
+        if not self.can_send_logs:
+            return
+        while self.log_batcher.due or (force and self.log_batcher):
+            self.queue_logs(self.compress(self.log_batcher.pop_batch()))
+
+    def send_pending(self) -> None:
+        """
+        Send operations waiting locally, for as long as they fit in the window
+        """
+        if not self.connected:
+            return
+        while self.pending_logs:
+            record_id, data = self.pending_logs.popleft()
+            self.current_connection.send_frame(0, NGTTHeaderType.LOGS, data)
+            self.journal.ack(record_id)
+            if self.budget is not None:
+                self.budget.give_back(len(data))
+        for op in self.currently_running_ops.sendable():
+            if self.current_connection.id_assigner.exhausted:
+                break
+            tid = self.current_connection.id_assigner.allocate()
+            self.currently_running_ops.sent(op, tid)
+            data = op.data
+            if isinstance(data, SpilledPayload):
+                data = self.journal.read(op.journal_id)
+            self.current_connection.send_frame(tid, op.h_type, data)
+
+    def flush(self) -> None:
+        """
+        Send the frames queued on the connection, as far as the socket allows. Called by the
+        event loop after every piece of work done on behalf of this device.
+        """
+        if self.connected and self.current_connection.send_queue:
+            self.try_send()
+
+    def try_send(self) -> None:
+        """
+        Send what's queued on the connection. If a streamed payload fails halfway through
+        its frame, its operation fails, so that it's not sent again, and the connection is
+        dropped, as the frame can't be finished.
+
+        :raises ConnectionFailed: a streamed payload failed
+        """
+        try:
+            self.current_connection.try_send()
+        except StreamedPayloadFailed as e:
+            logger.error('Failed to send a streamed payload: %s', e)
+            op = self.complete_op(e.tid)
+            if op is not None:
+                op.fut.set_exception(e)
+            raise ConnectionFailed() from e
+
+    def handle_socket_events(self, events: int) -> None:
+        """
+        Handle readiness of the connection's socket, taking into account that TLS may need
+        to read in order to write, and vice versa.
+        """
+        conn = self.current_connection
+        if conn.connecting:
+            conn.continue_connecting()
+            if conn.connected:
+                self.on_connected()
+            return
+        if conn.send_queue and (events & selectors.EVENT_WRITE or conn.send_wants_read):
+            self.try_send()
+        if events & selectors.EVENT_READ or conn.recv_wants_write:
+            while True:
+                for frame in conn.recv_frames():
+                    self.process_frame(frame)
+                if not conn.has_pending_data:
+                    break
+
+    def process_frame(self, frame: NGTTFrame) -> None:
+        logger.debug('Received %s', frame)
+        if self.metrics is not None:
+            self.metrics.frame_received(frame.packet_type, len(frame))
+        if frame.packet_type == NGTTHeaderType.PING:
+            self.current_connection.got_ping()
+        elif frame.packet_type == NGTTHeaderType.ORDER:
+            payload = frame.tobytes()
+            try:
+                data = minijson.loads(payload)
+            except ValueError:
+                logger.error('Received invalid JSON over the wire')
+                raise ConnectionFailed('Got invalid JSON')
+            order = Order(data, frame.tid, self.outbox)
+            if self.order_cache is not None and self.order_cache.is_duplicate(order, payload):
+                logger.debug('Order %s delivered again', frame.tid)
+                return
+            if self.metrics is None:
+                self.on_new_order(order)
+            else:
+                started = time.monotonic()
+                self.on_new_order(order)
+                self.metrics.order_handled(time.monotonic() - started)
+        elif frame.packet_type in (
+                NGTTHeaderType.DATA_STREAM_REJECT, NGTTHeaderType.DATA_STREAM_CONFIRM):
+            op = self.complete_op(frame.tid)
+            if op is not None:
+                if frame.packet_type == NGTTHeaderType.DATA_STREAM_CONFIRM:
+                    op.fut.set_result(None)
+                elif frame.packet_type == NGTTHeaderType.DATA_STREAM_REJECT:
+                    op.fut.set_exception(DataStreamSyncFailed())
+                self.send_pending()
+        elif frame.packet_type == NGTTHeaderType.SYNC_BAOB_RESPONSE:
+            op = self.complete_op(frame.tid)
+            if op is not None:
+                op.fut.set_result(frame.real_data)
+                self.send_pending()
+
+    def complete_op(self, tid: int) -> tp.Optional[InFlightOp]:
+        """
+        Forget the operation sent with given transaction ID and release the ID for reuse
+
+        :return: the operation, or None if there's no operation with that transaction ID
+        """
+        op = self.currently_running_ops.complete(tid)
+        if op is not None:
+            self.current_connection.id_assigner.free(tid)
+            if op.journal_id is not None:
+                self.journal.ack(op.journal_id)
+        return op
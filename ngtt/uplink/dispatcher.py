@@ -0,0 +1,98 @@
+import collections
+import logging
+import threading
+import typing as tp
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+from ..orders import Order
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 1000
+
+
+class OrderDispatcher:
+    """
+    Runs the handler of orders in a pool of threads, so that a slow handler doesn't hold
+    up the event loop. Pass it as on_new_order:
+
+    >>> dispatcher = OrderDispatcher(handle_order, key=lambda order: order.data.get('path'))
+    >>> conn = NGTTConnection('dev.crt', 'key.crt', dispatcher)
+
+    Orders with the same key are handled one after another, in the order they were
+    received. Orders with different keys, or with a key of None, are handled in parallel.
+
+    At most max_pending orders can wait to be handled, or be handled, at once. Further
+    orders are dropped without being acknowledged, so the server will deliver them again.
+
+    :param handler: callable to call with every order. It's responsible for acknowledging
+        the order, which can be done from any thread.
+    :param workers: amount of threads to handle orders in, if executor is not given
+    :param max_pending: maximum amount of orders waiting to be handled or being handled
+    :param key: callable that returns the key of an order, or None if all orders can be
+        handled in parallel
+    :param executor: executor to handle orders in. Default is to create a
+        ThreadPoolExecutor with given amount of workers, that will be shut down by
+        :meth:`~ngtt.uplink.dispatcher.OrderDispatcher.shutdown`.
+    :ivar pending: amount of orders waiting to be handled or being handled (int)
+    :ivar dropped: amount of orders dropped because there were max_pending of them (int)
+    """
+
+    def __init__(self, handler: tp.Callable[[Order], None], workers: int = DEFAULT_WORKERS,
+                 max_pending: int = DEFAULT_MAX_PENDING,
+                 key: tp.Optional[tp.Callable[[Order], tp.Hashable]] = None,
+                 executor: tp.Optional[Executor] = None):
+        self.handler = handler
+        self.max_pending = max_pending
+        self.key = key
+        self.owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(workers,
+                                                       thread_name_prefix='ngtt orders')
+        self.lock = threading.Lock()
+        # orders waiting for an order with the same key to be handled, by key
+        self.waiting = {}  # type: tp.Dict[tp.Hashable, tp.Deque[Order]]
+        self.pending = 0
+        self.dropped = 0
+
+    def __call__(self, order: Order) -> None:
+        """
+        Have order handled. Never blocks.
+        """
+        key = self.key(order) if self.key is not None else None
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.dropped += 1
+                logger.warning('Too many orders pending, dropping order %s', order.tid)
+                return
+            self.pending += 1
+            if key is not None:
+                if key in self.waiting:
+                    self.waiting[key].append(order)
+                    return
+                self.waiting[key] = collections.deque()
+        self.executor.submit(self.run, order, key)
+
+    def run(self, order: Order, key: tp.Optional[tp.Hashable]) -> None:
+        while order is not None:
+            try:
+                self.handler(order)
+            except Exception as e:
+                logger.error('Error handling order %s', order.tid, exc_info=e)
+            with self.lock:
+                self.pending -= 1
+                order = None
+                if key is not None:
+                    if self.waiting[key]:
+                        order = self.waiting[key].popleft()
+                    else:
+                        del self.waiting[key]
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop handling orders, if the executor was created by this dispatcher
+
+        :param wait: whether to wait for the orders being handled to finish
+        """
+        if self.owns_executor:
+            self.executor.shutdown(wait)
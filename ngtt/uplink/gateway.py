@@ -0,0 +1,153 @@
+import logging
+import typing as tp
+
+from satella.coding.concurrent import TerminableThread
+
+from ..orders import Order, OrderCache
+from .connection import NGTT_PORT
+from ..compression import Compression
+from .coalescer import PathpointCoalescer
+from .budget import MemoryBudget
+from .inflight import DEFAULT_WINDOW, DEFAULT_WINDOW_BYTES
+from .keepalive import Keepalive
+from .logs import LogBatcher
+from .metrics import Metrics
+from .device import NGTTDevice
+from .loop import NGTTEventLoop
+
+logger = logging.getLogger(__name__)
+
+
+class NGTTEventLoopThread(TerminableThread):
+    """
+    A thread running a :class:`~ngtt.uplink.loop.NGTTEventLoop`
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name=name, daemon=True)
+        self.event_loop = NGTTEventLoop()
+
+    def loop(self) -> None:
+        self.event_loop.run_once()
+
+    def terminate(self, force: bool = False) -> 'NGTTEventLoopThread':
+        super().terminate(force)
+        self.event_loop.waker.wake()
+        return self
+
+    def cleanup(self):
+        self.event_loop.close()
+
+
+class NGTTGateway:
+    """
+    Many devices, each with its own certificate and connection, driven by a small, fixed
+    pool of threads.
+
+    Every device gets its own :class:`~ngtt.uplink.device.NGTTDevice`, with the same API
+    as :class:`~ngtt.uplink.NGTTConnection`, and reconnects with its own backoff.
+
+    Connecting and the TLS handshake are driven by the selector, and host names are
+    resolved in the background, so a device whose server is unreachable doesn't hold up
+    the other devices on its thread.
+
+    The threads are started immediately.
+
+    :param threads: amount of event loop threads to use. Devices are assigned to the thread
+        that has the least devices.
+    """
+
+    def __init__(self, threads: int = 1):
+        self.threads = [NGTTEventLoopThread('ngtt gateway %s' % (i,)).start()
+                        for i in range(threads)]
+        self.stopped = False
+
+    def __len__(self) -> int:
+        return sum(len(thread.event_loop) for thread in self.threads)
+
+    def add_device(self, cert_file: str, key_file: str,
+                   on_new_order: tp.Callable[[Order], None], host: tp.Optional[str] = None,
+                   port: int = NGTT_PORT, ca_file: tp.Optional[str] = None,
+                   window: tp.Optional[int] = DEFAULT_WINDOW,
+                   window_bytes: tp.Optional[int] = DEFAULT_WINDOW_BYTES,
+                   journal_directory: tp.Optional[str] = None,
+                   log_batcher: tp.Optional[LogBatcher] = None,
+                   pathpoint_coalescer: tp.Optional[PathpointCoalescer] = None,
+                   compression: tp.Optional[Compression] = None,
+                   order_cache: tp.Optional[OrderCache] = None,
+                   keepalive: tp.Optional[Keepalive] = None,
+                   metrics: tp.Optional[Metrics] = None,
+                   budget: tp.Optional[MemoryBudget] = None) -> NGTTDevice:
+        """
+        Add a device. It will connect as soon as possible.
+
+        :param cert_file: path to the device's certificate
+        :param key_file: path to the device's private key
+        :param on_new_order: callable to call, in the event loop's thread, with every order
+            received by this device. It should return quickly, use an
+            :class:`~ngtt.uplink.dispatcher.OrderDispatcher` to handle orders in other
+            threads.
+        :param host: host to connect to. Default is to pick it basing on the environment
+            that the certificate was issued for.
+        :param port: port to connect to
+        :param ca_file: path to the CA certificates to verify the server with. Default is to
+            use SMOK's certificates.
+        :param window: maximum amount of operations sent and waiting for the server's answer.
+            None for no limit.
+        :param window_bytes: maximum total size of operations sent and waiting for the
+            server's answer. None for no limit.
+        :param journal_directory: directory to journal DATA_STREAMs and logs in, so that
+            they survive a restart, or None to keep them in memory only. Every device needs
+            a directory of its own. Streamed DATA_STREAMs, of data that is not a list or a
+            tuple, are not journaled.
+        :param log_batcher: a :class:`~ngtt.uplink.logs.LogBatcher` to merge logs with, or
+            None to send every call to stream_logs as a frame of its own. Every device needs
+            a batcher of its own.
+        :param pathpoint_coalescer: a :class:`~ngtt.uplink.coalescer.PathpointCoalescer`
+            to merge calls to sync_pathpoints with, or None to send each of them as a
+            DATA_STREAM of its own. Every device needs a coalescer of its own.
+        :param compression: how to compress payloads sent, or None not to compress them.
+            The server has to support compression.
+        :param order_cache: an :class:`~ngtt.orders.OrderCache` to recognize orders
+            delivered again with, so that they are not passed to on_new_order twice, or
+            None. Every device needs a cache of its own.
+        :param keepalive: a :class:`~ngtt.uplink.keepalive.Keepalive` that decides when to
+            ping the server, and when to give up on a connection whose pings aren't
+            answered. Every device needs one of its own.
+        :param metrics: a :class:`~ngtt.uplink.metrics.Metrics` to count what this device
+            does in, or None not to measure anything. It can be shared by many devices.
+        :param budget: a :class:`~ngtt.uplink.budget.MemoryBudget` to cap the memory taken
+            by operations waiting to be sent or answered with, or None for no cap. It can
+            be shared by many devices, to cap their total.
+        :return: the device
+        """
+        if self.stopped:
+            raise RuntimeError('This gateway is stopped')
+        event_loop = min((thread.event_loop for thread in self.threads), key=len)
+        device = NGTTDevice(event_loop, cert_file, key_file, on_new_order, host, port, ca_file,
+                            window, window_bytes, journal_directory, log_batcher,
+                            pathpoint_coalescer, compression, order_cache, keepalive,
+                            metrics, budget)
+        event_loop.add(device)
+        return device
+
+    def remove_device(self, device: NGTTDevice) -> None:
+        """
+        Disconnect a device and stop driving it
+        """
+        device.event_loop.remove(device)
+
+    def stop(self, wait_for_completion: bool = True) -> None:
+        """
+        Stop all threads, disconnecting all devices
+
+        :param wait_for_completion: whether to wait for the threads to terminate
+        """
+        if self.stopped:
+            return
+        for thread in self.threads:
+            thread.terminate()
+        if wait_for_completion:
+            for thread in self.threads:
+                thread.join()
+        self.stopped = True
@@ -0,0 +1,155 @@
+import collections
+import itertools
+import typing as tp
+
+from ..protocol import NGTTHeaderType
+
+#: default maximum amount of operations sent and waiting for the server's answer
+DEFAULT_WINDOW = 256
+#: default maximum amount of payload bytes sent and waiting for the server's answer
+DEFAULT_WINDOW_BYTES = 4 * 1024 * 1024
+
+
+class InFlightOp:
+    """
+    An operation that waits for the server's answer
+
+    :ivar op_id: ID of this operation, unique within a
+        :class:`~ngtt.uplink.inflight.InFlightOps` and kept across reconnects (int)
+    :ivar h_type: packet type to send (NGTTHeaderType)
+    :ivar data: payload to send (bytes)
+    :ivar fut: future that will receive the result
+    :ivar tid: transaction ID it was last sent with, or None if it was not sent over the
+        current connection yet
+    :ivar on_sent: callable to call once this is first sent, or None
+    :ivar journal_id: ID of the journal record of this operation, or None if it's not
+        journaled
+    """
+    __slots__ = ('op_id', 'h_type', 'data', 'fut', 'tid', 'on_sent', 'journal_id')
+
+    def __init__(self, op_id: int, h_type: NGTTHeaderType, data: bytes, fut,
+                 on_sent: tp.Optional[tp.Callable[[], None]] = None):
+        self.op_id = op_id
+        self.h_type = h_type
+        self.data = data
+        self.fut = fut
+        self.tid = None  # type: tp.Optional[int]
+        self.on_sent = on_sent
+        self.journal_id = None  # type: tp.Optional[int]
+
+
+class InFlightOps:
+    """
+    Operations waiting for the server's answer, in the order they were submitted, so that
+    they can be replayed in that order after a reconnect.
+
+    Only a window of operations is sent at once, the rest waits until the server answers
+    some of them. At least a single operation is always allowed, even if it's larger than
+    window_bytes.
+
+    Adding, completing by transaction ID and discarding an operation are all O(1).
+
+    :param window: maximum amount of operations sent and not answered yet, None for no limit
+    :param window_bytes: maximum total length of payloads sent and not answered yet, None for
+        no limit
+    """
+    __slots__ = ('ops', 'unsent', 'by_tid', 'op_ids', 'window', 'window_bytes', 'sent_bytes')
+
+    def __init__(self, window: tp.Optional[int] = None,
+                 window_bytes: tp.Optional[int] = None):
+        self.ops = collections.OrderedDict()  # type: tp.Dict[int, InFlightOp]
+        self.unsent = collections.OrderedDict()  # type: tp.Dict[int, InFlightOp]
+        self.by_tid = {}  # type: tp.Dict[int, int]
+        self.op_ids = itertools.count()
+        self.window = window
+        self.window_bytes = window_bytes
+        self.sent_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    def __iter__(self) -> tp.Iterator[InFlightOp]:
+        return iter(self.ops.values())
+
+    @property
+    def sent_count(self) -> int:
+        """
+        Amount of operations sent and not answered yet
+        """
+        return len(self.by_tid)
+
+    def add(self, h_type: NGTTHeaderType, data: bytes, fut,
+            on_sent: tp.Optional[tp.Callable[[], None]] = None) -> InFlightOp:
+        """
+        Remember a new operation, as the last one
+        """
+        op = InFlightOp(next(self.op_ids), h_type, data, fut, on_sent)
+        self.ops[op.op_id] = op
+        self.unsent[op.op_id] = op
+        return op
+
+    def sendable(self) -> tp.Iterator[InFlightOp]:
+        """
+        Iterate over operations that were not sent yet, in order, for as long as they fit
+        in the window.
+
+        Every operation returned must be marked with
+        :meth:`~ngtt.uplink.inflight.InFlightOps.sent` before advancing the iterator.
+        """
+        while self.unsent:
+            if self.window is not None and len(self.by_tid) >= self.window:
+                return
+            op = next(iter(self.unsent.values()))
+            if self.window_bytes is not None and self.by_tid and \
+                    self.sent_bytes + len(op.data) > self.window_bytes:
+                return
+            yield op
+
+    def sent(self, op: InFlightOp, tid: int) -> None:
+        """
+        Record that op was sent with given transaction ID
+        """
+        del self.unsent[op.op_id]
+        op.tid = tid
+        self.by_tid[tid] = op.op_id
+        self.sent_bytes += len(op.data)
+        if op.on_sent is not None:
+            op.on_sent()
+            op.on_sent = None
+
+    def complete(self, tid: int) -> tp.Optional[InFlightOp]:
+        """
+        Forget the operation sent with given transaction ID
+
+        :return: the operation, or None if there's no operation with that transaction ID
+        """
+        op_id = self.by_tid.pop(tid, None)
+        if op_id is None:
+            return None
+        op = self.ops.pop(op_id)
+        self.sent_bytes -= len(op.data)
+        return op
+
+    def discard(self, op: InFlightOp) -> None:
+        """
+        Forget an operation, eg. because it was cancelled. Does nothing if it's already
+        forgotten.
+        """
+        if self.ops.pop(op.op_id, None) is None:
+            return
+        if op.tid is None:
+            del self.unsent[op.op_id]
+        else:
+            del self.by_tid[op.tid]
+            self.sent_bytes -= len(op.data)
+
+    def reset_tids(self) -> None:
+        """
+        Forget all transaction IDs, because the connection they were sent over is gone.
+        All operations become unsent.
+        """
+        self.by_tid.clear()
+        self.sent_bytes = 0
+        self.unsent = self.ops.copy()
+        for op in self.ops.values():
+            op.tid = None
@@ -0,0 +1,271 @@
+import collections
+import logging
+import mmap
+import os
+import struct
+import time
+import typing as tp
+import zlib
+
+from ..compression import COMPRESSED, CompressedPayload, wire_type
+from ..protocol import NGTTHeaderType, header_type_for
+
+logger = logging.getLogger(__name__)
+
+#: crc32 of the rest of the record, record ID, kind, packet type and payload length
+RECORD_HEADER = struct.Struct('>LQBHL')
+RECORD_END = 0  # never written, zeroes mark the end of the segment
+RECORD_DATA = 1  # a frame that's waiting to be sent, or for the server's answer
+RECORD_ACK = 2  # the frame with given record ID is done with
+
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+DEFAULT_SYNC_INTERVAL = 0.2
+
+SEGMENT_SUFFIX = '.seg'
+
+#: packet type and payload of a journaled frame
+PendingRecord = tp.Tuple[NGTTHeaderType, bytes]
+
+
+class Segment:
+    """
+    A single, preallocated and memory-mapped file of a
+    :class:`~ngtt.uplink.journal.Journal`
+
+    :ivar seq: sequence number of this segment (int)
+    :ivar unacked: amount of data records here that were not acknowledged yet (int)
+    """
+    __slots__ = ('seq', 'path', 'file', 'mmap', 'offset', 'unacked')
+
+    def __init__(self, directory: str, seq: int, size: int):
+        self.seq = seq
+        self.path = os.path.join(directory, '%016x%s' % (seq, SEGMENT_SUFFIX))
+        self.file = open(self.path, 'a+b')
+        if os.fstat(self.file.fileno()).st_size < size:
+            self.file.truncate(size)
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+        self.offset = 0
+        self.unacked = 0
+
+    def __len__(self) -> int:
+        return len(self.mmap)
+
+    @property
+    def free(self) -> int:
+        return len(self.mmap) - self.offset
+
+    def records(self) -> tp.Iterator[tp.Tuple[int, int, int, bytes]]:
+        """
+        Read the records stored here, stopping at the end of the data or at the first
+        damaged record, and leave offset past the last valid one.
+
+        :return: an iterator of (record ID, kind, packet type, payload)
+        """
+        self.offset = 0
+        while self.free >= RECORD_HEADER.size:
+            crc, record_id, kind, h_type, length = RECORD_HEADER.unpack_from(self.mmap,
+                                                                             self.offset)
+            end = self.offset + RECORD_HEADER.size + length
+            if kind == RECORD_END or end > len(self.mmap):
+                return
+            if zlib.crc32(self.mmap[self.offset + 4:end]) != crc:
+                logger.warning('Damaged record in %s at %s, ignoring the rest of it',
+                               self.path, self.offset)
+                return
+            yield record_id, kind, h_type, self.mmap[self.offset + RECORD_HEADER.size:end]
+            self.offset = end
+
+    def append(self, record_id: int, kind: int, h_type: int, data: bytes) -> None:
+        end = self.offset + RECORD_HEADER.size + len(data)
+        RECORD_HEADER.pack_into(self.mmap, self.offset, 0, record_id, kind, h_type, len(data))
+        self.mmap[self.offset + RECORD_HEADER.size:end] = data
+        struct.pack_into('>L', self.mmap, self.offset,
+                         zlib.crc32(self.mmap[self.offset + 4:end]))
+        self.offset = end
+
+    def sync(self) -> None:
+        self.mmap.flush()
+
+    def close(self) -> None:
+        self.mmap.close()
+        self.file.close()
+
+    def remove(self) -> None:
+        self.close()
+        os.unlink(self.path)
+
+
+class Journal:
+    """
+    An append-only journal of frames, kept in a directory, so that they survive a restart
+    of the process.
+
+    The journal is split into preallocated, memory-mapped segments. Appending a record is
+    just a copy into memory, and the segments are synced to disk at most once per
+    sync_interval, so that the cost of syncing is shared by all records appended in the
+    meantime. Records appended after the last sync can be lost in a crash.
+
+    A record is done with once it's acknowledged. Acknowledgements are journaled too, and
+    a segment is removed once it and all the segments before it contain nothing but
+    acknowledged records.
+
+    A directory must be used by a single journal at a time. This is not thread-safe.
+
+    :param directory: directory to keep the segments in. It will be created if necessary.
+    :param segment_size: size of a single segment in bytes. Records larger than that get a
+        segment of their own.
+    :param sync_interval: maximum amount of seconds between appending a record and syncing
+        it to disk
+    """
+
+    def __init__(self, directory: str, segment_size: int = DEFAULT_SEGMENT_SIZE,
+                 sync_interval: float = DEFAULT_SYNC_INTERVAL):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync_interval = sync_interval
+        self.segments = collections.OrderedDict()  # type: tp.Dict[int, Segment]
+        self.record_segments = {}  # type: tp.Dict[int, Segment]
+        # record ID => offset within its segment, of records appended since opening
+        self.record_offsets = {}  # type: tp.Dict[int, int]
+        # record ID => (packet type, payload)
+        self.pending = collections.OrderedDict()  # type: tp.Dict[int, PendingRecord]
+        self.next_record_id = 1
+        self.sync_at = None  # type: tp.Optional[float]
+        self.recover()
+        self.current = self.new_segment(self.segment_size)
+
+    def recover(self) -> None:
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if not os.path.getsize(path):     # crashed right after creating it
+                os.unlink(path)
+                continue
+            segment = Segment(self.directory, int(name[:-len(SEGMENT_SUFFIX)], 16), 0)
+            self.segments[segment.seq] = segment
+            for record_id, kind, h_type, data in segment.records():
+                self.next_record_id = max(self.next_record_id, record_id + 1)
+                if kind == RECORD_DATA:
+                    if h_type & COMPRESSED:
+                        self.pending[record_id] = (header_type_for(h_type & ~COMPRESSED),
+                                                   CompressedPayload(data))
+                    else:
+                        self.pending[record_id] = header_type_for(h_type), bytes(data)
+                    self.record_segments[record_id] = segment
+                    segment.unacked += 1
+                elif kind == RECORD_ACK and record_id in self.pending:
+                    del self.pending[record_id]
+                    self.record_segments.pop(record_id).unacked -= 1
+        if self.pending:
+            logger.info('Recovered %s records from %s', len(self.pending), self.directory)
+        self.remove_acknowledged_segments(keep_last=False)
+
+    def replay(self) -> tp.List[tp.Tuple[int, NGTTHeaderType, bytes]]:
+        """
+        Return the records that were not acknowledged before this journal was opened.
+        They are to be sent again, and acknowledged once they're done with.
+
+        This can be called only once.
+
+        :return: a list of (record ID, packet type, payload)
+        """
+        pending, self.pending = self.pending, collections.OrderedDict()
+        return [(record_id, h_type, data) for record_id, (h_type, data) in pending.items()]
+
+    def new_segment(self, size: int) -> Segment:
+        seq = next(reversed(self.segments)) + 1 if self.segments else 0
+        segment = Segment(self.directory, seq, size)
+        self.segments[seq] = segment
+        return segment
+
+    def write(self, record_id: int, kind: int, h_type: int, data: bytes) -> Segment:
+        if self.current.free < RECORD_HEADER.size + len(data):
+            self.current.sync()
+            self.current = self.new_segment(max(self.segment_size,
+                                                RECORD_HEADER.size + len(data)))
+            self.remove_acknowledged_segments()
+        self.current.append(record_id, kind, h_type, data)
+        if self.sync_at is None:
+            self.sync_at = time.monotonic() + self.sync_interval
+        return self.current
+
+    def append(self, h_type: NGTTHeaderType, data: bytes) -> int:
+        """
+        Journal a frame
+
+        :return: record ID, to acknowledge it with
+        """
+        record_id = self.next_record_id
+        self.next_record_id += 1
+        segment = self.write(record_id, RECORD_DATA, wire_type(h_type.value, data), data)
+        segment.unacked += 1
+        self.record_segments[record_id] = segment
+        self.record_offsets[record_id] = segment.offset - RECORD_HEADER.size - len(data)
+        return record_id
+
+    def read(self, record_id: int) -> bytes:
+        """
+        Read back the payload of a record appended since this journal was opened, and not
+        acknowledged yet
+
+        :return: a copy of the payload, a CompressedPayload if it was one
+        """
+        segment = self.record_segments[record_id]
+        offset = self.record_offsets[record_id]
+        _, _, _, h_type, length = RECORD_HEADER.unpack_from(segment.mmap, offset)
+        start = offset + RECORD_HEADER.size
+        data = segment.mmap[start:start + length]
+        return CompressedPayload(data) if h_type & COMPRESSED else data
+
+    def ack(self, record_id: int) -> None:
+        """
+        Mark a record as done with. Does nothing if it already is.
+        """
+        segment = self.record_segments.pop(record_id, None)
+        if segment is None:
+            return
+        self.record_offsets.pop(record_id, None)
+        segment.unacked -= 1
+        self.write(record_id, RECORD_ACK, 0, b'')
+
+    def remove_acknowledged_segments(self, keep_last: bool = True) -> None:
+        """
+        Remove segments that, along with all segments before them, contain only
+        acknowledged records. Acknowledgements refer to records in their own or earlier
+        segments, so these are no longer needed.
+        """
+        while len(self.segments) > (1 if keep_last else 0):
+            segment = next(iter(self.segments.values()))
+            if segment.unacked:
+                return
+            del self.segments[segment.seq]
+            segment.remove()
+
+    def sync_if_due(self) -> None:
+        """
+        Sync to disk, if sync_interval has passed since the first record that was not
+        synced yet
+        """
+        if self.sync_at is not None and time.monotonic() >= self.sync_at:
+            self.sync()
+
+    def sync(self) -> None:
+        """
+        Sync everything written so far to disk
+        """
+        self.sync_at = None
+        self.current.sync()
+
+    def close(self) -> None:
+        """
+        Sync and close the journal
+        """
+        if self.current is None:
+            return
+        self.sync()
+        for segment in self.segments.values():
+            segment.close()
+        self.segments.clear()
+        self.current = None
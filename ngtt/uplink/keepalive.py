@@ -0,0 +1,74 @@
+import bisect
+import typing as tp
+
+PING_INTERVAL_TIME = 30
+PING_TIMEOUT = 10
+
+#: upper bounds, in seconds, of the buckets of round-trip times. The last bucket counts
+#: everything above the last bound.
+RTT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Keepalive:
+    """
+    Decides when to ping the server, and keeps track of how long it takes to answer.
+
+    The server is pinged after interval seconds without hearing from it, and the
+    connection is deemed failed if the ping isn't answered within timeout seconds.
+
+    If max_interval is given, the interval doubles after each answered ping, up to
+    max_interval, so that a quiet link is pinged less often. If a ping isn't answered,
+    the interval goes back to interval, and is from then on kept below the one that
+    failed, so that links behind NATs that drop idle connections stay alive.
+
+    One instance is used for all connections of a device, so that the statistics
+    survive reconnects.
+
+    :param interval: seconds of silence after which the server is pinged
+    :param timeout: seconds to wait for an answer to a ping
+    :param max_interval: maximum interval to grow the interval to, or None to keep it fixed
+    :ivar current_interval: seconds of silence after which the server is pinged now (float)
+    :ivar rtt: smoothed round-trip time in seconds, or None if no ping was answered yet
+    :ivar last_rtt: round-trip time of the last answered ping in seconds, or None
+    :ivar histogram: amounts of answered pings, by bucket of
+        :data:`~ngtt.uplink.keepalive.RTT_BUCKETS` (tp.List[int])
+    :ivar timeouts: amount of pings that weren't answered in time (int)
+    """
+    __slots__ = ('interval', 'timeout', 'max_interval', 'current_interval', 'rtt',
+                 'last_rtt', 'histogram', 'timeouts')
+
+    #: weight of the newest sample in the smoothed round-trip time, as in TCP
+    ALPHA = 0.125
+
+    def __init__(self, interval: float = PING_INTERVAL_TIME, timeout: float = PING_TIMEOUT,
+                 max_interval: tp.Optional[float] = None):
+        self.interval = interval
+        self.timeout = timeout
+        self.max_interval = max_interval
+        self.current_interval = interval
+        self.rtt = None  # type: tp.Optional[float]
+        self.last_rtt = None  # type: tp.Optional[float]
+        self.histogram = [0] * (len(RTT_BUCKETS) + 1)
+        self.timeouts = 0
+
+    def answered(self, rtt: float) -> None:
+        """
+        Note that a ping was answered after rtt seconds
+        """
+        self.last_rtt = rtt
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            self.rtt += self.ALPHA * (rtt - self.rtt)
+        self.histogram[bisect.bisect_left(RTT_BUCKETS, rtt)] += 1
+        if self.max_interval is not None:
+            self.current_interval = min(self.current_interval * 2, self.max_interval)
+
+    def timed_out(self) -> None:
+        """
+        Note that a ping wasn't answered in time
+        """
+        self.timeouts += 1
+        if self.max_interval is not None and self.current_interval > self.interval:
+            self.max_interval = max(self.interval, self.current_interval / 2)
+        self.current_interval = self.interval
@@ -0,0 +1,135 @@
+import collections
+import struct
+import time
+import typing as tp
+
+DEFAULT_MAX_BYTES = 64 * 1024
+DEFAULT_MAX_LATENCY = 0.2
+DEFAULT_MAX_BUFFERED = 1024 * 1024
+
+STRUCT_H = struct.Struct('>H')
+STRUCT_L = struct.Struct('>L')
+
+
+def split_list(data: bytes) -> tp.Tuple[int, memoryview]:
+    """
+    Split a list serialized with minijson into the amount of its elements and their
+    serialized form
+
+    :raises ValueError: data is not a serialized list
+    """
+    view = memoryview(data)
+    tag = data[0]
+    if 0x40 <= tag <= 0x4F:
+        return tag & 0x0F, view[1:]
+    elif tag == 0x07:
+        return data[1], view[2:]
+    elif tag == 0x0F:
+        return STRUCT_H.unpack_from(data, 1)[0], view[3:]
+    elif tag == 0x10:
+        return STRUCT_L.unpack_from(data, 1)[0], view[5:]
+    raise ValueError('Not a list')
+
+
+def list_header(count: int) -> bytes:
+    """
+    Return the minijson header of a list with given amount of elements
+    """
+    if count < 16:
+        return bytes((0x40 | count, ))
+    elif count < 256:
+        return bytes((0x07, count))
+    elif count < 65536:
+        return b'\x0F' + STRUCT_H.pack(count)
+    return b'\x10' + STRUCT_L.pack(count)
+
+
+class LogBatcher:
+    """
+    Merges logs passed to many calls to stream_logs into a single LOGS frame.
+
+    The logs are merged without decoding them, by concatenating the serialized entries.
+    A batch is sent once it reaches max_bytes, or max_latency seconds after its first
+    entry was added, whichever comes first. While the logs can't be sent, at most
+    max_buffered bytes of them are kept, and the oldest ones are dropped to make room.
+
+    This is not thread-safe, it's meant to be used by the thread that drives the device.
+
+    :param max_bytes: size of a batch that is sent right away
+    :param max_latency: maximum amount of seconds that logs wait for a batch to fill up
+    :param max_buffered: maximum amount of bytes of logs to keep, or None for no limit
+    :ivar dropped: amount of log entries dropped so far (int)
+    """
+    __slots__ = ('max_bytes', 'max_latency', 'max_buffered', 'entries', 'count', 'size',
+                 'due_at', 'dropped')
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_latency: float = DEFAULT_MAX_LATENCY,
+                 max_buffered: tp.Optional[int] = DEFAULT_MAX_BUFFERED):
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.max_buffered = max_buffered
+        self.entries = collections.deque()  # type: tp.Deque[tp.Tuple[int, memoryview]]
+        self.count = 0
+        self.size = 0
+        self.due_at = None  # type: tp.Optional[float]
+        self.dropped = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.entries)
+
+    @property
+    def full(self) -> bool:
+        """
+        Whether there's enough logs to send a batch right away
+        """
+        return self.size >= self.max_bytes
+
+    @property
+    def due(self) -> bool:
+        """
+        Whether a batch should be sent now
+        """
+        return self.full or (self.due_at is not None and time.monotonic() >= self.due_at)
+
+    def add(self, data: bytes) -> None:
+        """
+        Add logs
+
+        :param data: a list of log entries, serialized with minijson
+        """
+        count, entries = split_list(data)
+        if not count:
+            return
+        self.entries.append((count, entries))
+        self.count += count
+        self.size += len(entries)
+        if self.due_at is None:
+            self.due_at = time.monotonic() + self.max_latency
+        if self.max_buffered is not None:
+            while self.size > self.max_buffered and len(self.entries) > 1:
+                count, entries = self.entries.popleft()
+                self.count -= count
+                self.size -= len(entries)
+                self.dropped += count
+
+    def pop_batch(self) -> tp.Optional[bytes]:
+        """
+        Return a batch of at least max_bytes of logs, or less if that's all there is, as
+        a single minijson list, or None if there are no logs.
+        """
+        if not self.entries:
+            return None
+        count = 0
+        parts = []
+        size = 0
+        while self.entries and size < self.max_bytes:
+            entry_count, entries = self.entries.popleft()
+            count += entry_count
+            size += len(entries)
+            parts.append(entries)
+        self.count -= count
+        self.size -= size
+        self.due_at = time.monotonic() + self.max_latency if self.entries else None
+        parts.insert(0, list_header(count))
+        return b''.join(parts)
@@ -0,0 +1,176 @@
+import collections
+import heapq
+import itertools
+import logging
+import selectors
+import threading
+import time
+import typing as tp
+
+from ..exceptions import ConnectionFailed
+from .outbox import Waker
+
+logger = logging.getLogger(__name__)
+
+
+class NGTTEventLoop:
+    """
+    A selector-based event loop that drives any number of devices from a single thread.
+
+    Devices tell the loop when they need to be woken up via
+    :meth:`~ngtt.uplink.device.NGTTDevice.next_deadline`, and the loop keeps these
+    deadlines in a heap, so an iteration costs time proportional to the amount of devices
+    that actually had something happen, not to the amount of devices in total.
+
+    Only :meth:`~ngtt.uplink.loop.NGTTEventLoop.add`,
+    :meth:`~ngtt.uplink.loop.NGTTEventLoop.remove` and
+    :meth:`~ngtt.uplink.loop.NGTTEventLoop.call_soon` are safe to call from other threads.
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.waker = Waker()
+        self.selector.register(self.waker, selectors.EVENT_READ)
+        self.devices = set()  # type: tp.Set[NGTTDevice]
+        self.assigned = 0  # amount of devices added, including these that are not added yet
+        self.timers = []  # type: tp.List[tp.Tuple[float, int, NGTTDevice]]
+        self.timer_counter = itertools.count()
+        self.commands = collections.deque()  # type: tp.Deque[tp.Callable[[], None]]
+        self.thread_id = None  # type: tp.Optional[int]
+
+    def __len__(self) -> int:
+        return self.assigned
+
+    def call_soon(self, fun: tp.Callable[[], None]) -> None:
+        """
+        Have fun called in the loop's thread
+        """
+        self.commands.append(fun)
+        self.waker.wake()
+
+    def add(self, device: 'NGTTDevice') -> None:
+        """
+        Start driving a device. It will connect as soon as possible.
+        """
+        self.assigned += 1
+        self.call_soon(lambda: self._add(device))
+
+    def remove(self, device: 'NGTTDevice') -> None:
+        """
+        Disconnect a device and stop driving it
+        """
+        self.assigned -= 1
+        self.call_soon(lambda: self._remove(device))
+
+    def _add(self, device: 'NGTTDevice') -> None:
+        self.devices.add(device)
+        self.schedule(device, time.monotonic())
+
+    def _remove(self, device: 'NGTTDevice') -> None:
+        self.devices.discard(device)
+        device.abandon()
+
+    def schedule(self, device: 'NGTTDevice', deadline: float) -> None:
+        """
+        Make sure that the device's on_timer will be called no later than at deadline.
+
+        Only the earliest deadline of each device is kept in the heap, stale entries are
+        skipped when they are popped.
+        """
+        if device.timer_at is None or deadline < device.timer_at:
+            device.timer_at = deadline
+            heapq.heappush(self.timers, (deadline, next(self.timer_counter), device))
+
+    def update_socket(self, device: 'NGTTDevice') -> None:
+        """
+        Bring the selector registration of device's socket up to date
+        """
+        conn = device.current_connection
+        events = conn.events if conn is not None and (conn.connected or conn.connecting) \
+            else 0
+        if conn is not device.registered_connection or not events:
+            self.unregister_socket(device)
+        if not events or events == device.socket_events:
+            return
+        if device.registered_connection is None:
+            self.selector.register(conn, events, device)
+            device.registered_connection = conn
+        else:
+            self.selector.modify(conn, events, device)
+        device.socket_events = events
+
+    def unregister_socket(self, device: 'NGTTDevice') -> None:
+        """
+        Remove device's socket from the selector. Must be done before the socket is closed.
+        """
+        if device.registered_connection is not None:
+            self.selector.unregister(device.registered_connection)
+            device.registered_connection = None
+            device.socket_events = 0
+
+    def run_device(self, device: 'NGTTDevice', fun: tp.Callable, *args) -> None:
+        """
+        Run fun on behalf of device, handling connection failures, send whatever it has
+        queued and then bring device's registration and timer up to date.
+        """
+        try:
+            fun(*args)
+            device.flush()
+        except ConnectionFailed as e:
+            logger.debug('Connection failed, retrying', exc_info=e)
+            device.connection_failed()
+        except Exception as e:
+            logger.error('Error while handling a device, reconnecting', exc_info=e)
+            device.connection_failed()
+            device.backoff.failed()
+        if device not in self.devices:
+            return
+        self.update_socket(device)
+        deadline = device.next_deadline()
+        if deadline is not None:
+            self.schedule(device, deadline)
+
+    def process_wakeup(self) -> None:
+        self.waker.drain()
+        while self.commands:
+            self.commands.popleft()()
+        ready = self.waker.ready
+        while ready:
+            outbox = ready.popleft()
+            outbox.flagged = False
+            if outbox.owner in self.devices:
+                self.run_device(outbox.owner, outbox.owner.process_outbox)
+
+    def run_once(self) -> None:
+        """
+        Run timers that are due, wait for events and process them
+        """
+        self.thread_id = threading.get_ident()
+        now = time.monotonic()
+        timers = self.timers
+        while timers and timers[0][0] <= now:
+            deadline, _, device = heapq.heappop(timers)
+            if device.timer_at != deadline or device not in self.devices:
+                continue
+            device.timer_at = None
+            self.run_device(device, device.on_timer)
+
+        timeout = max(0.0, timers[0][0] - time.monotonic()) if timers else None
+        for key, events in self.selector.select(timeout):
+            if key.fileobj is self.waker:
+                self.process_wakeup()
+            elif key.data in self.devices:
+                self.run_device(key.data, key.data.handle_socket_events, events)
+
+    def close(self) -> None:
+        """
+        Disconnect all devices and release the loop's resources. To be called from the loop's
+        thread, or after it has terminated.
+        """
+        while self.commands:
+            self.commands.popleft()()
+        devices, self.devices = self.devices, set()
+        for device in devices:
+            device.abandon()
+        self.selector.close()
+        self.waker.close()
@@ -0,0 +1,157 @@
+import bisect
+import collections
+import threading
+import time
+import typing as tp
+from concurrent.futures import Future
+
+from ..protocol import NGTTHeaderType
+
+#: upper bounds, in seconds, of the buckets of latency histograms. The last bucket counts
+#: everything above the last bound.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """
+    Counts of values, by bucket
+
+    :param buckets: upper bounds of the buckets, in ascending order
+    :ivar counts: amount of values in every bucket, one more than there are bounds, for the
+        values above the last one (tp.List[int])
+    :ivar count: amount of values (int)
+    :ivar total: sum of values (float)
+    """
+    __slots__ = ('buckets', 'counts', 'count', 'total')
+
+    def __init__(self, buckets: tp.Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    @property
+    def mean(self) -> tp.Optional[float]:
+        """
+        :return: mean of the values, or None if there are none
+        """
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q: float) -> tp.Optional[float]:
+        """
+        :param q: quantile to return, between 0 and 1
+        :return: upper bound of the bucket that the quantile falls into, infinity if it's
+            the last one, or None if there are no values
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """
+    Counts what a device does. Pass one as metrics to a device to enable it, devices
+    without one don't measure anything.
+
+    Counters only grow, so frames and bytes per second are obtained by sampling them
+    periodically. To export them, eg. to Prometheus, override the methods below, calling
+    the original ones to keep the numbers here.
+
+    This is thread-safe, and can be shared by many devices to add up their numbers.
+
+    :ivar frames_sent: frames sent, by packet type (tp.Counter[NGTTHeaderType])
+    :ivar bytes_sent: bytes sent, including headers, by packet type
+        (tp.Counter[NGTTHeaderType])
+    :ivar frames_received: frames received, by packet type (tp.Counter[NGTTHeaderType])
+    :ivar bytes_received: bytes received, including headers, by packet type
+        (tp.Counter[NGTTHeaderType])
+    :ivar latency: seconds from submitting an operation, eg. calling sync_pathpoints, to its
+        future being resolved, by packet type (tp.Dict[NGTTHeaderType, Histogram])
+    :ivar failed: operations that failed, by packet type (tp.Counter[NGTTHeaderType])
+    :ivar order_handling: seconds spent in on_new_order (Histogram)
+    :ivar connects: amount of connections established (int)
+    :ivar connection_failures: amount of connections that failed, or failed to be
+        established (int)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames_sent = collections.Counter()  # type: tp.Counter[NGTTHeaderType]
+        self.bytes_sent = collections.Counter()  # type: tp.Counter[NGTTHeaderType]
+        self.frames_received = collections.Counter()  # type: tp.Counter[NGTTHeaderType]
+        self.bytes_received = collections.Counter()  # type: tp.Counter[NGTTHeaderType]
+        self.latency = {}  # type: tp.Dict[NGTTHeaderType, Histogram]
+        self.failed = collections.Counter()  # type: tp.Counter[NGTTHeaderType]
+        self.order_handling = Histogram()
+        self.connects = 0
+        self.connection_failures = 0
+
+    def frame_sent(self, h_type: NGTTHeaderType, size: int) -> None:
+        """
+        Called when a frame of size bytes is queued to be sent
+        """
+        with self.lock:
+            self.frames_sent[h_type] += 1
+            self.bytes_sent[h_type] += size
+
+    def frame_received(self, h_type: NGTTHeaderType, size: int) -> None:
+        """
+        Called when a frame of size bytes is received
+        """
+        with self.lock:
+            self.frames_received[h_type] += 1
+            self.bytes_received[h_type] += size
+
+    def op_completed(self, h_type: NGTTHeaderType, latency: float, succeeded: bool) -> None:
+        """
+        Called when the future of an operation is resolved, latency seconds after it was
+        submitted
+        """
+        with self.lock:
+            if h_type not in self.latency:
+                self.latency[h_type] = Histogram()
+            self.latency[h_type].observe(latency)
+            if not succeeded:
+                self.failed[h_type] += 1
+
+    def order_handled(self, duration: float) -> None:
+        """
+        Called after on_new_order returns, having taken duration seconds
+        """
+        with self.lock:
+            self.order_handling.observe(duration)
+
+    def connected(self) -> None:
+        """
+        Called when a connection is established
+        """
+        with self.lock:
+            self.connects += 1
+
+    def connection_failed(self) -> None:
+        """
+        Called when a connection fails, or fails to be established
+        """
+        with self.lock:
+            self.connection_failures += 1
+
+    def watch(self, h_type: NGTTHeaderType, fut: Future, submitted_at: float) -> None:
+        """
+        Call :meth:`~ngtt.uplink.metrics.Metrics.op_completed` once fut is resolved
+        """
+        def on_done(fut):
+            succeeded = not fut.cancelled() and fut.exception() is None
+            self.op_completed(h_type, time.monotonic() - submitted_at, succeeded)
+
+        fut.add_done_callback(on_done)
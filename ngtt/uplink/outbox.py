@@ -0,0 +1,124 @@
+import collections
+import socket
+import typing as tp
+from concurrent.futures import Future
+
+from satella.coding import silence_excs
+
+from ..protocol import NGTTHeaderType
+
+#: header, data, transaction ID, a future if this is an operation and a callable to call
+#: once the operation is sent
+OutboxEntry = tp.Tuple[NGTTHeaderType, bytes, int, tp.Optional[Future],
+                       tp.Optional[tp.Callable[[], None]]]
+
+
+class Waker:
+    """
+    A socket pair that can be waited upon by select() to wake up the IO thread.
+
+    Waking up is cheap if the IO thread has already been woken up, as only the first
+    :meth:`~ngtt.uplink.outbox.Waker.wake` since last :meth:`~ngtt.uplink.outbox.Waker.drain`
+    writes to the socket.
+
+    A single waker can be shared by many outboxes. The outboxes that have something queued
+    are put into :attr:`ready`, so that the IO thread doesn't need to check all of them.
+
+    :ivar ready: outboxes that have entries to process (tp.Deque[Outbox])
+    """
+
+    def __init__(self):
+        self.r_sock, self.w_sock = socket.socketpair()
+        self.r_sock.setblocking(False)
+        self.w_sock.setblocking(False)
+        self.signalled = False
+        self.ready = collections.deque()  # type: tp.Deque[Outbox]
+
+    def fileno(self) -> int:
+        return self.r_sock.fileno()
+
+    @silence_excs(OSError)
+    def wake(self) -> None:
+        """
+        Wake up the IO thread. Can be called from any thread.
+        """
+        if not self.signalled:
+            self.signalled = True
+            self.w_sock.send(b'\x00')
+
+    def drain(self) -> None:
+        """
+        Consume the wake-up signal. To be called by the IO thread before it processes what
+        it was woken up for.
+        """
+        with silence_excs(OSError):
+            while self.r_sock.recv(4096):
+                pass
+        self.signalled = False
+
+    def close(self) -> None:
+        self.r_sock.close()
+        self.w_sock.close()
+
+
+class Outbox:
+    """
+    A multi-producer, single-consumer queue of frames to be sent by the IO thread.
+
+    Any thread can put frames there, and only the IO thread touches the socket.
+    Appending to and popping from a deque is atomic, so producers don't need a lock.
+
+    The IO thread should set :attr:`flagged` to False before it pops the entries.
+
+    :param waker: waker to signal after a frame has been queued
+    :param owner: object that processes this outbox, for the IO thread's use
+    :ivar flagged: whether this outbox has been put into the waker's ready queue
+    """
+
+    def __init__(self, waker: Waker, owner: tp.Optional[object] = None):
+        self.waker = waker
+        self.owner = owner
+        self.flagged = False
+        self.queue = collections.deque()  # type: tp.Deque[OutboxEntry]
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+    def send_frame(self, tid: int, header: NGTTHeaderType, data: bytes = b'') -> None:
+        """
+        Queue a frame with a given transaction ID. It will be dropped if the connection
+        is not established at the time the IO thread gets to it.
+        """
+        self.queue.append((header, data, tid, None, None))
+        self.signal()
+
+    def submit(self, header: NGTTHeaderType, data: bytes, fut: Future,
+               on_sent: tp.Optional[tp.Callable[[], None]] = None) -> None:
+        """
+        Queue an operation that will receive a transaction ID from the IO thread, and
+        a reply to which will complete fut.
+
+        :param on_sent: callable to call in the IO thread once the operation is first sent
+        """
+        self.queue.append((header, data, 0, fut, on_sent))
+        self.signal()
+
+    def signal(self) -> None:
+        """
+        Tell the IO thread that this outbox has entries to process
+        """
+        if not self.flagged:
+            self.flagged = True
+            self.waker.ready.append(self)
+        self.waker.wake()
+
+    def pop(self) -> tp.Optional[OutboxEntry]:
+        """
+        Return the oldest queued entry, or None if there are none. Every entry is returned
+        exactly once, even if this is called from many threads, but normally only the IO
+        thread does that.
+        """
+        try:
+            return self.queue.popleft()
+        except IndexError:
+            return None
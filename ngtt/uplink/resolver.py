@@ -0,0 +1,84 @@
+import logging
+import socket
+import threading
+import time
+import typing as tp
+
+logger = logging.getLogger(__name__)
+
+#: how long, in seconds, a resolved address is used for before resolving it again
+DEFAULT_TTL = 300
+
+Address = tp.Tuple[str, int]
+Callback = tp.Callable[[tp.Optional[Address]], None]
+
+
+class Resolver:
+    """
+    Resolves host names in background threads, so that event loops never block on
+    getaddrinfo, and caches the results for ttl seconds.
+
+    Devices that want the same host while it's being resolved share a single lookup.
+    Failures are not cached. The threads are daemonic, so a lookup that hangs doesn't
+    keep the process from exiting.
+
+    This is thread-safe.
+
+    :param ttl: seconds to use a resolved address for
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.cache = {}  # type: tp.Dict[Address, tp.Tuple[float, Address]]
+        self.pending = {}  # type: tp.Dict[Address, tp.List[Callback]]
+
+    def get(self, host: str, port: int) -> tp.Optional[Address]:
+        """
+        :return: a cached address of host, or None if it needs to be resolved
+        """
+        with self.lock:
+            entry = self.cache.get((host, port))
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def forget(self, host: str, port: int) -> None:
+        """
+        Drop the cached address of host, eg. because connecting to it failed
+        """
+        with self.lock:
+            self.cache.pop((host, port), None)
+
+    def resolve(self, host: str, port: int, callback: Callback) -> None:
+        """
+        Resolve host in the background
+
+        :param callback: callable to call, in a background thread, with the address, or
+            with None if it couldn't be resolved
+        """
+        key = host, port
+        with self.lock:
+            if key in self.pending:
+                self.pending[key].append(callback)
+                return
+            self.pending[key] = [callback]
+        threading.Thread(target=self.run, args=key, name='ngtt resolver', daemon=True).start()
+
+    def run(self, host: str, port: int) -> None:
+        address = None
+        try:
+            address = socket.getaddrinfo(host, port, socket.AF_INET,
+                                         socket.SOCK_STREAM)[0][4]
+        except (OSError, IndexError) as e:
+            logger.warning('Failure resolving %s', host, exc_info=e)
+        with self.lock:
+            if address is not None:
+                self.cache[host, port] = time.monotonic() + self.ttl, address
+            callbacks = self.pending.pop((host, port))
+        for callback in callbacks:
+            callback(address)
+
+
+#: the resolver shared by all devices
+resolver = Resolver()
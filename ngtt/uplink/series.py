@@ -0,0 +1,119 @@
+import sys
+import typing as tp
+
+import minijson
+
+from .logs import list_header
+
+#: minijson tags of numbers of given memoryview format kind and size
+INT_TAGS = {1: b'\x03', 2: b'\x02', 4: b'\x01', 8: b'\x18\x08'}
+UINT_TAGS = {1: b'\x06', 2: b'\x05', 4: b'\x04', 8: b'\x18\x09\x00'}
+FLOAT_TAGS = {4: b'\x09', 8: b'\x0A'}
+TAGS = {'b': INT_TAGS, 'h': INT_TAGS, 'i': INT_TAGS, 'l': INT_TAGS, 'q': INT_TAGS,
+        'B': UINT_TAGS, 'H': UINT_TAGS, 'I': UINT_TAGS, 'L': UINT_TAGS, 'Q': UINT_TAGS,
+        'f': FLOAT_TAGS, 'd': FLOAT_TAGS}
+
+SAMPLE_START = b'\x52\x09timestamp'
+VALUE_KEY = b'\x05value'
+
+
+class Column:
+    """
+    A buffer of numbers, as big-endian minijson numbers of a single tag
+
+    :raises TypeError: buffer does not support the buffer protocol
+    :raises ValueError: buffer is not a contiguous, one-dimensional array of numbers
+    """
+    __slots__ = ('tag', 'itemsize', 'raw', 'little_endian')
+
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        fmt = view.format
+        byte_order = '@'
+        if fmt[0] in '@=<>!':
+            byte_order, fmt = fmt[0], fmt[1:]
+        if view.ndim != 1 or not view.c_contiguous or fmt not in TAGS or \
+                view.itemsize not in TAGS[fmt]:
+            raise ValueError('Expected a contiguous, one-dimensional array of numbers, '
+                             'got format %s' % (view.format, ))
+        self.tag = TAGS[fmt][view.itemsize]
+        self.itemsize = view.itemsize
+        self.raw = view.cast('B')
+        self.little_endian = byte_order == '<' or \
+            (byte_order in '@=' and sys.byteorder == 'little')
+
+    def __len__(self) -> int:
+        return len(self.raw) // self.itemsize
+
+    def write_into(self, out: bytearray, offset: int, stride: int) -> None:
+        """
+        Write the numbers, as big-endian, into every stride-th position of out, starting
+        at offset
+        """
+        for i in range(self.itemsize):
+            src = self.itemsize - 1 - i if self.little_endian else i
+            out[offset + i::stride] = self.raw[src::self.itemsize].tobytes()
+
+
+class PathpointSeries:
+    """
+    Values of a single pathpoint, kept in two columns of numbers, to be passed to
+    sync_pathpoints along with, or instead of, dicts in the POST /v1/device/ format.
+
+    It is encoded to exactly the same structure as
+    {'path': path, 'values': [{'timestamp': timestamp, 'value': value}, ...]}, but straight
+    from the buffers, without creating a Python object per sample. Floats are encoded with
+    the precision of their buffer.
+
+    :param path: name of the pathpoint
+    :param timestamps: timestamps, eg. an array.array('q') or a NumPy array
+    :param values: values, eg. an array.array('d') or a NumPy array
+    :raises ValueError: a buffer is not a contiguous, one-dimensional array of numbers, or
+        the buffers have different lengths
+    """
+    __slots__ = ('path', 'timestamps', 'values')
+
+    def __init__(self, path: str, timestamps, values):
+        self.path = path
+        self.timestamps = Column(timestamps)
+        self.values = Column(values)
+        if len(self.timestamps) != len(self.values):
+            raise ValueError('There are %s timestamps but %s values' % (
+                len(self.timestamps), len(self.values)))
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def encode(self) -> bytes:
+        """
+        Return this, serialized with minijson
+        """
+        count = len(self)
+        ts_at = len(SAMPLE_START) + len(self.timestamps.tag)
+        value_tag_at = ts_at + self.timestamps.itemsize + len(VALUE_KEY)
+        value_at = value_tag_at + len(self.values.tag)
+        stride = value_at + self.values.itemsize
+
+        samples = bytearray(stride * count)
+        constant_columns = {}  # type: tp.Dict[int, bytes]
+        for offset, constant in ((0, SAMPLE_START + self.timestamps.tag),
+                                 (ts_at + self.timestamps.itemsize,
+                                  VALUE_KEY + self.values.tag)):
+            for i, byte in enumerate(constant):
+                if byte not in constant_columns:
+                    constant_columns[byte] = bytes((byte, )) * count
+                samples[offset + i::stride] = constant_columns[byte]
+        self.timestamps.write_into(samples, ts_at, stride)
+        self.values.write_into(samples, value_at, stride)
+        return b''.join((b'\x52\x04path', minijson.dumps(self.path), b'\x06values',
+                         list_header(count), samples))
+
+
+def encode_pathpoints(data: tp.List) -> bytes:
+    """
+    Serialize a list of pathpoint entries with minijson, encoding
+    :class:`~ngtt.uplink.series.PathpointSeries` straight from their buffers
+    """
+    return list_header(len(data)) + b''.join(
+        entry.encode() if isinstance(entry, PathpointSeries) else minijson.dumps(entry)
+        for entry in data)
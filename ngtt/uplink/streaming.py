@@ -0,0 +1,78 @@
+import typing as tp
+
+import minijson
+
+from ..protocol import StreamedPayload
+from .logs import list_header
+from .series import PathpointSeries
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def encode_entry(entry) -> bytes:
+    return entry.encode() if isinstance(entry, PathpointSeries) else minijson.dumps(entry)
+
+
+class PathpointStream(StreamedPayload):
+    """
+    Pathpoint entries to be sent as a DATA_STREAM, encoded as they are sent, so that they
+    are never all in memory at once. sync_pathpoints wraps anything that is not a list or
+    a tuple in this, eg.:
+
+    >>> conn.sync_pathpoints(PathpointStream(read_backlog_entries(), chunk_size=256 * 1024))
+
+    The entries are iterated over right away, to compute the size of the payload, and then
+    every time the DATA_STREAM is sent, which is again after every reconnect. So they must
+    yield the same entries every time, eg. an object whose __iter__ reads them from a file,
+    and then only about chunk_size bytes of them are in memory. An iterator, such as a
+    generator, can be iterated over only once, so it's encoded into memory right away,
+    which still takes far less than the entries themselves.
+
+    If iterating over the entries again gives something else, the connection fails, and the
+    DATA_STREAM is tried again.
+
+    :param entries: pathpoint entries, the same as list elements passed to sync_pathpoints
+    :param chunk_size: amount of encoded bytes to hand to the connection at once
+    :ivar count: amount of entries (int)
+    """
+    __slots__ = ('entries', 'encoded', 'count', 'size', 'chunk_size')
+
+    def __init__(self, entries: tp.Iterable, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.count = 0
+        self.entries = None  # type: tp.Optional[tp.Iterable]
+        self.encoded = None  # type: tp.Optional[tp.List[bytearray]]
+        if iter(entries) is entries:
+            self.encoded = list(self.encode(entries))
+            size = sum(len(chunk) for chunk in self.encoded)
+        else:
+            self.entries = entries
+            size = sum(len(chunk) for chunk in self.encode(entries))
+        self.size = len(list_header(self.count)) + size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def encode(self, entries: tp.Iterable) -> tp.Iterator[bytearray]:
+        """
+        Encode entries into chunks of at least chunk_size bytes, except for the last one,
+        counting them
+        """
+        count = 0
+        chunk = bytearray()
+        for entry in entries:
+            chunk += encode_entry(entry)
+            count += 1
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = bytearray()
+        if chunk:
+            yield chunk
+        self.count = count
+
+    def chunks(self) -> tp.Iterator[tp.Union[bytes, bytearray]]:
+        yield list_header(self.count)
+        if self.encoded is not None:
+            yield from self.encoded
+        else:
+            yield from self.encode(self.entries)
@@ -0,0 +1,73 @@
+from ..exceptions import TidsExhausted
+
+#: largest transaction ID, as they are sent as an unsigned short
+MAX_TID = 0xFFFF
+
+
+class TidAllocator:
+    """
+    Allocates transaction IDs of a single connection.
+
+    IDs are handed out in increasing order, skipping the ones still in use, and wrap around
+    after :data:`~ngtt.uplink.tids.MAX_TID`, so that an ID is not reused right after it was
+    freed. 0 is never handed out, as it's the ID of LOGS.
+
+    IDs in use are kept in a bitmap of 8 KiB. Allocating is O(1) amortised as long as IDs
+    are freed roughly in the order they were allocated, which is the case for operations
+    answered by the server.
+    """
+    __slots__ = ('bitmap', 'next_tid', 'allocated')
+
+    def __init__(self):
+        self.bitmap = bytearray(MAX_TID // 8 + 1)
+        self.bitmap[0] = 1  # 0 is reserved
+        self.next_tid = 1
+        self.allocated = 0
+
+    def __len__(self) -> int:
+        """
+        :return: amount of IDs in use
+        """
+        return self.allocated
+
+    def __contains__(self, tid: int) -> bool:
+        return bool(self.bitmap[tid >> 3] & (1 << (tid & 7)))
+
+    @property
+    def exhausted(self) -> bool:
+        """
+        :return: whether every ID is in use, so that allocate would raise
+        """
+        return self.allocated == MAX_TID
+
+    def allocate(self) -> int:
+        """
+        :return: an ID that is not in use
+        :raises TidsExhausted: every ID is in use
+        """
+        if self.allocated == MAX_TID:
+            raise TidsExhausted('All %s transaction IDs are in use' % (MAX_TID,))
+        bitmap = self.bitmap
+        index = self.next_tid >> 3
+        # treat the IDs before next_tid in its byte as used, they are checked after wrapping
+        byte = bitmap[index] | ((1 << (self.next_tid & 7)) - 1)
+        while byte == 0xFF:
+            index += 1
+            if index == len(bitmap):
+                index = 0
+            byte = bitmap[index]
+        bit = (~byte & (byte + 1)).bit_length() - 1
+        bitmap[index] |= 1 << bit
+        tid = index << 3 | bit
+        self.next_tid = tid + 1 if tid < MAX_TID else 1
+        self.allocated += 1
+        return tid
+
+    def free(self, tid: int) -> None:
+        """
+        Return an ID for reuse. Does nothing if it's not in use.
+        """
+        mask = 1 << (tid & 7)
+        if tid and self.bitmap[tid >> 3] & mask:
+            self.bitmap[tid >> 3] &= ~mask
+            self.allocated -= 1
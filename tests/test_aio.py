@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+
+from ngtt.exceptions import ConnectionFailed
+from ngtt.protocol import NGTTHeaderType
+from ngtt.testing import NGTTTestServer, TestCertificates
+from ngtt.uplink.aio import NGTTAsyncConnection
+from ngtt.uplink.keepalive import Keepalive
+
+
+class TestAsyncConnection(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.certificates = TestCertificates()
+        cls.server = NGTTTestServer(cls.certificates)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate().join()
+
+    def test_connection(self):
+        async def run():
+            async with NGTTAsyncConnection(*self.certificates.device('aio'), host='localhost',
+                                           port=self.server.port,
+                                           ca_file=self.certificates.ca_file) as conn:
+                await asyncio.wait_for(asyncio.gather(*[
+                    conn.sync_pathpoints([{'path': 'W1', 'values': [
+                        {'timestamp': i, 'value': i}]}]) for i in range(100)]), 10)
+                self.assertEqual(await asyncio.wait_for(conn.sync_baobs({}), 10),
+                                 {'download': [], 'upload': []})
+                await conn.stream_logs([{'service': 'test', 'content': 'hello'}])
+                self.server.send_order({'uuid': 'test'})
+                order = await asyncio.wait_for(conn.__anext__(), 10)
+                self.assertEqual(order.data, {'uuid': 'test'})
+                order.acknowledge()
+
+                # drop the connection on the server's side, it should reconnect
+                self.server.call_soon(lambda: [self.server.drop(client)
+                                               for client in list(self.server.clients)])
+                await asyncio.wait_for(conn.sync_pathpoints([]), 10)
+
+        self.run_coroutine(run())
+
+    def run_coroutine(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_keeps_pinging(self):
+        async def run():
+            pings = self.server.received[NGTTHeaderType.PING]
+            async with NGTTAsyncConnection(*self.certificates.device('aio-ping'),
+                                           host='localhost', port=self.server.port,
+                                           ca_file=self.certificates.ca_file,
+                                           keepalive=keepalive):
+                await asyncio.sleep(1)
+            return self.server.received[NGTTHeaderType.PING] - pings
+
+        keepalive = Keepalive(interval=0.1)
+        self.assertGreaterEqual(self.run_coroutine(run()), 3)
+        self.assertIsNotNone(keepalive.rtt)
+
+    def test_unanswered_ping_fails_the_connection(self):
+        async def run():
+            async with NGTTAsyncConnection(*self.certificates.device('aio-keepalive'),
+                                           host='localhost', port=self.server.port,
+                                           ca_file=self.certificates.ca_file,
+                                           keepalive=keepalive) as conn:
+                await asyncio.wait_for(conn.sync_pathpoints([]), 10)
+                self.server.answer_pings = False
+                for _ in range(100):
+                    if keepalive.timeouts:
+                        break
+                    await asyncio.sleep(0.1)
+                self.server.answer_pings = True
+                await asyncio.wait_for(conn.sync_pathpoints([]), 10)
+
+        keepalive = Keepalive(interval=0.1, timeout=0.3)
+        try:
+            self.run_coroutine(run())
+        finally:
+            self.server.answer_pings = True
+        self.assertGreaterEqual(keepalive.timeouts, 1)
+
+    def test_close_fails_pending_operations(self):
+        async def run():
+            conn = NGTTAsyncConnection(*self.certificates.device('aio-closed'),
+                                       host='localhost', port=1,
+                                       ca_file=self.certificates.ca_file)
+            await conn.start()
+            sync = asyncio.ensure_future(conn.sync_pathpoints([]))
+            orders = asyncio.ensure_future(conn.__anext__())
+            await asyncio.sleep(0.1)
+            await conn.close()
+            with self.assertRaises(ConnectionFailed):
+                await asyncio.wait_for(sync, 5)
+            with self.assertRaises(StopAsyncIteration):
+                await asyncio.wait_for(orders, 5)
+            with self.assertRaises(ConnectionFailed):
+                await conn.sync_pathpoints([])
+
+        self.run_coroutine(run())
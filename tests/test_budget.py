@@ -0,0 +1,57 @@
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+
+from ngtt.uplink.budget import MemoryBudget, BLOCK, FAIL, SPILL
+
+
+class TestMemoryBudget(unittest.TestCase):
+    def test_fail(self):
+        budget = MemoryBudget(100, FAIL)
+        first, second = Future(), Future()
+        self.assertTrue(budget.admit(first, 1000, False, True))
+        self.assertFalse(budget.admit(second, 1, True, True))
+        self.assertEqual((budget.used, budget.rejected), (1000, 1))
+        first.set_result(None)
+        self.assertEqual(budget.used, 0)
+        self.assertTrue(budget.admit(second, 60, False, False))
+        self.assertFalse(budget.admit(Future(), 60, False, False))
+        self.assertEqual(budget.peak, 1000)
+
+    def test_block(self):
+        budget = MemoryBudget(100, BLOCK, block_timeout=0.1)
+        first = Future()
+        self.assertTrue(budget.admit(first, 100, False, True))
+        self.assertFalse(budget.admit(Future(), 10, False, False))
+        started = time.monotonic()
+        self.assertFalse(budget.admit(Future(), 10, False, True))
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+        budget.block_timeout = None
+        threading.Timer(0.1, lambda: first.set_result(None)).start()
+        self.assertTrue(budget.admit(Future(), 10, False, True))
+        self.assertEqual(budget.used, 10)
+
+    def test_spill(self):
+        budget = MemoryBudget(100, SPILL)
+        first, second = Future(), Future()
+        self.assertTrue(budget.admit(first, 100, True, False))
+        self.assertFalse(budget.admit(Future(), 10, False, False))
+        self.assertTrue(budget.admit(second, 10, True, False))
+        self.assertTrue(budget.over)
+        budget.spill(second)
+        self.assertEqual((budget.used, budget.spilled), (100, 1))
+        second.set_result(None)
+        self.assertEqual(budget.used, 100)
+
+    def test_logs(self):
+        budget = MemoryBudget(100, FAIL)
+        self.assertTrue(budget.take(60))
+        self.assertFalse(budget.take(60))
+        self.assertTrue(budget.take(60, force=True))
+        budget.give_back(120)
+        self.assertEqual(budget.used, 0)
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, MemoryBudget, policy='drop')
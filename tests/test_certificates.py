@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from ngtt.testing import TestCertificates
+from ngtt.uplink.certificates import read_device_info, get_root_cert, get_dev_ca_cert
+
+
+class TestCertificatesModule(unittest.TestCase):
+    def test_importing_is_lazy(self):
+        loaded = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, ngtt.uplink; '
+            'print(*[m for m in ("cryptography", "pyasn1", "pkg_resources") '
+            'if m in sys.modules])'], universal_newlines=True)
+        self.assertEqual(loaded.strip(), '')
+
+    def test_bundled_certificates(self):
+        self.assertIn(b'-----BEGIN CERTIFICATE-----', get_root_cert())
+        self.assertIn(b'-----BEGIN CERTIFICATE-----', get_dev_ca_cert())
+
+    def test_device_info_is_cached_until_modified(self):
+        certificates = TestCertificates()
+        cert_file, _ = certificates.device('cached', environment=1)
+        self.assertEqual(read_device_info(cert_file), ('cached', 1))
+        other_file, _ = certificates.device('other', environment=2)
+        stat = os.stat(cert_file)
+        os.replace(other_file, cert_file)
+        os.utime(cert_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(read_device_info(cert_file), ('cached', 1))
+        os.utime(cert_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(read_device_info(cert_file), ('other', 2))
@@ -0,0 +1,52 @@
+import unittest
+from concurrent.futures import Future
+
+from ngtt.exceptions import DataStreamSyncFailed
+from ngtt.uplink.coalescer import PathpointCoalescer, fan_out
+
+
+class TestCoalescer(unittest.TestCase):
+    def test_merging(self):
+        coalescer = PathpointCoalescer(max_latency=10)
+        sent = []
+        for i in range(10):
+            coalescer.add([{'path': 'W%s' % (i % 2, ), 'values': [{'timestamp': i, 'value': i}]}],
+                          Future(), lambda i=i: sent.append(i))
+        self.assertFalse(coalescer.due)
+        data, futures, on_sent = coalescer.pop()
+        self.assertEqual(data, [
+            {'path': 'W0', 'values': [{'timestamp': i, 'value': i} for i in range(0, 10, 2)]},
+            {'path': 'W1', 'values': [{'timestamp': i, 'value': i} for i in range(1, 10, 2)]}])
+        self.assertEqual(len(futures), 10)
+        on_sent()
+        self.assertEqual(sent, list(range(10)))
+        self.assertFalse(coalescer)
+
+    def test_max_values(self):
+        coalescer = PathpointCoalescer(max_values=5, max_latency=10)
+        coalescer.add([{'path': 'W1', 'values': [{'timestamp': i, 'value': i}
+                                                 for i in range(5)]}], Future())
+        self.assertTrue(coalescer.due)
+
+    def test_fan_out(self):
+        for outcome in (None, DataStreamSyncFailed()):
+            futures = [Future() for _ in range(3)]
+            fut = Future()
+            fut.add_done_callback(fan_out(futures))
+            if outcome is None:
+                fut.set_result(None)
+            else:
+                fut.set_exception(outcome)
+            for future in futures:
+                self.assertIs(future.exception(), outcome)
+
+    def test_invalid_entries_are_not_merged(self):
+        coalescer = PathpointCoalescer(max_latency=10)
+        coalescer.add([{'path': 'W1', 'values': [{'timestamp': 0, 'value': 0}]}], Future())
+        for data in ([{'path': 'W1', 'values': [{'timestamp': 1, 'value': 1}]},
+                      {'path': 'W2'}],
+                     [{'values': []}], ['W1'], {'path': 'W1', 'values': []}):
+            self.assertRaises(ValueError, coalescer.add, data, Future())
+        data, futures, on_sent = coalescer.pop()
+        self.assertEqual(data, [{'path': 'W1', 'values': [{'timestamp': 0, 'value': 0}]}])
+        self.assertEqual(len(futures), 1)
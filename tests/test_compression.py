@@ -0,0 +1,68 @@
+import unittest
+
+from ngtt.compression import Compression, CompressedPayload, Codec, COMPRESSED
+from ngtt.exceptions import InvalidFrame
+from ngtt.protocol import NGTTHeaderType, NGTTFrameDecoder, NGTTSendQueue, STRUCT_LHH
+
+
+def transmit(*frames):
+    queue = NGTTSendQueue()
+    for tid, header, data in frames:
+        queue.append(tid, header, data)
+    decoder = NGTTFrameDecoder()
+    while queue:
+        chunk = queue.next_chunk()
+        decoder.feed(chunk)
+        queue.consume(len(chunk))
+    return [(frame.tid, frame.packet_type, frame.tobytes()) for frame in decoder.frames()]
+
+
+class ReversingCodec(Codec):
+    codec_id = 200
+
+    def compress(self, data: bytes) -> bytes:
+        return bytes(reversed(data[:len(data) // 2]))
+
+    def decompress(self, data) -> bytes:
+        return bytes(reversed(data)) * 2
+
+
+class TestCompression(unittest.TestCase):
+    def test_round_trip(self):
+        compression = Compression(threshold=100)
+        payload = b'{"path": "W1", "value": 1}' * 100
+        compressed = compression.compress(payload)
+        self.assertIsInstance(compressed, CompressedPayload)
+        self.assertLess(len(compressed), len(payload))
+        self.assertEqual(transmit((1, NGTTHeaderType.DATA_STREAM, compressed),
+                                  (2, NGTTHeaderType.LOGS, b'small')),
+                         [(1, NGTTHeaderType.DATA_STREAM, payload),
+                          (2, NGTTHeaderType.LOGS, b'small')])
+
+    def test_not_worth_it(self):
+        compression = Compression(threshold=100)
+        self.assertNotIsInstance(compression.compress(b'x' * 99), CompressedPayload)
+        incompressible = bytes(range(256))
+        self.assertNotIsInstance(compression.compress(incompressible), CompressedPayload)
+        compressed = compression.compress(b'x' * 1000)
+        self.assertIs(compression.compress(compressed), compressed)
+
+    def test_custom_codec(self):
+        compression = Compression(ReversingCodec(), threshold=0)
+        payload = b'abcd' * 2
+        self.assertEqual(transmit((1, NGTTHeaderType.LOGS, compression.compress(payload))),
+                         [(1, NGTTHeaderType.LOGS, payload)])
+
+    def test_invalid(self):
+        for payload in (b'', b'\xFE1234', b'\x01not zlib'):
+            decoder = NGTTFrameDecoder()
+            decoder.feed(STRUCT_LHH.pack(len(payload), 1,
+                                         NGTTHeaderType.LOGS.value | COMPRESSED) + payload)
+            self.assertRaises(InvalidFrame, list, decoder.frames())
+
+    def test_decompressed_too_long(self):
+        compressed = Compression(threshold=0).compress(b'x' * 10000)
+        decoder = NGTTFrameDecoder(max_frame_size=1000)
+        decoder.feed(STRUCT_LHH.pack(len(compressed), 1,
+                                     NGTTHeaderType.LOGS.value | COMPRESSED) + compressed)
+        self.assertRaises(InvalidFrame, list, decoder.frames())
@@ -0,0 +1,60 @@
+import threading
+import time
+import unittest
+
+from ngtt.orders import Order
+from ngtt.uplink.dispatcher import OrderDispatcher
+
+
+def make_order(tid: int, key: str) -> Order:
+    return Order({'uuid': str(tid), 'key': key}, tid, None)
+
+
+class TestDispatcher(unittest.TestCase):
+    def test_per_key_ordering(self):
+        handled = []
+        lock = threading.Lock()
+        all_done = threading.Event()
+
+        def handler(order):
+            time.sleep(0.01)
+            with lock:
+                handled.append(order)
+                if len(handled) == 40:
+                    all_done.set()
+
+        dispatcher = OrderDispatcher(handler, workers=4, key=lambda order: order.data['key'])
+        try:
+            for tid in range(40):
+                dispatcher(make_order(tid, 'key-%s' % (tid % 4,)))
+            self.assertTrue(all_done.wait(10))
+            for key in range(4):
+                tids = [order.tid for order in handled if order.data['key'] == 'key-%s' % (key,)]
+                self.assertEqual(tids, list(range(key, 40, 4)))
+            self.assertEqual(dispatcher.pending, 0)
+            self.assertEqual(dispatcher.waiting, {})
+        finally:
+            dispatcher.shutdown()
+
+    def test_parallelism(self):
+        barrier = threading.Barrier(4, timeout=10)
+        dispatcher = OrderDispatcher(lambda order: barrier.wait(), workers=4)
+        try:
+            for tid in range(4):
+                dispatcher(make_order(tid, None))
+        finally:
+            dispatcher.shutdown()
+        self.assertFalse(barrier.broken)
+
+    def test_bounded(self):
+        release = threading.Event()
+        dispatcher = OrderDispatcher(lambda order: release.wait(10), workers=1, max_pending=2)
+        try:
+            for tid in range(5):
+                dispatcher(make_order(tid, None))
+            self.assertEqual(dispatcher.pending, 2)
+            self.assertEqual(dispatcher.dropped, 3)
+        finally:
+            release.set()
+            dispatcher.shutdown()
+        self.assertEqual(dispatcher.pending, 0)
@@ -1,6 +1,20 @@
 import unittest
 
-from ngtt.protocol import NGTTHeaderType, NGTTFrame
+from ngtt.exceptions import InvalidFrame, StreamedPayloadFailed
+from ngtt.protocol import NGTTHeaderType, NGTTFrame, NGTTFrameDecoder, NGTTSendQueue, \
+    PayloadStream, StreamedPayload, STRUCT_LHH, TLS_RECORD_SIZE
+
+
+class Chunks(StreamedPayload):
+    def __init__(self, chunks, length=None):
+        self.chunk_list = chunks
+        self.length = sum(map(len, chunks)) if length is None else length
+
+    def __len__(self):
+        return self.length
+
+    def chunks(self):
+        return iter(self.chunk_list)
 
 
 class TestFrame(unittest.TestCase):
@@ -11,3 +25,109 @@ class TestFrame(unittest.TestCase):
         self.assertEqual(frame.packet_type, NGTTHeaderType.PING)
         self.assertEqual(frame.data, b'AL')
         self.assertEqual(len(frame), len(b))
+
+    def test_decoder(self):
+        decoder = NGTTFrameDecoder()
+        stream = b'\x00\x00\x00\x00\x00\x01\x00\x00' + b'\x00\x00\x00\x02\x00\x05\x00\x01{}'
+        decoder.feed(stream[:5])
+        self.assertEqual(list(decoder.frames()), [])
+        decoder.feed(stream[5:13])
+        frames = list(decoder.frames())
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0].packet_type, NGTTHeaderType.PING)
+        decoder.feed(stream[13:] + stream)
+        frames = list(decoder.frames())
+        self.assertEqual([frame.tid for frame in frames], [5, 1, 5])
+        self.assertEqual(frames[0].packet_type, NGTTHeaderType.ORDER)
+        self.assertEqual(frames[0].data, b'{}')
+        self.assertEqual(len(decoder), 0)
+
+    def test_decoder_grows_and_compacts(self):
+        decoder = NGTTFrameDecoder(16)
+        payload = b'x' * 40
+        stream = (b'\x00\x00\x00\x28\x00\x07\x00\x04' + payload) * 3
+        received = 0
+        for i in range(0, len(stream), 10):
+            decoder.feed(stream[i:i + 10])
+            for frame in decoder.frames():
+                self.assertEqual(frame.tid, 7)
+                self.assertEqual(frame.tobytes(), payload)
+                received += 1
+        self.assertEqual(received, 3)
+        self.assertEqual(len(decoder), 0)
+
+    def test_decoder_goes_back_to_its_buffer(self):
+        decoder = NGTTFrameDecoder(16)
+        base = decoder.buffer
+        decoder.feed(b'\x00\x00\x00\x28\x00\x07\x00\x04' + b'x' * 40 + b'\x00\x00')
+        self.assertEqual(len(list(decoder.frames())), 1)
+        self.assertIsNot(decoder.buffer, base)
+        decoder.make_room()
+        self.assertIs(decoder.buffer, base)
+        decoder.feed(b'\x00\x01\x00\x03\x00\x00x')
+        self.assertEqual([frame.tid for frame in decoder.frames()], [3])
+
+    def test_decoder_rejects_too_long_frames(self):
+        decoder = NGTTFrameDecoder(max_frame_size=1024)
+        decoder.feed(STRUCT_LHH.pack(1024, 1, NGTTHeaderType.ORDER.value) + b'x' * 1024)
+        self.assertEqual(len(list(decoder.frames())), 1)
+        # rejected as soon as the header arrives
+        decoder.feed(STRUCT_LHH.pack(0xFFFFFFFF, 1, NGTTHeaderType.ORDER.value))
+        self.assertRaises(InvalidFrame, lambda: list(decoder.frames()))
+        self.assertLess(len(decoder.buffer), 0xFFFF)
+
+    def test_unknown_header_type(self):
+        self.assertRaises(InvalidFrame, NGTTFrame.from_bytes, b'\x00\x00\x00\x00\x00\x01\x00\x20')
+
+    def test_send_queue(self):
+        queue = NGTTSendQueue()
+        expected = bytearray()
+        for tid, length in enumerate((0, 5, 100, 20000, 3, 70000, 1)):
+            data = bytes(range(256)) * (length // 256) + b'y' * (length % 256)
+            queue.append(tid, NGTTHeaderType.DATA_STREAM, data)
+            expected += STRUCT_LHH.pack(len(data), tid, NGTTHeaderType.DATA_STREAM.value) + data
+        self.assertEqual(queue.pending, len(expected))
+        sent = bytearray()
+        while queue:
+            chunk = queue.next_chunk()
+            self.assertLessEqual(len(chunk), TLS_RECORD_SIZE)
+            sent += chunk[:7000]
+            queue.consume(min(len(chunk), 7000))
+        self.assertEqual(sent, expected)
+        self.assertEqual(queue.pending, 0)
+
+    def test_send_queue_streams(self):
+        queue = NGTTSendQueue()
+        payload = Chunks([b'a' * 30000, b'', b'b' * 10, b'c' * 50000])
+        queue.append(1, NGTTHeaderType.PING, b'x')
+        queue.append(2, NGTTHeaderType.DATA_STREAM, payload)
+        queue.append(3, NGTTHeaderType.DATA_STREAM, Chunks([]))
+        queue.append(4, NGTTHeaderType.PING, b'y')
+        expected = STRUCT_LHH.pack(1, 1, NGTTHeaderType.PING.value) + b'x' + \
+            STRUCT_LHH.pack(len(payload), 2, NGTTHeaderType.DATA_STREAM.value) + \
+            b''.join(payload.chunk_list) + \
+            STRUCT_LHH.pack(0, 3, NGTTHeaderType.DATA_STREAM.value) + \
+            STRUCT_LHH.pack(1, 4, NGTTHeaderType.PING.value) + b'y'
+        self.assertEqual(queue.pending, len(expected))
+        # nothing is pulled from the stream before it's due to be sent
+        self.assertEqual(len(queue.next_chunk()), STRUCT_LHH.size * 2 + 1)
+        stream, = [segment for segment in queue.segments if isinstance(segment, PayloadStream)]
+        self.assertEqual(stream.remaining, len(payload))
+        sent = bytearray()
+        while queue:
+            chunk = queue.next_chunk()
+            self.assertLessEqual(len(chunk), TLS_RECORD_SIZE)
+            sent += chunk[:7000]
+            queue.consume(min(len(chunk), 7000))
+        self.assertEqual(sent, expected)
+        self.assertEqual(queue.pending, 0)
+
+    def test_send_queue_stream_of_wrong_length(self):
+        for length in (9, 11):
+            queue = NGTTSendQueue()
+            queue.append(7, NGTTHeaderType.DATA_STREAM, Chunks([b'x' * 10], length))
+            queue.consume(STRUCT_LHH.size)
+            with self.assertRaises(StreamedPayloadFailed) as context:
+                for _ in range(2):
+                    queue.consume(len(queue.next_chunk()))
+            self.assertEqual(context.exception.tid, 7)
@@ -0,0 +1,50 @@
+import random
+import unittest
+
+from ngtt.protocol import NGTTHeaderType
+from ngtt.uplink.inflight import InFlightOps
+
+
+class TestInFlightOps(unittest.TestCase):
+    def test_complete_discard_and_replay(self):
+        ops = InFlightOps()
+        added = [ops.add(NGTTHeaderType.DATA_STREAM, b'%d' % (i,), i) for i in range(10000)]
+        for tid, op in enumerate(added, start=1):
+            ops.sent(op, tid)
+        self.assertEqual(len(ops), 10000)
+
+        completed = list(range(1, 10001, 2))
+        random.shuffle(completed)
+        for tid in completed:
+            self.assertEqual(ops.complete(tid).tid, tid)
+        self.assertIsNone(ops.complete(1))
+        ops.discard(added[1])
+        ops.discard(added[1])
+        self.assertIsNone(ops.complete(2))
+        self.assertEqual(len(ops), 4999)
+
+        # after a reconnect the rest is replayed in the order it was submitted
+        ops.reset_tids()
+        self.assertIsNone(ops.complete(4))
+        self.assertEqual([op.fut for op in ops], list(range(3, 10000, 2)))
+
+    def test_window(self):
+        ops = InFlightOps(window=3, window_bytes=10)
+        for i in range(5):
+            ops.add(NGTTHeaderType.DATA_STREAM, b'1234', i)
+        tids = iter(range(1, 100))
+        for op in ops.sendable():
+            ops.sent(op, next(tids))
+        self.assertEqual(ops.sent_count, 2)     # 3 * 4 bytes would not fit in 10 bytes
+        ops.complete(1)
+        for op in ops.sendable():
+            ops.sent(op, next(tids))
+        self.assertEqual([op.tid for op in ops], [2, 3, None, None])
+
+        # a single operation is let through even if it's larger than the window
+        big = InFlightOps(window_bytes=10)
+        big.add(NGTTHeaderType.DATA_STREAM, b'x' * 100, None)
+        big.add(NGTTHeaderType.DATA_STREAM, b'x', None)
+        for op in big.sendable():
+            big.sent(op, 1)
+        self.assertEqual(big.sent_count, 1)
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+from ngtt.compression import Compression, CompressedPayload
+from ngtt.protocol import NGTTHeaderType
+from ngtt.uplink.journal import Journal, SEGMENT_SUFFIX
+
+
+def segments(directory: str):
+    return sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def test_replay_after_reopening(self):
+        journal = Journal(self.directory)
+        ids = [journal.append(NGTTHeaderType.DATA_STREAM, b'%d' % (i,)) for i in range(100)]
+        journal.append(NGTTHeaderType.LOGS, b'logs')
+        for record_id in ids[:90]:
+            journal.ack(record_id)
+        journal.ack(ids[0])
+        journal.close()
+
+        journal = Journal(self.directory)
+        self.assertEqual(journal.replay(), [
+            (record_id, NGTTHeaderType.DATA_STREAM, b'%d' % (i,))
+            for i, record_id in enumerate(ids) if i >= 90] + [
+            (ids[-1] + 1, NGTTHeaderType.LOGS, b'logs')])
+        self.assertEqual(journal.replay(), [])
+        self.assertGreater(journal.append(NGTTHeaderType.LOGS, b''), ids[-1] + 1)
+        journal.close()
+
+    def test_read(self):
+        journal = Journal(self.directory, segment_size=64)
+        compressed = Compression(threshold=0).compress(b'x' * 100)
+        ids = [journal.append(NGTTHeaderType.DATA_STREAM, b'%d' % (i,) * 10) for i in range(10)]
+        compressed_id = journal.append(NGTTHeaderType.DATA_STREAM, compressed)
+        self.assertEqual([journal.read(record_id) for record_id in ids],
+                         [b'%d' % (i,) * 10 for i in range(10)])
+        self.assertEqual(journal.read(compressed_id), compressed)
+        self.assertIsInstance(journal.read(compressed_id), CompressedPayload)
+        journal.ack(ids[0])
+        self.assertRaises(KeyError, journal.read, ids[0])
+        journal.close()
+
+    def test_segments_are_rotated_and_removed(self):
+        journal = Journal(self.directory, segment_size=1024)
+        first = journal.append(NGTTHeaderType.DATA_STREAM, b'x' * 100)
+        for _ in range(50):
+            journal.ack(journal.append(NGTTHeaderType.DATA_STREAM, b'x' * 100))
+        # the first record keeps the first segment, and so all the later ones, around
+        self.assertGreater(len(segments(self.directory)), 5)
+        journal.ack(first)
+        journal.ack(journal.append(NGTTHeaderType.DATA_STREAM, b'x' * 1000))
+        self.assertEqual(len(segments(self.directory)), 1)
+        journal.close()
+        self.assertEqual(Journal(self.directory).replay(), [])
+
+    def test_damaged_tail_is_ignored(self):
+        journal = Journal(self.directory)
+        journal.append(NGTTHeaderType.DATA_STREAM, b'first')
+        journal.append(NGTTHeaderType.DATA_STREAM, b'second')
+        journal.close()
+        path = os.path.join(self.directory, segments(self.directory)[-1])
+        with open(path, 'r+b') as f_out:
+            data = f_out.read()
+            f_out.seek(data.index(b'second'))
+            f_out.write(b'SECOND')
+        self.assertEqual([data for _, _, data in Journal(self.directory).replay()],
+                         [b'first'])
@@ -0,0 +1,37 @@
+import unittest
+
+from ngtt.uplink.keepalive import Keepalive, RTT_BUCKETS
+
+
+class TestKeepalive(unittest.TestCase):
+    def test_rtt(self):
+        keepalive = Keepalive()
+        self.assertIsNone(keepalive.rtt)
+        keepalive.answered(0.1)
+        self.assertEqual(keepalive.rtt, 0.1)
+        keepalive.answered(0.9)
+        self.assertAlmostEqual(keepalive.rtt, 0.2)
+        self.assertEqual(keepalive.last_rtt, 0.9)
+        self.assertEqual(keepalive.histogram[RTT_BUCKETS.index(0.1)], 1)
+        self.assertEqual(keepalive.histogram[RTT_BUCKETS.index(1)], 1)
+        keepalive.answered(60)
+        self.assertEqual(keepalive.histogram[-1], 1)
+
+    def test_fixed_interval(self):
+        keepalive = Keepalive(interval=10)
+        keepalive.answered(0.1)
+        self.assertEqual(keepalive.current_interval, 10)
+
+    def test_adaptive_interval(self):
+        keepalive = Keepalive(interval=10, max_interval=100)
+        for _ in range(3):
+            keepalive.answered(0.1)
+        self.assertEqual(keepalive.current_interval, 80)
+        keepalive.answered(0.1)
+        self.assertEqual(keepalive.current_interval, 100)
+        keepalive.timed_out()
+        self.assertEqual(keepalive.timeouts, 1)
+        self.assertEqual(keepalive.current_interval, 10)
+        for _ in range(5):
+            keepalive.answered(0.1)
+        self.assertEqual(keepalive.current_interval, 50)
@@ -0,0 +1,46 @@
+import unittest
+
+import minijson
+
+from ngtt.uplink.logs import LogBatcher, list_header, split_list
+
+
+class TestLogs(unittest.TestCase):
+    def test_list_header(self):
+        for count in (0, 1, 15, 16, 255, 256, 65535, 65536):
+            data = minijson.dumps(list(range(count)))
+            self.assertEqual(data[:len(list_header(count))], list_header(count))
+            self.assertEqual(split_list(data)[0], count)
+        self.assertRaises(ValueError, split_list, minijson.dumps({'a': 1}))
+
+    def test_merging(self):
+        batcher = LogBatcher(max_latency=10)
+        for i in range(20):
+            batcher.add(minijson.dumps([{'content': str(i)}]))
+        batcher.add(minijson.dumps([]))
+        self.assertFalse(batcher.due)
+        self.assertEqual(minijson.loads(batcher.pop_batch()),
+                         [{'content': str(i)} for i in range(20)])
+        self.assertFalse(batcher)
+        self.assertIsNone(batcher.pop_batch())
+
+    def test_batch_size(self):
+        batcher = LogBatcher(max_bytes=100, max_latency=10)
+        for i in range(100):
+            batcher.add(minijson.dumps([{'content': 'x' * 10}]))
+        self.assertTrue(batcher.due)
+        entries = 0
+        while batcher:
+            batch = batcher.pop_batch()
+            entries += len(minijson.loads(batch))
+            self.assertLess(len(batch), 200)
+        self.assertEqual(entries, 100)
+
+    def test_drops_oldest(self):
+        batcher = LogBatcher(max_bytes=1000, max_buffered=100)
+        for i in range(100):
+            batcher.add(minijson.dumps([i * 1000]))
+        self.assertGreater(batcher.dropped, 0)
+        entries = minijson.loads(batcher.pop_batch())
+        self.assertEqual(len(entries) + batcher.dropped, 100)
+        self.assertEqual(entries[-1], 99000)
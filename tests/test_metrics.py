@@ -0,0 +1,32 @@
+import unittest
+from concurrent.futures import Future
+
+from ngtt.protocol import NGTTHeaderType
+from ngtt.uplink.metrics import Histogram, Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram((1, 2, 5))
+        self.assertIsNone(histogram.mean)
+        self.assertIsNone(histogram.quantile(0.5))
+        for value in (0.5, 0.5, 1.5, 4, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1, 1])
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.mean, 3.3)
+        self.assertEqual(histogram.quantile(0.4), 1)
+        self.assertEqual(histogram.quantile(0.5), 2)
+        self.assertEqual(histogram.quantile(1), float('inf'))
+
+    def test_watch(self):
+        metrics = Metrics()
+        succeeded, failed, cancelled = Future(), Future(), Future()
+        for fut in (succeeded, failed, cancelled):
+            metrics.watch(NGTTHeaderType.DATA_STREAM, fut, 0)
+        self.assertNotIn(NGTTHeaderType.DATA_STREAM, metrics.latency)
+        succeeded.set_result(None)
+        failed.set_exception(ValueError())
+        cancelled.cancel()
+        self.assertEqual(metrics.latency[NGTTHeaderType.DATA_STREAM].count, 3)
+        self.assertEqual(metrics.failed[NGTTHeaderType.DATA_STREAM], 2)
@@ -0,0 +1,53 @@
+import time
+import unittest
+
+from ngtt.orders import Order, OrderCache
+from ngtt.protocol import NGTTHeaderType
+
+
+class RecordingOutbox:
+    def __init__(self):
+        self.sent = []
+
+    def send_frame(self, tid, header, data=b''):
+        self.sent.append((tid, header))
+
+
+class TestOrderCache(unittest.TestCase):
+    def setUp(self):
+        self.outbox = RecordingOutbox()
+
+    def order(self, data, tid: int = 1) -> Order:
+        return Order(data, tid, self.outbox)
+
+    def test_redelivery_after_acknowledgement(self):
+        cache = OrderCache()
+        original = self.order({'uuid': 'a'}, 1)
+        self.assertFalse(cache.is_duplicate(original, b'a'))
+        original.acknowledge()
+        self.assertTrue(cache.is_duplicate(self.order({'uuid': 'a'}, 2), b'a'))
+        self.assertEqual(self.outbox.sent, [(1, NGTTHeaderType.ORDER_CONFIRM),
+                                            (2, NGTTHeaderType.ORDER_CONFIRM)])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_redelivery_before_acknowledgement(self):
+        cache = OrderCache()
+        original = self.order(['no uuid'], 1)
+        self.assertFalse(cache.is_duplicate(original, b'payload'))
+        self.assertTrue(cache.is_duplicate(self.order(['no uuid'], 1), b'payload'))
+        self.assertFalse(cache.is_duplicate(self.order(['no uuid'], 1), b'other payload'))
+        self.assertFalse(cache.is_duplicate(self.order(['no uuid'], 2), b'payload'))
+        self.assertEqual(self.outbox.sent, [])
+        original.acknowledge()
+        self.assertEqual(self.outbox.sent, [(1, NGTTHeaderType.ORDER_CONFIRM)] * 2)
+
+    def test_bounded(self):
+        cache = OrderCache(max_orders=10, ttl=0.05)
+        for i in range(100):
+            cache.is_duplicate(self.order({'uuid': i}), b'')
+        self.assertEqual(len(cache), 10)
+        self.assertTrue(cache.is_duplicate(self.order({'uuid': 99}), b''))
+        self.assertFalse(cache.is_duplicate(self.order({'uuid': 0}), b''))
+        time.sleep(0.1)
+        self.assertFalse(cache.is_duplicate(self.order({'uuid': 99}), b''))
+        self.assertEqual(len(cache), 1)
@@ -0,0 +1,37 @@
+import select
+import threading
+import unittest
+
+from ngtt.protocol import NGTTHeaderType
+from ngtt.uplink.outbox import Outbox, Waker
+
+
+class TestOutbox(unittest.TestCase):
+    def test_many_producers(self):
+        waker = Waker()
+        outbox = Outbox(waker)
+        producers, per_producer = 32, 1000
+        received = []
+
+        def produce(producer_id: int):
+            for i in range(per_producer):
+                outbox.send_frame(producer_id, NGTTHeaderType.LOGS, b'%d' % (i,))
+
+        threads = [threading.Thread(target=produce, args=(i,)) for i in range(producers)]
+        for thread in threads:
+            thread.start()
+        while len(received) < producers * per_producer:
+            rx, _, _ = select.select([waker], [], [], 5)
+            self.assertTrue(rx)
+            waker.drain()
+            entry = outbox.pop()
+            while entry is not None:
+                received.append(entry)
+                entry = outbox.pop()
+        for thread in threads:
+            thread.join()
+        waker.close()
+
+        for producer_id in range(producers):
+            data = [entry[1] for entry in received if entry[2] == producer_id]
+            self.assertEqual(data, [b'%d' % (i,) for i in range(per_producer)])
@@ -0,0 +1,49 @@
+import threading
+import unittest
+from unittest import mock
+
+from ngtt.uplink.resolver import Resolver
+
+
+class TestResolver(unittest.TestCase):
+    def test_lookups_are_shared_and_cached(self):
+        resolver = Resolver()
+        release = threading.Event()
+        results = []
+        done = threading.Semaphore(0)
+
+        def getaddrinfo(host, port, *args):
+            release.wait(10)
+            return [(None, None, None, '', ('127.0.0.1', port))]
+
+        def callback(address):
+            results.append(address)
+            done.release()
+
+        with mock.patch('socket.getaddrinfo', side_effect=getaddrinfo) as patched:
+            self.assertIsNone(resolver.get('example.com', 2408))
+            for _ in range(3):
+                resolver.resolve('example.com', 2408, callback)
+            release.set()
+            for _ in range(3):
+                self.assertTrue(done.acquire(timeout=10))
+            self.assertEqual(patched.call_count, 1)
+        self.assertEqual(results, [('127.0.0.1', 2408)] * 3)
+        self.assertEqual(resolver.get('example.com', 2408), ('127.0.0.1', 2408))
+        resolver.forget('example.com', 2408)
+        self.assertIsNone(resolver.get('example.com', 2408))
+
+    def test_failures_are_not_cached(self):
+        resolver = Resolver()
+        results = []
+        done = threading.Event()
+
+        def callback(address):
+            results.append(address)
+            done.set()
+
+        with mock.patch('socket.getaddrinfo', side_effect=OSError()):
+            resolver.resolve('example.com', 2408, callback)
+            self.assertTrue(done.wait(10))
+        self.assertEqual(results, [None])
+        self.assertIsNone(resolver.get('example.com', 2408))
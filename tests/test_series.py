@@ -0,0 +1,40 @@
+import array
+import unittest
+
+import minijson
+
+from ngtt.uplink.device import encode_data
+from ngtt.uplink.series import PathpointSeries
+
+
+class TestSeries(unittest.TestCase):
+    def test_same_as_dicts(self):
+        for ts_type, value_type, values in (
+                ('q', 'd', [0.5, -1.25, 1e300]),
+                ('Q', 'f', [0.5, -1.25, 3.0]),
+                ('l', 'b', [-128, 0, 127]),
+                ('I', 'H', [0, 1, 65535]),
+                ('i', 'h', [-32768, 0, 32767]),
+                ('L', 'B', [0, 1, 255])):
+            timestamps = [0, 2 ** 31 - 1, 12345]
+            series = PathpointSeries('W1', array.array(ts_type, timestamps),
+                                     array.array(value_type, values))
+            self.assertEqual(minijson.loads(encode_data([series, {'path': 'W2', 'values': []}])),
+                             [{'path': 'W1', 'values': [{'timestamp': ts, 'value': value}
+                                                        for ts, value in zip(timestamps, values)]},
+                              {'path': 'W2', 'values': []}])
+
+    def test_large(self):
+        count = 100000
+        series = PathpointSeries('W1', array.array('q', range(count)),
+                                 array.array('d', range(count)))
+        values = minijson.loads(encode_data([series]))[0]['values']
+        self.assertEqual(len(values), count)
+        self.assertEqual(values[-1], {'timestamp': count - 1, 'value': count - 1})
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, PathpointSeries, 'W1', array.array('q', [1]),
+                          array.array('d', [1, 2]))
+        self.assertRaises(ValueError, PathpointSeries, 'W1', array.array('u', 'a'),
+                          array.array('d', [1]))
+        self.assertRaises(TypeError, PathpointSeries, 'W1', [1], array.array('d', [1]))
@@ -0,0 +1,49 @@
+import array
+import unittest
+
+import minijson
+
+from ngtt.uplink.series import PathpointSeries, encode_pathpoints
+from ngtt.uplink.streaming import PathpointStream
+
+
+class Backlog:
+    """Entries that are generated anew on every iteration, like ones read from a file"""
+
+    def __init__(self, count):
+        self.count = count
+        self.iterations = 0
+
+    def __iter__(self):
+        self.iterations += 1
+        for i in range(self.count):
+            yield {'path': 'W%s' % (i % 10,), 'values': [{'timestamp': i, 'value': i}]}
+
+
+class TestPathpointStream(unittest.TestCase):
+    def test_iterable_is_streamed(self):
+        backlog = Backlog(10000)
+        stream = PathpointStream(backlog, chunk_size=1000)
+        self.assertEqual(backlog.iterations, 1)
+        self.assertIsNone(stream.encoded)
+        for _ in range(2):
+            chunks = list(stream.chunks())
+            self.assertTrue(all(len(chunk) < 1100 for chunk in chunks))
+            payload = b''.join(chunks)
+            self.assertEqual(len(payload), len(stream))
+            self.assertEqual(minijson.loads(payload), list(backlog))
+        self.assertEqual(stream.count, 10000)
+
+    def test_iterator_is_encoded_once(self):
+        series = PathpointSeries('W1', array.array('q', [1, 2]), array.array('d', [0.5, 1.5]))
+        entries = [{'path': 'W2', 'values': [{'timestamp': 3, 'value': 'x'}]}, series]
+        stream = PathpointStream(iter(entries))
+        for _ in range(2):
+            payload = b''.join(stream.chunks())
+            self.assertEqual(payload, encode_pathpoints(entries))
+            self.assertEqual(len(payload), len(stream))
+
+    def test_empty(self):
+        stream = PathpointStream(iter(()))
+        self.assertEqual(b''.join(stream.chunks()), minijson.dumps([]))
+        self.assertEqual(len(stream), 1)
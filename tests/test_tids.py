@@ -0,0 +1,52 @@
+import random
+import struct
+import time
+import unittest
+
+from ngtt.exceptions import TidsExhausted
+from ngtt.uplink.tids import TidAllocator, MAX_TID
+
+
+class TestTidAllocator(unittest.TestCase):
+    def test_skips_zero_and_wraps_around(self):
+        tids = TidAllocator()
+        self.assertEqual(tids.allocate(), 1)
+        self.assertEqual(tids.allocate(), 2)
+        tids.free(1)
+        # a freed ID is not reused until the IDs wrap around
+        self.assertEqual(tids.allocate(), 3)
+        tids.next_tid = MAX_TID
+        self.assertEqual(tids.allocate(), MAX_TID)
+        self.assertEqual(tids.allocate(), 1)
+        self.assertEqual(tids.allocate(), 4)
+        tids.free(0)
+        self.assertIn(0, tids)
+        self.assertEqual(len(tids), 5)
+
+    def test_exhaustion(self):
+        tids = TidAllocator()
+        allocated = {tids.allocate() for _ in range(MAX_TID)}
+        self.assertEqual(allocated, set(range(1, MAX_TID + 1)))
+        self.assertTrue(tids.exhausted)
+        self.assertRaises(TidsExhausted, tids.allocate)
+        tids.free(1234)
+        self.assertFalse(tids.exhausted)
+        self.assertEqual(tids.allocate(), 1234)
+
+    def test_60k_in_flight(self):
+        tids = TidAllocator()
+        in_flight = set()
+        rng = random.Random(0)
+        started = time.monotonic()
+        for _ in range(10):
+            while len(in_flight) < 60000:
+                tid = tids.allocate()
+                self.assertNotIn(tid, in_flight)
+                struct.pack('>H', tid)
+                in_flight.add(tid)
+            # answers arrive mostly, but not exactly, in order
+            for tid in rng.sample(sorted(in_flight), 20000):
+                tids.free(tid)
+                in_flight.discard(tid)
+            self.assertEqual(len(tids), len(in_flight))
+        self.assertLess(time.monotonic() - started, 10)
@@ -0,0 +1,470 @@
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from ngtt.compression import Compression
+from ngtt.exceptions import ConnectionFailed, DataStreamSyncFailed, Overloaded, \
+    StreamedPayloadFailed
+from ngtt.orders import OrderCache
+from ngtt.protocol import NGTTHeaderType
+from ngtt.testing import NGTTTestServer, TestCertificates, CONFIRM, REJECT, IGNORE, DROP
+from ngtt.uplink import NGTTConnection, NGTTGateway
+from ngtt.uplink.budget import MemoryBudget, FAIL, SPILL
+from ngtt.uplink.coalescer import PathpointCoalescer
+from ngtt.uplink.dispatcher import OrderDispatcher
+from ngtt.uplink.keepalive import Keepalive
+from ngtt.uplink.logs import LogBatcher
+from ngtt.uplink.metrics import Metrics
+
+
+class TestUplink(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.certificates = TestCertificates()
+        cls.server = NGTTTestServer(cls.certificates)
+        cls.endpoint = dict(host='localhost', port=cls.server.port,
+                            ca_file=cls.certificates.ca_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate().join()
+
+    def test_connection(self):
+        order_received = threading.Event()
+
+        def on_new_order(order):
+            order.acknowledge()
+            order_received.set()
+
+        conn = NGTTConnection(*self.certificates.device('connection'), on_new_order,
+                              **self.endpoint)
+        try:
+            futures = [conn.sync_pathpoints([{'path': 'W1', 'values': [
+                {'timestamp': i, 'value': i}]}]) for i in range(100)]
+            for fut in futures:
+                fut.result(timeout=10)
+            self.assertEqual(conn.sync_baobs({}).result(timeout=10),
+                             {'download': [], 'upload': []})
+            self.server.send_order({'uuid': 'test'})
+            self.assertTrue(order_received.wait(10))
+
+            # drop the connection on the server's side, it should reconnect
+            self.server.call_soon(lambda: [self.server.drop(client)
+                                           for client in list(self.server.clients)])
+            conn.sync_pathpoints([]).result(timeout=10)
+        finally:
+            conn.stop()
+
+    def test_metrics(self):
+        metrics = Metrics()
+        order_received = threading.Event()
+
+        def on_new_order(order):
+            order.acknowledge()
+            order_received.set()
+
+        conn = NGTTConnection(*self.certificates.device('measured'), on_new_order,
+                              metrics=metrics, **self.endpoint)
+        try:
+            for fut in [conn.sync_pathpoints([]) for _ in range(10)]:
+                fut.result(timeout=10)
+            self.server.send_order({'uuid': 'measured'})
+            self.assertTrue(order_received.wait(10))
+            self.assertEqual(conn.in_flight, 0)
+            # the acknowledgement is sent by the connection's thread
+            deadline = time.monotonic() + 10
+            while not metrics.frames_sent[NGTTHeaderType.ORDER_CONFIRM] and \
+                    time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            conn.stop()
+        self.assertEqual(metrics.connects, 1)
+        self.assertEqual(metrics.frames_sent[NGTTHeaderType.DATA_STREAM], 10)
+        self.assertEqual(metrics.bytes_sent[NGTTHeaderType.DATA_STREAM], 10 * (8 + 1))
+        self.assertEqual(metrics.frames_received[NGTTHeaderType.DATA_STREAM_CONFIRM], 10)
+        self.assertEqual(metrics.frames_received[NGTTHeaderType.ORDER], 1)
+        self.assertEqual(metrics.frames_sent[NGTTHeaderType.ORDER_CONFIRM], 1)
+        self.assertEqual(metrics.latency[NGTTHeaderType.DATA_STREAM].count, 10)
+        self.assertEqual(metrics.order_handling.count, 1)
+
+    def test_tls_session_is_resumed(self):
+        conn = NGTTConnection(*self.certificates.device('resumed'), lambda order: None,
+                              **self.endpoint)
+        try:
+            conn.sync_pathpoints([]).result(timeout=10)
+            first_connection = conn.current_connection
+            self.assertFalse(first_connection.socket.session_reused)
+            self.server.call_soon(lambda: [self.server.drop(client)
+                                           for client in list(self.server.clients)])
+            deadline = time.monotonic() + 10
+            while conn.current_connection is first_connection and \
+                    time.monotonic() < deadline:
+                time.sleep(0.01)
+            conn.sync_pathpoints([]).result(timeout=10)
+            self.assertTrue(conn.current_connection.socket.session_reused)
+        finally:
+            conn.stop()
+
+    def test_unanswered_ping_fails_the_connection(self):
+        keepalive = Keepalive(interval=0.1, timeout=0.3)
+        conn = NGTTConnection(*self.certificates.device('keepalive'), lambda order: None,
+                              keepalive=keepalive, **self.endpoint)
+        try:
+            conn.sync_pathpoints([]).result(timeout=10)
+            deadline = time.monotonic() + 10
+            while keepalive.rtt is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertIsNotNone(keepalive.rtt)
+            self.assertGreater(sum(keepalive.histogram), 0)
+
+            self.server.answer_pings = False
+            first_connection = conn.current_connection
+            while conn.current_connection is first_connection and \
+                    time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertIsNot(conn.current_connection, first_connection)
+            self.assertGreaterEqual(keepalive.timeouts, 1)
+        finally:
+            self.server.answer_pings = True
+            conn.stop()
+
+    def test_slow_order_handler_does_not_block_the_link(self):
+        handling = threading.Event()
+        release = threading.Event()
+
+        def on_new_order(order):
+            handling.set()
+            release.wait(10)
+            order.acknowledge()
+
+        dispatcher = OrderDispatcher(on_new_order)
+        conn = NGTTConnection(*self.certificates.device('dispatched'), dispatcher,
+                              **self.endpoint)
+        try:
+            conn.sync_pathpoints([]).result(timeout=10)
+            self.server.send_order({'uuid': 'slow'})
+            self.assertTrue(handling.wait(10))
+            conn.sync_pathpoints([]).result(timeout=1)
+        finally:
+            release.set()
+            conn.stop()
+            dispatcher.shutdown()
+
+    def test_orders_delivered_again_are_not_handled_again(self):
+        handled = []
+        conn = NGTTConnection(*self.certificates.device('deduplicated'),
+                              lambda order: [handled.append(order), order.acknowledge()],
+                              order_cache=OrderCache(), **self.endpoint)
+        try:
+            conn.sync_pathpoints([]).result(timeout=10)
+            received = self.server.received.copy()
+            for tid in (1, 2):
+                self.server.send_order({'uuid': 'once'}, tid)
+            deadline = time.monotonic() + 10
+            while self.server.received[NGTTHeaderType.ORDER_CONFIRM] - \
+                    received[NGTTHeaderType.ORDER_CONFIRM] < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(handled), 1)
+            self.assertEqual(self.server.received[NGTTHeaderType.ORDER_CONFIRM] -
+                             received[NGTTHeaderType.ORDER_CONFIRM], 2)
+            self.assertEqual(conn.order_cache.hits, 1)
+        finally:
+            conn.stop()
+
+    def test_scripted_server(self):
+        server = NGTTTestServer(self.certificates)
+        metrics = Metrics()
+        conn = NGTTConnection(*self.certificates.device('scripted'), lambda order: None,
+                              host='localhost', port=server.port,
+                              ca_file=self.certificates.ca_file, window=1, metrics=metrics)
+        try:
+            server.script(REJECT, (CONFIRM, 0.2), DROP)
+            rejected, delayed, dropped = [conn.sync_pathpoints([]) for _ in range(3)]
+            self.assertRaises(DataStreamSyncFailed, rejected.result, timeout=10)
+            started = time.monotonic()
+            delayed.result(timeout=10)
+            self.assertGreaterEqual(time.monotonic() - started, 0.1)
+            # the dropped DATA_STREAM is sent again after reconnecting, and confirmed
+            dropped.result(timeout=10)
+            self.assertEqual(metrics.connects, 2)
+            server.script(IGNORE)
+            ignored = conn.sync_pathpoints([])
+            time.sleep(0.3)
+            self.assertFalse(ignored.done())
+            server.call_soon(lambda: [server.drop(client) for client in list(server.clients)])
+            ignored.result(timeout=10)
+        finally:
+            conn.stop()
+            server.terminate().join()
+
+    def test_window(self):
+        server = NGTTTestServer(self.certificates)
+        server.confirm_delay = 0.05
+        try:
+            for window in (None, 4):
+                server.max_outstanding = 0
+                conn = NGTTConnection(*self.certificates.device('window'), lambda order: None,
+                                      host='localhost', port=server.port,
+                                      ca_file=self.certificates.ca_file, window=window)
+                try:
+                    futures = [conn.sync_pathpoints([], block=i % 2 == 0, timeout=10)
+                               for i in range(100)]
+                    for fut in futures:
+                        fut.result(timeout=10)
+                    self.assertEqual(len(conn.currently_running_ops), 0)
+                    # transaction IDs are freed once answered, only the ping's is kept
+                    self.assertEqual(len(conn.current_connection.id_assigner), 1)
+                finally:
+                    conn.stop()
+                if window is None:
+                    self.assertGreater(server.max_outstanding, 4)
+                else:
+                    self.assertLessEqual(server.max_outstanding, 4)
+        finally:
+            server.terminate().join()
+
+    def test_journal_survives_restart(self):
+        journal_directory = tempfile.mkdtemp()
+        device = self.certificates.device('journaled')
+        conn = NGTTConnection(*device, lambda order: None, host='localhost', port=1,
+                              ca_file=self.certificates.ca_file,
+                              journal_directory=journal_directory)
+        conn.sync_pathpoints([{'path': 'W1', 'values': [{'timestamp': 0, 'value': 0}]}])
+        conn.stream_logs([{'service': 'test', 'content': 'offline'}])
+        conn.stop()
+
+        received = self.server.received.copy()
+        conn = NGTTConnection(*device, lambda order: None, journal_directory=journal_directory,
+                              **self.endpoint)
+        try:
+            conn.sync_pathpoints([]).result(timeout=10)
+            self.assertEqual(self.server.received[NGTTHeaderType.DATA_STREAM] -
+                             received[NGTTHeaderType.DATA_STREAM], 2)
+            self.assertEqual(self.server.received[NGTTHeaderType.LOGS] -
+                             received[NGTTHeaderType.LOGS], 1)
+        finally:
+            conn.stop()
+
+    def test_budget(self):
+        budget = MemoryBudget(1000, FAIL)
+        conn = NGTTConnection(*self.certificates.device('budget'), lambda order: None,
+                              host='localhost', port=1, ca_file=self.certificates.ca_file,
+                              journal_directory=tempfile.mkdtemp(), budget=budget)
+        entry = [{'path': 'W1', 'values': [{'timestamp': 0, 'value': 'x' * 200}]}]
+        futures = [conn.sync_pathpoints(entry) for _ in range(10)]
+        self.assertRaises(Overloaded, futures[-1].result, timeout=1)
+        self.assertFalse(futures[0].done())
+        for _ in range(100):
+            conn.stream_logs([{'service': 'test', 'content': 'x' * 100}])
+        deadline = time.monotonic() + 10
+        while budget.logs_dropped < 90 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertGreaterEqual(budget.logs_dropped, 90)
+        self.assertLessEqual(budget.peak, 1000)
+        conn.stop()
+        self.assertEqual(budget.used, 0)
+
+    def test_budget_spills_to_the_journal(self):
+        server = NGTTTestServer(self.certificates)
+        server.confirm_delay = 0.02
+        budget = MemoryBudget(1000, SPILL)
+        conn = NGTTConnection(*self.certificates.device('spilled'), lambda order: None,
+                              host='localhost', port=server.port,
+                              ca_file=self.certificates.ca_file, window=1,
+                              journal_directory=tempfile.mkdtemp(), budget=budget)
+        try:
+            futures = [conn.sync_pathpoints([{'path': 'W1', 'values': [
+                {'timestamp': i, 'value': 'x' * 200}]}]) for i in range(20)]
+            for fut in futures:
+                fut.result(timeout=10)
+            self.assertGreater(budget.spilled, 0)
+            self.assertEqual(budget.used, 0)
+            self.assertEqual(server.pathpoint_entries, 20)
+        finally:
+            conn.stop()
+            server.terminate().join()
+
+    def test_logs_are_batched(self):
+        conn = NGTTConnection(*self.certificates.device('logs'), lambda order: None,
+                              log_batcher=LogBatcher(max_latency=0.05), **self.endpoint)
+        try:
+            conn.sync_pathpoints([]).result(timeout=10)
+            received = self.server.received.copy()
+            log_entries = self.server.log_entries
+            for i in range(200):
+                conn.stream_logs([{'service': 'test', 'content': str(i)}])
+            deadline = time.monotonic() + 10
+            while self.server.log_entries - log_entries < 200 and \
+                    time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(self.server.log_entries - log_entries, 200)
+            self.assertLess(self.server.received[NGTTHeaderType.LOGS] -
+                            received[NGTTHeaderType.LOGS], 20)
+        finally:
+            conn.stop()
+
+    def test_batched_logs_must_be_a_list(self):
+        metrics = Metrics()
+        conn = NGTTConnection(*self.certificates.device('logs-checked'), lambda order: None,
+                              log_batcher=LogBatcher(max_latency=0.05), metrics=metrics,
+                              **self.endpoint)
+        try:
+            conn.sync_pathpoints([]).result(timeout=10)
+            log_entries = self.server.log_entries
+            self.assertRaises(ValueError, conn.stream_logs, {'service': 'test'})
+            conn.stream_logs([{'service': 'test', 'content': 'valid'}])
+            deadline = time.monotonic() + 10
+            while self.server.log_entries == log_entries and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(self.server.log_entries - log_entries, 1)
+            self.assertEqual(metrics.connects, 1)
+        finally:
+            conn.stop()
+
+    def test_pathpoints_are_coalesced(self):
+        conn = NGTTConnection(*self.certificates.device('coalesced'), lambda order: None,
+                              pathpoint_coalescer=PathpointCoalescer(max_latency=0.05),
+                              **self.endpoint)
+        try:
+            conn.sync_pathpoints([]).result(timeout=10)
+            received = self.server.received.copy()
+            futures = [conn.sync_pathpoints([{'path': 'W%s' % (i % 3, ), 'values': [
+                {'timestamp': i, 'value': i}]}]) for i in range(300)]
+            for fut in futures:
+                fut.result(timeout=10)
+            self.assertLess(self.server.received[NGTTHeaderType.DATA_STREAM] -
+                            received[NGTTHeaderType.DATA_STREAM], 30)
+            self.assertRaises(ValueError, conn.sync_pathpoints, [{'path': 'W1'}])
+        finally:
+            conn.stop()
+
+    def test_pathpoints_are_streamed(self):
+        server = NGTTTestServer(self.certificates)
+        conn = NGTTConnection(*self.certificates.device('streamed'), lambda order: None,
+                              host='localhost', port=server.port,
+                              ca_file=self.certificates.ca_file,
+                              compression=Compression(threshold=16))
+
+        class Backlog:
+            def __iter__(self):
+                for i in range(20000):
+                    yield {'path': 'W1', 'values': [{'timestamp': i, 'value': 'x' * 50}]}
+
+        try:
+            conn.sync_pathpoints(Backlog()).result(timeout=10)
+            conn.sync_pathpoints(entry for entry in Backlog()).result(timeout=10)
+            self.assertEqual(server.pathpoint_entries, 40000)
+        finally:
+            conn.stop()
+            server.terminate().join()
+
+    def test_stream_of_wrong_length_fails_only_its_operation(self):
+        server = NGTTTestServer(self.certificates)
+        metrics = Metrics()
+        conn = NGTTConnection(*self.certificates.device('wrong-length'), lambda order: None,
+                              host='localhost', port=server.port,
+                              ca_file=self.certificates.ca_file, metrics=metrics)
+
+        class Shrinking:
+            passes = 0
+
+            def __iter__(self):
+                self.passes += 1
+                for i in range(1000 // self.passes):
+                    yield {'path': 'W1', 'values': [{'timestamp': i, 'value': 'x' * 50}]}
+
+        try:
+            conn.sync_pathpoints([]).result(timeout=10)
+            self.assertRaises(StreamedPayloadFailed,
+                              conn.sync_pathpoints(Shrinking()).result, timeout=10)
+            conn.sync_pathpoints([]).result(timeout=10)
+            self.assertEqual(len(conn.currently_running_ops), 0)
+            self.assertEqual(metrics.connects, 2)
+        finally:
+            conn.stop()
+            server.terminate().join()
+
+    def test_compression(self):
+        server = NGTTTestServer(self.certificates)
+        server.compression = Compression(threshold=16)
+        order_received = threading.Event()
+        conn = NGTTConnection(*self.certificates.device('compressed'),
+                              lambda order: order_received.set(), host='localhost',
+                              port=server.port, ca_file=self.certificates.ca_file,
+                              compression=Compression(threshold=16))
+        try:
+            conn.sync_pathpoints([{'path': 'W1', 'values': [
+                {'timestamp': i, 'value': i} for i in range(1000)]}]).result(timeout=10)
+            conn.stream_logs([{'service': 'test', 'content': 'compressed'}] * 100)
+            self.assertEqual(conn.sync_baobs({}).result(timeout=10),
+                             {'download': [], 'upload': []})
+            server.send_order({'uuid': 'compressed', 'data': ['x'] * 100})
+            self.assertTrue(order_received.wait(10))
+            self.assertEqual(server.log_entries, 100)
+        finally:
+            conn.stop()
+            server.terminate().join()
+
+    def test_stop_fails_pending_operations(self):
+        conn = NGTTConnection(*self.certificates.device('stopped'), lambda order: None,
+                              host='localhost', port=1, ca_file=self.certificates.ca_file)
+        fut = conn.sync_pathpoints([])
+        conn.stop()
+        self.assertRaises(ConnectionFailed, fut.result, timeout=10)
+        self.assertRaises(ConnectionFailed, conn.sync_pathpoints([], block=True).result,
+                          timeout=10)
+
+    def test_stop_is_prompt_while_resolving(self):
+        resolving = threading.Event()
+
+        def getaddrinfo(*args, **kwargs):
+            resolving.set()
+            time.sleep(2)
+            raise OSError()
+
+        with mock.patch('socket.getaddrinfo', side_effect=getaddrinfo):
+            conn = NGTTConnection(*self.certificates.device('unresolvable'),
+                                  lambda order: None, host='unresolvable.invalid',
+                                  ca_file=self.certificates.ca_file)
+            self.assertTrue(resolving.wait(10))
+            started_at = time.monotonic()
+            conn.stop()
+            self.assertLess(time.monotonic() - started_at, 1)
+
+    def test_gateway(self):
+        gateway = NGTTGateway(threads=2)
+        try:
+            devices = [gateway.add_device(*self.certificates.device('gateway-%s' % (i,)),
+                                          lambda order: None, **self.endpoint)
+                       for i in range(10)]
+            self.assertEqual(len(gateway), 10)
+            for fut in [device.sync_pathpoints([]) for device in devices]:
+                fut.result(timeout=10)
+        finally:
+            gateway.stop()
+
+    def test_gateway_does_not_block_on_connecting(self):
+        # a server that accepts TCP connections, but never completes the TLS handshake
+        blackhole = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        blackhole.bind(('127.0.0.1', 0))
+        blackhole.listen(16)
+        gateway = NGTTGateway(threads=1)
+        try:
+            stuck = gateway.add_device(*self.certificates.device('blackholed'),
+                                       lambda order: None, host='localhost',
+                                       port=blackhole.getsockname()[1],
+                                       ca_file=self.certificates.ca_file)
+            stuck.sync_pathpoints([])
+            time.sleep(0.2)
+            device = gateway.add_device(*self.certificates.device('healthy'),
+                                        lambda order: None, **self.endpoint)
+            started_at = time.monotonic()
+            device.sync_pathpoints([]).result(timeout=10)
+            self.assertLess(time.monotonic() - started_at, 2)
+            self.assertFalse(stuck.connected)
+        finally:
+            gateway.stop()
+            blackhole.close()